@@ -0,0 +1,191 @@
+import os
+import sys
+import argparse
+import json
+import time
+import random
+import tracemalloc
+import numpy as np
+from sklearn.cluster import KMeans
+
+from src import pipeline
+from src import live_edge
+from src import accumulators
+from src import create_weights
+from src import synthetic
+from src import metrics
+
+OUTPUT_PATH = 'monoplex/output'
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+WEIGHT_SCHEMES = {
+    'uniform': create_weights.w_uniform,
+    'weighted': create_weights.w_weighted,
+    'random': create_weights.w_random,
+    'trivalency': create_weights.w_trivalency,
+}
+# Largest graph each stage runs on by default: networkx stages keep Python objects for every
+# edge, reachability counts into a dense n x n matrix and normalization holds two of them
+STAGE_LIMITS = {
+    'networkx': 100_000,
+    'reachability': 20_000,
+    'normalization': 10_000,
+}
+# Stages faster than this are too noisy to flag
+MIN_SECONDS = 0.01
+MIN_MB = 1.0
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--graphs', default=','.join(synthetic.GRAPHS), help='comma-separated synthetic graph kinds')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES), help='comma-separated node counts')
+    parser.add_argument('--degree', type=int, default=10, help='mean out-degree of the synthetic graphs')
+    parser.add_argument('--type', default='weighted', choices=['weighted', 'uniform'], help='weights of the array stages')
+    parser.add_argument('--worlds', type=int, default=16, help='live-edge worlds per sampling and reachability stage')
+    parser.add_argument('--seeds', type=int, default=100, help='seeds of the networkx activation stage')
+    parser.add_argument('--reach', default='forest')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--limits', default='', help='stage limits to override, such as networkx=10000,reachability=50000')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced run that records allocation peaks')
+    parser.add_argument('--output', default=f'{OUTPUT_PATH}/benchmark.json')
+    parser.add_argument('--baseline', help='results of an earlier run to flag regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown or memory growth as a fraction')
+    return parser.parse_args()
+
+# Timing and memory
+# A stage runs repeats times untraced, keeping the median time, and once more under
+# tracemalloc for its allocation peak, which numpy arrays and networkx objects both report to.
+def measure(function, args, repeats, memory=True):
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start_time)
+
+    measurement = {'seconds': float(np.median(times)), 'min_seconds': float(min(times))}
+    if memory:
+        tracemalloc.start()
+        function(*args)
+        measurement['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result, measurement
+
+def run_stage(stages, name, n_nodes, limit, function, args, options):
+    if limit is not None and n_nodes > options.stage_limits[limit]:
+        return None
+    try:
+        result, stages[name] = measure(function, args, options.repeats, not options.no_memory)
+    except ValueError as error:
+        # trivalency weights do not exist once an in-degree passes 1000
+        stages[name] = {'skipped': str(error)}
+        return None
+    print(f"{name:>20}: {stages[name].get('seconds', 0):.4f} s")
+    return result
+
+def activation(live_edge_graph, seeds):
+    return [pipeline.get_activated_nodes(live_edge_graph, seed) for seed in seeds]
+
+def reachability(parents, reach, n_nodes):
+    counts = accumulators.create('dense', n_nodes, len(parents))
+    live_edge.count_batch(parents, reach, counts)
+    return counts.result()
+
+def clustering(IA, n_clusters):
+    return KMeans(n_clusters=n_clusters, random_state=1, n_init='auto').fit_predict(IA)
+
+# Stages of the networkx pipeline run up to their limits; the array stages start from weights
+# computed on the edge array and run on every size
+def benchmark_graph(kind, n_nodes, options):
+    print(f"Benchmark {kind} with {n_nodes} nodes")
+    stages = {}
+    edges, labels = run_stage(stages, 'generate', n_nodes, None, synthetic.generate,
+                              (kind, n_nodes, options.degree, options.seed), options)
+
+    graph = run_stage(stages, 'networkx_graph', n_nodes, 'networkx', synthetic.to_networkx, (n_nodes, edges), options)
+    if graph is not None:
+        random.seed(options.seed)
+        for scheme, assign in WEIGHT_SCHEMES.items():
+            run_stage(stages, f'weights_{scheme}', n_nodes, 'networkx', assign, (graph,), options)
+        WEIGHT_SCHEMES[options.type](graph)
+        run_stage(stages, 'in_edge_arrays', n_nodes, 'networkx', live_edge.in_edge_arrays, (graph,), options)
+        live_edge_graph = run_stage(stages, 'live_edge_graph', n_nodes, 'networkx', pipeline.create_live_edge_graph,
+                                    (graph,), options)
+        seeds = np.random.default_rng(options.seed).choice(n_nodes, min(options.seeds, n_nodes), replace=False)
+        run_stage(stages, 'activation', n_nodes, 'networkx', activation, (live_edge_graph, seeds.tolist()), options)
+        del graph, live_edge_graph
+
+    weights = synthetic.scheme_weights(n_nodes, edges, options.type)
+    arrays = run_stage(stages, 'edge_arrays', n_nodes, None, live_edge.edge_arrays,
+                       (n_nodes, edges[:, 0], edges[:, 1], weights), options)
+    rng = np.random.default_rng(options.seed)
+    parents = run_stage(stages, 'sampling', n_nodes, None, live_edge.sample_parents, (arrays, options.worlds, rng), options)
+    counts = run_stage(stages, 'reachability', n_nodes, 'reachability', reachability,
+                       (parents, options.reach, n_nodes), options)
+    del arrays, parents
+
+    if counts is not None and n_nodes <= options.stage_limits['normalization']:
+        IA = accumulators.probabilities(counts, options.worlds)
+        normalized = run_stage(stages, 'normalization', n_nodes, 'normalization', pipeline.normalize_offdiag, (IA,), options)
+        n_clusters = synthetic.PLANTED_CLUSTERS if labels is not None else 4
+        run_stage(stages, 'kmeans', n_nodes, 'normalization', clustering, (normalized, n_clusters), options)
+
+    return {'n_nodes': n_nodes, 'n_edges': len(edges), 'stages': stages}
+
+# Regressions
+# A stage regresses when its median time or allocation peak grows by more than the tolerance
+# over the baseline's, ignoring stages too short or too small to measure reliably.
+def compare(results, baseline, tolerance):
+    regressions = []
+    for kind, sizes in results.items():
+        for size, result in sizes.items():
+            baseline_stages = baseline.get(kind, {}).get(size, {}).get('stages', {})
+            for stage, measurement in result['stages'].items():
+                previous = baseline_stages.get(stage, {})
+                for metric, floor in (('seconds', MIN_SECONDS), ('peak_mb', MIN_MB)):
+                    if metric not in measurement or metric not in previous:
+                        continue
+                    current, before = measurement[metric], previous[metric]
+                    if current > before * (1 + tolerance) and current - before > floor:
+                        regressions.append({
+                            'graph': kind, 'n_nodes': int(size), 'stage': stage, 'metric': metric,
+                            'baseline': before, 'current': current, 'ratio': current / max(before, 1e-12),
+                        })
+    return regressions
+
+def stage_limits(overrides):
+    limits = dict(STAGE_LIMITS)
+    for override in filter(None, overrides.split(',')):
+        stage, _, value = override.partition('=')
+        if stage not in limits:
+            raise ValueError(f"Unknown benchmark stage limit: {stage}!")
+        limits[stage] = int(value)
+    return limits
+
+def main():
+    args = parse_args()
+    args.stage_limits = stage_limits(args.limits)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = {}
+    for kind in args.graphs.split(','):
+        results[kind] = {str(n_nodes): benchmark_graph(kind, n_nodes, args) for n_nodes in sizes}
+
+    own, _ = metrics.peak_rss()
+    report = {'arguments': vars(args), 'peak_rss_mb': own, 'results': results}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        report['regressions'] = compare(results, baseline['results'], args.tolerance)
+        for regression in report['regressions']:
+            print(f"Regression: {regression['graph']} {regression['n_nodes']} {regression['stage']} {regression['metric']} "
+                  f"{regression['baseline']:.4f} -> {regression['current']:.4f} (x{regression['ratio']:.2f})")
+        print(f"{len(report['regressions'])} regressions against {args.baseline}")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=4)
+
+    if report.get('regressions'):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import os
+import sys
+import argparse
+import json
+import time
+import random
+import numpy as np
+import networkx as nx
+from scipy.sparse import issparse
+from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+
+from src import pipeline
+from src import utils
+from src import synthetic
+from src import stability
+from src.path_series import CONFIDENCE_Z
+
+OUTPUT_PATH = 'monoplex/output'
+CONFIDENCE = 0.99
+ARI_SLACK = 0.1
+# Engines checked against the networkx reference on live-edge types; each entry holds the
+# options of pipeline.live_edge_simulation
+ENGINES = {
+    'array': {},
+    'array_bitset': {'reach': 'bitset'},
+    'array_bfs': {'reach': 'bfs'},
+    'array_scc': {'reach': 'scc'},
+    'array_sobol': {'sampling': 'sobol'},
+    'reduce': {'reduce': True},
+    'components': {'decompose': True},
+    'series': {'engine': 'series', 'series_check': 0},
+    'sketch': {'engine': 'sketch'},
+}
+# Engines checked against ndlib_simulation on the ndlib type
+THRESHOLD_ENGINES = {
+    'threshold': {'model': 'threshold'},
+}
+# Exact engines have no Monte Carlo error of their own and the series engine is only exact on
+# acyclic graphs, so it joins the default engines there; sketch engines return features
+# instead of IA and are only compared by their clustering
+EXACT_ENGINES = ['series']
+FEATURE_ENGINES = ['sketch']
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--graph', default='sbm', help='synthetic graph kind or dataset name')
+    parser.add_argument('--nodes', type=int, default=300, help='nodes of a synthetic graph')
+    parser.add_argument('--degree', type=int, default=5, help='mean out-degree of a synthetic graph')
+    parser.add_argument('--type', default='weighted')  # options: random, uniform, weighted, trivalency, ndlib
+    parser.add_argument('--engines', help='comma-separated engines to check, all of the type by default')
+    parser.add_argument('--simulations', type=int, default=2_000)
+    parser.add_argument('--reference-simulations', type=int, help='simulations of the reference engine, --simulations by default')
+    parser.add_argument('--clusters', type=int, default=synthetic.PLANTED_CLUSTERS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--tolerance', type=float, default=0.01, help='allowed shortfall of entries inside the confidence interval')
+    parser.add_argument('--min-ari', type=float, default=0.7, help='lowest ARI against the reference clustering')
+    return parser.parse_args()
+
+def load_graph(args):
+    if args.graph not in synthetic.GRAPHS:
+        return utils.load_graph(args.graph), None
+    edges, labels = synthetic.generate(args.graph, args.nodes, args.degree, args.seed)
+    return synthetic.to_networkx(args.nodes, edges), labels
+
+# Both reference simulators draw from the random module; ndlib splits its simulations evenly
+# over its processes
+def reference_simulation(graph, n_simulations, type, seed, n_workers):
+    random.seed(seed)
+    if type == 'ndlib':
+        return pipeline.ndlib_simulation(n_simulations, graph, n_workers)
+    return pipeline.networkx_live_edge_simulation(n_simulations, graph)
+
+def simulate(graph, n_simulations, options, seed, n_workers):
+    start_time = time.time()
+    IA, _ = pipeline.live_edge_simulation(n_simulations, graph, seed=seed, n_workers=n_workers, **options)
+    return IA, time.time() - start_time
+
+# Entry-wise agreement
+# Where two engines estimate the same IA, an off-diagonal entry differs by less than CONFIDENCE_Z
+# pooled standard errors, plus one world of slack per estimate, in about CONFIDENCE of the
+# entries. An exact IA adds neither variance nor slack of its own.
+def agreement(IA, reference, n_simulations, n_reference):
+    offdiag = ~np.eye(len(IA), dtype=bool)
+    estimate, expected = IA[offdiag], reference[offdiag]
+    difference = estimate - expected
+    if n_simulations is None:
+        variance = expected * (1 - expected) / n_reference
+        slack = 1 / n_reference
+    else:
+        pooled = (estimate * n_simulations + expected * n_reference) / (n_simulations + n_reference)
+        variance = pooled * (1 - pooled) * (1 / n_simulations + 1 / n_reference)
+        slack = 1 / n_simulations + 1 / n_reference
+    margin = CONFIDENCE_Z * np.sqrt(variance) + slack
+
+    return {
+        'max_error': float(np.abs(difference).max()),
+        'mean_error': float(np.abs(difference).mean()),
+        'bias': float(difference.mean()),
+        'within_confidence': float((np.abs(difference) <= margin).mean()),
+    }
+
+def labels(IA, n_clusters, normalization='offdiag'):
+    return stability.cluster_labels(pipeline.clustering(n_clusters, IA, normalization), IA.shape[0])
+
+def clustering_agreement(engine_labels, reference_labels, planted=None):
+    result = {
+        'ari': float(adjusted_rand_score(reference_labels, engine_labels)),
+        'nmi': float(normalized_mutual_info_score(reference_labels, engine_labels)),
+    }
+    if planted is not None:
+        result['planted_ari'] = float(adjusted_rand_score(planted, engine_labels))
+    return result
+
+def throughput(n_simulations, seconds, n_nodes):
+    if n_simulations is None or not seconds:
+        return {'seconds': seconds}
+    return {
+        'seconds': seconds,
+        'worlds_per_second': n_simulations / seconds,
+        'seeds_per_second': n_simulations * n_nodes / seconds,
+    }
+
+# Every engine runs on the same graph and weights and is compared with the reference engine.
+# A second reference run on another seed shows how far two correct estimates already differ,
+# in the confidence interval share as well as in the clustering, where KMeans already moves
+# some nodes between two estimates of one IA.
+def main():
+    args = parse_args()
+    n_reference = args.reference_simulations or args.simulations
+    graph, planted = load_graph(args)
+    n_nodes = len(graph.nodes())
+    if args.type != 'ndlib':
+        graph, _ = pipeline.assign_weights(graph, args.type, args.seed)
+
+    engines = THRESHOLD_ENGINES if args.type == 'ndlib' else ENGINES
+    if not args.engines and not nx.is_directed_acyclic_graph(graph):
+        engines = {name: options for name, options in engines.items() if name not in EXACT_ENGINES}
+    if args.engines:
+        unknown = set(args.engines.split(',')) - set(engines)
+        if unknown:
+            raise ValueError(f"Unknown engines for type {args.type}: {', '.join(sorted(unknown))}!")
+        engines = {name: engines[name] for name in args.engines.split(',')}
+
+    runs = {}
+    for name, seed in (('reference', args.seed), ('reference_repeat', args.seed + 1)):
+        print(f"Engine {name}")
+        IA, time_per_simulation = reference_simulation(graph, n_reference, args.type, seed, args.workers)
+        runs[name] = (IA, n_reference, time_per_simulation * n_reference, 'offdiag')
+    for name, options in engines.items():
+        print(f"Engine {name}")
+        IA, seconds = simulate(graph, args.simulations, options, args.seed, args.workers)
+        n_simulations = None if name in EXACT_ENGINES else args.simulations
+        runs[name] = (IA, n_simulations, seconds, 'rows' if name in FEATURE_ENGINES else 'offdiag')
+
+    reference = runs['reference'][0]
+    reference_labels = labels(reference, args.clusters)
+    results = {}
+    for name, (IA, n_simulations, seconds, normalization) in runs.items():
+        results[name] = {'throughput': throughput(n_simulations, seconds, n_nodes)}
+        if name == 'reference':
+            continue
+        results[name].update(clustering_agreement(labels(IA, args.clusters, normalization), reference_labels, planted))
+        if name not in FEATURE_ENGINES:
+            IA = IA.toarray() if issparse(IA) else np.asarray(IA)
+            results[name].update(agreement(IA, reference, n_simulations, n_reference))
+
+    # a graph without stable clusters cannot ask more of an engine than of the reference itself
+    min_ari = min(args.min_ari, results['reference_repeat']['ari'] - ARI_SLACK)
+    for name in engines:
+        result = results[name]
+        result['passed'] = bool(result['ari'] >= min_ari and result.get('within_confidence', 1.0) >= CONFIDENCE - args.tolerance)
+
+    for name, result in results.items():
+        line = f"{name:>16}: {result['throughput']['seconds']:.2f} s"
+        if 'worlds_per_second' in result['throughput']:
+            line += f", {result['throughput']['worlds_per_second']:.4g} worlds/s"
+        if 'within_confidence' in result:
+            line += f", {result['within_confidence']:.2%} inside the {CONFIDENCE:.0%} interval, max error {result['max_error']:.4f}"
+        if 'ari' in result:
+            line += f", ARI {result['ari']:.3f}, NMI {result['nmi']:.3f}"
+        if 'passed' in result:
+            line += ', passed' if result['passed'] else ', FAILED'
+        print(line)
+
+    os.makedirs(OUTPUT_PATH, exist_ok=True)
+    with open(f'{OUTPUT_PATH}/equivalence_{args.graph}_{args.type}_{args.simulations}.json', 'w') as file:
+        json.dump({'arguments': vars(args), 'n_nodes': n_nodes, 'confidence': CONFIDENCE, 'min_ari': min_ari,
+                   'results': results}, file, indent=4)
+
+    if not all(result.get('passed', True) for result in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+from scipy.sparse import coo_matrix, csr_matrix, issparse, save_npz, load_npz
+
+from src import metrics
+
+SPARSE_BUFFER_SIZE = 1 << 22
+TILE_SIZE = 1 << 24
+
+def count_dtype(n_simulations):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_simulations <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+# Raw per-(node, seed) counts of a run. Kernels only call add_pairs and add_columns, so
+# the same kernels fill a dense matrix, a shared-memory buffer or a sparse matrix.
+class DenseCounts:
+    def __init__(self, counts):
+        self.counts = counts
+
+    @classmethod
+    def zeros(cls, n_nodes, n_simulations):
+        return cls(np.zeros((n_nodes, n_nodes), dtype=count_dtype(n_simulations)))
+
+    @metrics.timed('accumulation')
+    def add_pairs(self, nodes, seeds):
+        self.counts[nodes, seeds] += 1
+
+    @metrics.timed('accumulation')
+    def add_columns(self, seeds, counts):
+        self.counts[:, seeds] += counts.astype(self.counts.dtype, copy=False)
+
+    @metrics.timed('accumulation')
+    def add(self, counts):
+        if issparse(counts):
+            counts = counts.tocoo()
+            np.add.at(self.counts, (counts.row, counts.col), counts.data.astype(self.counts.dtype))
+        else:
+            self.counts += counts.astype(self.counts.dtype, copy=False)
+
+    def result(self):
+        return self.counts
+
+# Pairs are buffered as COO batches and merged into a CSR matrix once the buffer is full,
+# for graphs where reach sets are small and most IA entries stay zero.
+class SparseCounts:
+    def __init__(self, n_nodes, n_simulations, buffer_size=SPARSE_BUFFER_SIZE):
+        self.shape = (n_nodes, n_nodes)
+        self.dtype = np.int32 if n_simulations <= np.iinfo(np.int32).max else np.int64
+        self.matrix = csr_matrix(self.shape, dtype=self.dtype)
+        self.buffer_size = buffer_size
+        self.rows, self.cols, self.values = [], [], []
+        self.buffered = 0
+
+    @metrics.timed('accumulation')
+    def add_pairs(self, nodes, seeds):
+        self.buffer(nodes, seeds, np.ones(len(nodes), dtype=self.dtype))
+
+    @metrics.timed('accumulation')
+    def add_columns(self, seeds, counts):
+        rows, columns = np.nonzero(counts)
+        self.buffer(rows, seeds[columns], counts[rows, columns].astype(self.dtype))
+
+    @metrics.timed('accumulation')
+    def add(self, counts):
+        counts = coo_matrix(counts)
+        self.buffer(counts.row, counts.col, counts.data.astype(self.dtype))
+
+    def buffer(self, rows, cols, values):
+        self.rows.append(rows)
+        self.cols.append(cols)
+        self.values.append(values)
+        self.buffered += len(rows)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    @metrics.timed('accumulation')
+    def flush(self):
+        if not self.buffered:
+            return
+        batch = coo_matrix(
+            (np.concatenate(self.values), (np.concatenate(self.rows), np.concatenate(self.cols))),
+            shape=self.shape,
+        ).tocsr()
+        self.matrix = self.matrix + batch
+        self.rows, self.cols, self.values = [], [], []
+        self.buffered = 0
+
+    def result(self):
+        self.flush()
+        return self.matrix
+
+# Counts live in a .npy file on disk for graphs whose IA does not fit in memory. Pairs are
+# buffered and merged into counts per cell, and only those cells are updated, in file order.
+# The final file holds float counts that are divided in place into IA.
+class MemmapCounts:
+    def __init__(self, path, n_nodes, dtype=float, buffer_size=SPARSE_BUFFER_SIZE):
+        self.counts = open_memmap(path, mode='w+', dtype=dtype, shape=(n_nodes, n_nodes))
+        self.tile_rows = tile_rows(n_nodes)
+        self.buffer_size = buffer_size
+        self.rows, self.cols = [], []
+        self.buffered = 0
+
+    @metrics.timed('accumulation')
+    def add_pairs(self, nodes, seeds):
+        self.rows.append(nodes)
+        self.cols.append(seeds)
+        self.buffered += len(nodes)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    @metrics.timed('accumulation')
+    def add_columns(self, seeds, counts):
+        for first, last in tiles(self.counts.shape[0], self.tile_rows):
+            self.counts[first:last, seeds] += counts[first:last].astype(self.counts.dtype, copy=False)
+
+    @metrics.timed('accumulation')
+    def add(self, counts):
+        if issparse(counts):
+            counts = csr_matrix(counts)
+        for first, last in tiles(self.counts.shape[0], self.tile_rows):
+            tile = counts[first:last]
+            self.counts[first:last] += tile.toarray() if issparse(tile) else tile.astype(self.counts.dtype, copy=False)
+
+    @metrics.timed('accumulation')
+    def flush(self):
+        if not self.buffered:
+            return
+        n_nodes = self.counts.shape[0]
+        keys = np.concatenate(self.rows).astype(np.int64) * n_nodes + np.concatenate(self.cols)
+        self.rows, self.cols = [], []
+        self.buffered = 0
+
+        # only the touched cells are read and written, in file order
+        cells, counts = np.unique(keys, return_counts=True)
+        flat = self.counts.reshape(-1)
+        flat[cells] += counts.astype(flat.dtype, copy=False)
+
+    def result(self):
+        self.flush()
+        self.counts.flush()
+        return self.counts
+
+def tile_rows(n_nodes, tile_size=TILE_SIZE):
+    return max(1, tile_size // max(n_nodes, 1))
+
+def tiles(n_rows, rows):
+    return [(first, min(first + rows, n_rows)) for first in range(0, n_rows, rows)]
+
+def create(kind, n_nodes, n_simulations, path=None):
+    if kind == 'dense':
+        return DenseCounts.zeros(n_nodes, n_simulations)
+    elif kind == 'sparse':
+        return SparseCounts(n_nodes, n_simulations)
+    elif kind == 'memmap':
+        if path is None:
+            raise ValueError('The memmap accumulator needs a file path!')
+        return MemmapCounts(path, n_nodes)
+    raise ValueError(f"Unknown accumulator: {kind}")
+
+# Probabilities are only formed when the result is read
+def probabilities(counts, n_simulations):
+    if issparse(counts):
+        return counts.astype(float) / n_simulations
+    if isinstance(counts, np.memmap):
+        for first, last in tiles(counts.shape[0], tile_rows(counts.shape[0])):
+            counts[first:last] /= n_simulations
+        counts.flush()
+        return counts
+    return counts / n_simulations
+
+def save_counts(path, counts):
+    if issparse(counts):
+        save_npz(f'{path}.npz', csr_matrix(counts))
+    else:
+        np.save(f'{path}.npy', counts)
+
+def load_counts(path):
+    if os.path.exists(f'{path}.npz'):
+        return load_npz(f'{path}.npz')
+    return np.load(f'{path}.npy')
+
+def counts_exist(path):
+    return os.path.exists(f'{path}.npz') or os.path.exists(f'{path}.npy')
+
+# Upcasts a partial result so it can hold n_simulations counts without overflow
+def widen(counts, n_simulations):
+    if issparse(counts):
+        return counts
+    return counts.astype(np.promote_types(counts.dtype, count_dtype(n_simulations)), copy=False)
@@ -0,0 +1,93 @@
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from src import live_edge
+
+EXACT_WORLDS = 4_096
+
+# Weakly connected components
+# IA is zero between weakly connected components, so every component is solved on its own
+# and the blocks form a sparse block-diagonal IA. A component with at most EXACT_WORLDS
+# parent combinations is solved exactly by listing its worlds, larger ones are sampled.
+def weak_components(arrays):
+    n_nodes = len(arrays['indptr']) - 1
+    targets = np.repeat(np.arange(n_nodes), np.diff(arrays['indptr']))
+    links = csr_matrix((np.ones(len(targets)), (arrays['sources'], targets)), shape=(n_nodes, n_nodes))
+    n_components, labels = connected_components(links, directed=True, connection='weak')
+
+    order = np.argsort(labels, kind='stable')
+    return np.split(order, np.cumsum(np.bincount(labels, minlength=n_components))[:-1])
+
+# In-edge arrays of the subgraph on nodes, relabeled to 0..len(nodes) - 1
+def component_arrays(arrays, nodes):
+    index = np.full(len(arrays['indptr']) - 1, -1, dtype=np.int64)
+    index[nodes] = np.arange(len(nodes))
+
+    counts = np.diff(arrays['indptr'])[nodes]
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    positions = live_edge.segments(arrays['indptr'], nodes)
+    weights = arrays['weights'][positions]
+
+    return {
+        'indptr': indptr,
+        'sources': index[arrays['sources'][positions]].astype(np.int32),
+        'weights': weights,
+        'keys': live_edge.cumulative_keys(np.repeat(np.arange(len(nodes)), counts), indptr, weights),
+    }
+
+# Parent options of every node: its in-neighbours and -1 for no parent, with their chances
+def parent_options(arrays):
+    options = []
+    for node in range(len(arrays['indptr']) - 1):
+        edges = slice(arrays['indptr'][node], arrays['indptr'][node + 1])
+        parents = np.append(arrays['sources'][edges], -1)
+        chances = np.append(arrays['weights'][edges], 1.0 - arrays['weights'][edges].sum())
+        options.append((parents[chances > 0], chances[chances > 0]))
+    return options
+
+# Number of worlds of the component, the product of the parent options of its nodes
+def world_count(arrays):
+    with np.errstate(over='ignore'):
+        return float(np.prod(option_counts(arrays), dtype=float))
+
+def option_counts(arrays):
+    n_nodes = len(arrays['indptr']) - 1
+    targets = np.repeat(np.arange(n_nodes), np.diff(arrays['indptr']))
+    positive = np.bincount(targets[arrays['weights'] > 0], minlength=n_nodes)
+    return positive + (np.bincount(targets, arrays['weights'], minlength=n_nodes) < 1.0)
+
+# Every world of the component with its probability
+def all_worlds(options):
+    n_worlds = int(np.prod([len(parents) for parents, _ in options]))
+    rest = np.arange(n_worlds)
+    parents = np.empty((n_worlds, len(options)), dtype=np.int32)
+    chances = np.ones(n_worlds)
+    # world index in mixed radix, one digit per node
+    for node, (node_parents, node_chances) in enumerate(options):
+        choice = rest % len(node_parents)
+        rest = rest // len(node_parents)
+        parents[:, node] = node_parents[choice]
+        chances *= node_chances[choice]
+    return parents, chances
+
+def exact_ia(arrays):
+    n_nodes = len(arrays['indptr']) - 1
+    rows, columns, values = [], [], []
+    parents, chances = all_worlds(parent_options(arrays))
+    for world, chance in zip(parents, chances):
+        for nodes, seeds in live_edge.reach_pairs(world):
+            rows.append(nodes)
+            columns.append(seeds)
+            values.append(np.full(len(nodes), chance))
+    return coo_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))), shape=(n_nodes, n_nodes)).tocsr()
+
+def block_diagonal(parts, blocks, n_nodes):
+    rows, columns, values = [], [], []
+    for nodes, block in zip(parts, blocks):
+        block = coo_matrix(block)
+        rows.append(nodes[block.row])
+        columns.append(nodes[block.col])
+        values.append(block.data.astype(float))
+    return csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))), shape=(n_nodes, n_nodes))
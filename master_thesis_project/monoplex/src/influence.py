@@ -0,0 +1,130 @@
+import heapq
+import numpy as np
+
+from src import live_edge
+
+INFLUENCE_WORLDS = 1_000
+GATHER_SIZE = 1 << 22
+
+# Seed sets
+# A seed set reaches a node in a world when one of its seeds is an ancestor of the node. In
+# the preorder layout of a live-edge forest the nodes a seed reaches are one range, so every
+# world keeps its preorder and the range of every node. Positions covered by the chosen seeds
+# go into one prefix sum per world, and the marginal gain of a candidate is then a difference
+# of two prefix sums per world.
+def sample_forests(arrays, n_worlds, rng, sampling='mc'):
+    return world_forests(np.concatenate(list(live_edge.sample_worlds(arrays, n_worlds, rng, sampling=sampling))))
+
+# Forests of stored parents, also of a memory-mapped world bank
+def world_forests(parents):
+    n_worlds, n_nodes = parents.shape
+    forests = {name: np.empty((n_worlds, n_nodes), dtype=np.int32) for name in ('order', 'start', 'count')}
+    for world in range(n_worlds):
+        order, start, count = live_edge.forest(np.asarray(parents[world]))
+        forests['order'][world], forests['start'][world], forests['count'][world] = order, start, count
+    return forests
+
+def covered_positions(forests, seeds, covered=None):
+    n_worlds, n_nodes = forests['start'].shape
+    marks = np.zeros((n_worlds, n_nodes + 1), dtype=np.int32)
+    worlds = np.arange(n_worlds)
+    for seed in seeds:
+        marks[worlds, forests['start'][:, seed]] += 1
+        marks[worlds, forests['start'][:, seed] + forests['count'][:, seed]] -= 1
+    reached = np.cumsum(marks, axis=1)[:, :-1] > 0
+    return reached if covered is None else covered | reached
+
+# Expected number of nodes the seed set reaches
+def spread(forests, seeds):
+    return covered_positions(forests, seeds).sum() / len(forests['start'])
+
+# Probability that the seed set reaches every node
+def access(forests, seeds):
+    covered = covered_positions(forests, seeds)
+    return np.bincount(forests['order'][covered], minlength=forests['start'].shape[1]) / len(forests['start'])
+
+# Prefix sums of the node values not yet covered, over preorder positions
+def uncovered_prefix(forests, covered, values):
+    prefix = np.zeros((covered.shape[0], covered.shape[1] + 1))
+    np.cumsum(np.where(covered, 0.0, values[forests['order']]), axis=1, out=prefix[:, 1:])
+    return prefix
+
+# Expected gain of every candidate, in chunks so the gathered ranges stay small
+def gains(forests, prefix, candidates):
+    n_worlds = len(prefix)
+    chunk = max(1, GATHER_SIZE // n_worlds)
+    result = np.empty(len(candidates))
+    for first in range(0, len(candidates), chunk):
+        nodes = candidates[first:first + chunk]
+        start = forests['start'][:, nodes]
+        end = start + forests['count'][:, nodes]
+        covered_sum = np.take_along_axis(prefix, end, axis=1) - np.take_along_axis(prefix, start, axis=1)
+        result[first:first + chunk] = covered_sum.sum(axis=0)
+    return result / n_worlds
+
+# Greedy seed selection
+# 'reach' maximizes the spread. It is monotone and submodular, so CELF keeps every candidate's
+# last gain in a max-heap as an upper bound and only re-evaluates the top, which picks the
+# same seeds as the plain greedy. 'balanced' maximizes the lowest mean access over the
+# clusters, with the total gain breaking ties. A minimum is not submodular, so every round
+# evaluates all candidates.
+def maximize(forests, k, objective='reach', labels=None, candidates=None):
+    n_nodes = forests['start'].shape[1]
+    candidates = np.arange(n_nodes) if candidates is None else np.asarray(candidates, dtype=np.int64)
+    if objective == 'reach':
+        return celf(forests, k, candidates)
+    if objective == 'balanced':
+        if labels is None:
+            raise ValueError('The balanced objective needs cluster labels!')
+        return balanced_greedy(forests, k, np.asarray(labels), candidates)
+    raise ValueError(f"Unknown objective: {objective}")
+
+def celf(forests, k, candidates):
+    n_worlds, n_nodes = forests['start'].shape
+    values = np.ones(n_nodes)
+    covered = np.zeros((n_worlds, n_nodes), dtype=bool)
+    prefix = uncovered_prefix(forests, covered, values)
+
+    heap = [(-gain, int(node), 0) for node, gain in zip(candidates, gains(forests, prefix, candidates))]
+    heapq.heapify(heap)
+    seeds, spreads = [], []
+    while heap and len(seeds) < k:
+        gain, node, evaluated = heapq.heappop(heap)
+        if evaluated < len(seeds):
+            heapq.heappush(heap, (-gains(forests, prefix, np.array([node]))[0], node, len(seeds)))
+            continue
+
+        seeds.append(node)
+        spreads.append(float((spreads[-1] if spreads else 0.0) - gain))
+        covered = covered_positions(forests, [node], covered)
+        prefix = uncovered_prefix(forests, covered, values)
+        print(f"Seed {len(seeds)}/{k}: node {node}, spread {spreads[-1]}")
+    return seeds, spreads
+
+def balanced_greedy(forests, k, labels, candidates):
+    n_worlds, n_nodes = forests['start'].shape
+    sizes = np.bincount(labels)
+    covered = np.zeros((n_worlds, n_nodes), dtype=bool)
+    reached = np.zeros(len(sizes))
+
+    seeds, minimum_access = [], []
+    for _ in range(min(k, len(candidates))):
+        cluster_gains = np.stack([
+            gains(forests, uncovered_prefix(forests, covered, (labels == cluster).astype(float)), candidates)
+            for cluster in range(len(sizes))
+        ])
+        worst = ((reached[:, None] + cluster_gains) / np.maximum(sizes, 1)[:, None]).min(axis=0)
+        best = np.lexsort((cluster_gains.sum(axis=0), worst))[-1]
+
+        seeds.append(int(candidates[best]))
+        reached += cluster_gains[:, best]
+        minimum_access.append(float(worst[best]))
+        covered = covered_positions(forests, [seeds[-1]], covered)
+        candidates = np.delete(candidates, best)
+        print(f"Seed {len(seeds)}/{k}: node {seeds[-1]}, lowest cluster access {minimum_access[-1]}")
+    return seeds, minimum_access
+
+# Mean access of every cluster
+def cluster_access(forests, seeds, labels):
+    labels = np.asarray(labels)
+    return np.bincount(labels, weights=access(forests, seeds)) / np.maximum(np.bincount(labels), 1)
@@ -0,0 +1,114 @@
+import time
+import resource
+from contextlib import contextmanager
+from functools import wraps
+
+PROGRESS_INTERVAL = 5.0
+
+# Phase timers
+# Every phase keeps its self time in this process: a phase inside another one, like
+# accumulation inside reachability, only counts for the inner phase, so the phases of a run
+# add up to at most its wall time. Pool workers start from empty timers and hand theirs back
+# with their result through collect, and the parent merges them.
+timers = {}
+open_phases = []
+# Whether this process started worker processes, whose peak memory then means something
+children = {'started': False}
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    open_phases.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timers[name] = timers.get(name, 0.0) + elapsed - open_phases.pop()
+        if open_phases:
+            open_phases[-1] += elapsed
+
+def timed(name):
+    def decorate(function):
+        @wraps(function)
+        def run(*args, **kwargs):
+            with phase(name):
+                return function(*args, **kwargs)
+        return run
+    return decorate
+
+def reset():
+    timers.clear()
+    open_phases.clear()
+
+def merge(other):
+    for name, seconds in other.items():
+        timers[name] = timers.get(name, 0.0) + seconds
+
+def collect(function, *args):
+    reset()
+    result = function(*args)
+    return result, dict(timers)
+
+def pool_map(pool, function, tasks, **kwargs):
+    children['started'] = True
+    results = []
+    for result, worker_timers in pool.starmap(collect, [(function, *task) for task in tasks], **kwargs):
+        merge(worker_timers)
+        results.append(result)
+    return results
+
+# Peak resident set size of this process and of its largest finished child, in MB. The
+# child peak covers any process this one waited for, so it is only reported after a run
+# that started its own.
+def peak_rss():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+def summary(time_per_simulation=None, n_nodes=None):
+    own, child = peak_rss()
+    result = {
+        'phases': {name: seconds for name, seconds in sorted(timers.items(), key=lambda item: -item[1])},
+        'peak_rss_mb': own,
+    }
+    if children['started']:
+        result['peak_child_rss_mb'] = child
+    if time_per_simulation:
+        result['worlds_per_second'] = 1 / time_per_simulation
+        if n_nodes is not None:
+            # every world answers the cascades of all seeds
+            result['seeds_per_second'] = n_nodes / time_per_simulation
+    return result
+
+def report_lines(summary):
+    lines = ['## Performance\n\n']
+    if 'worlds_per_second' in summary:
+        lines.append(f"Throughput: {summary['worlds_per_second']:.4g} worlds/s")
+        if 'seeds_per_second' in summary:
+            lines[-1] += f", {summary['seeds_per_second']:.4g} seeds/s"
+        lines[-1] += '\n'
+    lines.append(f"Peak RSS: {summary['peak_rss_mb']:.1f} MB")
+    if 'peak_child_rss_mb' in summary:
+        lines[-1] += f", largest child process {summary['peak_child_rss_mb']:.1f} MB"
+    lines[-1] += '\n'
+    if summary['phases']:
+        lines.append('\n| Phase | Seconds |\n|------|-------|\n')
+        lines.extend(f'| {name} | {seconds:.3f} |\n' for name, seconds in summary['phases'].items())
+    return ''.join(lines)
+
+# Progress of a loop, printed at most every PROGRESS_INTERVAL seconds and once at the end,
+# with the rate so far and the time left at that rate
+class Progress:
+    def __init__(self, total, label='Simulation'):
+        self.total = total
+        self.label = label
+        self.start = self.last = time.perf_counter()
+
+    def update(self, done):
+        now = time.perf_counter()
+        if done < self.total and now - self.last < PROGRESS_INTERVAL:
+            return
+        self.last = now
+        rate = done / max(now - self.start, 1e-9)
+        remaining = (self.total - done) / rate if rate else float('inf')
+        print(f"{self.label} {done}/{self.total} ({rate:.3g}/s, ETA {remaining:.0f}s)")
@@ -0,0 +1,205 @@
+import os
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+from src import live_edge
+from src import accumulators
+from src import threshold
+from src import metrics
+
+# Shared memory
+def share(array):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+def attach(spec):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def release(blocks, unlink=False):
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
+
+def split_simulations(n_simulations, n_parts):
+    return [n_simulations // n_parts + (index < n_simulations % n_parts) for index in range(n_parts)]
+
+# Worker pool
+# Worker i draws from the i-th child of the run's SeedSequence, so a run with the same
+# seed and number of workers reproduces bit for bit, and a single worker runs in-process.
+# Dense workers count into their own shared buffer, memmap workers into their own file next
+# to the result, and sparse workers return their matrix. A list of arrays, one per weighting
+# scheme, runs all schemes on common random numbers. With a world bank worker i writes its
+# worlds to its own rows of the bank file. The model picks linear threshold ('lt') or
+# independent cascade ('ic') worlds, or threshold model simulations ('threshold'). Workers send
+# their phase timers back with their counts.
+def count_live_edge_worlds(arrays, n_simulations, seed_sequence, n_workers, reach, accumulator='dense', path=None,
+                           sampling='mc', horizons=None, bank_path=None, model='lt'):
+    schemes = isinstance(arrays, list)
+    if schemes and (horizons is not None or bank_path is not None or model != 'lt'):
+        raise ValueError('Hop-limited IA, world banks and independent cascades do not support several weighting schemes at once!')
+    n_nodes = len((arrays[0] if schemes else arrays)['indptr']) - 1
+    n_slots = len(arrays) if schemes else None if horizons is None else len(horizons)
+    n_workers = max(1, min(n_workers, n_simulations))
+    streams = seed_sequence.spawn(n_workers)
+    worlds = split_simulations(n_simulations, n_workers)
+
+    if n_workers == 1:
+        counts = create_counts(accumulator, n_nodes, worlds[0], path, n_slots)
+        bank = open_bank(bank_path, 0, worlds[0])
+        count_worlds(arrays, worlds[0], np.random.default_rng(streams[0]), reach, counts, sampling, horizons, bank, model)
+        del bank
+        return results(counts)
+
+    blocks = []
+    array_specs = []
+    for scheme_arrays in (arrays if schemes else [arrays]):
+        scheme_specs = {}
+        for name, array in scheme_arrays.items():
+            block, scheme_specs[name] = share(array)
+            blocks.append(block)
+        array_specs.append(scheme_specs)
+    if not schemes:
+        array_specs = array_specs[0]
+
+    count_specs = []
+    for index in range(n_workers):
+        if accumulator == 'dense':
+            shape = (n_nodes, n_nodes) if n_slots is None else (n_slots, n_nodes, n_nodes)
+            block, spec = share(np.zeros(shape, dtype=accumulators.count_dtype(worlds[index])))
+            blocks.append(block)
+            count_specs.append(spec)
+        elif accumulator == 'memmap':
+            count_specs.append(f'{path}.worker{index}')
+        else:
+            count_specs.append(None)
+
+    offsets = np.cumsum([0] + worlds)
+    try:
+        tasks = [
+            (array_specs, count_specs[index], worlds[index], streams[index], reach, accumulator, sampling, horizons, bank_path,
+             offsets[index], model)
+            for index in range(n_workers)
+        ]
+        with mp.Pool(n_workers) as pool:
+            partials = metrics.pool_map(pool, live_edge_worker, tasks)
+
+        counts = create_counts(accumulator, n_nodes, n_simulations, path, n_slots)
+        for spec, result in zip(count_specs, partials):
+            if spec is None:
+                add(counts, result)
+                continue
+            if accumulator == 'memmap':
+                partial = np.load(spec, mmap_mode='r')
+                counts.add(partial)
+                del partial
+                os.remove(spec)
+                continue
+            block, partial = attach(spec)
+            add(counts, partial)
+            del partial
+            release([block])
+    finally:
+        release(blocks, unlink=True)
+
+    return results(counts)
+
+# Components
+# Weakly connected components are independent runs and component i draws from the i-th child
+# of the run's SeedSequence. A component larger than a worker's share of the nodes takes the
+# whole pool, the others run in-process on the workers of one pool, several per worker.
+def count_component_worlds(component_arrays, n_simulations, seed_sequence, n_workers, reach, accumulator='dense',
+                           sampling='mc'):
+    streams = seed_sequence.spawn(len(component_arrays))
+    sizes = np.array([len(arrays['indptr']) - 1 for arrays in component_arrays])
+    large = sizes * n_workers > sizes.sum()
+    counts = [None] * len(component_arrays)
+
+    for index in np.flatnonzero(large):
+        counts[index] = count_live_edge_worlds(
+            component_arrays[index], n_simulations, streams[index], n_workers, reach, accumulator, sampling=sampling
+        )
+
+    small = np.flatnonzero(~large)
+    tasks = [(component_arrays[index], n_simulations, streams[index], 1, reach, accumulator, None, sampling) for index in small]
+    if n_workers == 1 or len(tasks) <= 1:
+        partials = [count_live_edge_worlds(*task) for task in tasks]
+    else:
+        with mp.Pool(min(n_workers, len(tasks))) as pool:
+            partials = metrics.pool_map(pool, count_live_edge_worlds, tasks, chunksize=max(1, len(tasks) // (4 * n_workers)))
+    for index, partial in zip(small, partials):
+        counts[index] = partial
+    return counts
+
+# Rows of the world bank written by one worker
+def open_bank(bank_path, offset, n_worlds):
+    if bank_path is None:
+        return None
+    return np.load(bank_path, mmap_mode='r+')[offset:offset + n_worlds]
+
+# Hop-limited and multi-scheme runs keep one accumulator per horizon or scheme
+def create_counts(accumulator, n_nodes, n_simulations, path=None, n_slots=None):
+    if n_slots is None:
+        return accumulators.create(accumulator, n_nodes, n_simulations, path)
+    if accumulator == 'memmap':
+        raise ValueError('Hop-limited and multi-scheme runs do not support the memmap accumulator!')
+    return [accumulators.create(accumulator, n_nodes, n_simulations) for _ in range(n_slots)]
+
+def count_worlds(arrays, n_worlds, rng, reach, counts, sampling, horizons, bank=None, model='lt'):
+    if isinstance(arrays, list):
+        return live_edge.count_common_worlds(arrays, n_worlds, rng, reach, counts, sampling)
+    if model == 'threshold':
+        return threshold.count_worlds(arrays, n_worlds, rng, counts)
+    return live_edge.count_worlds(arrays, n_worlds, rng, reach, counts, sampling, horizons, bank, model)
+
+def add(counts, partial):
+    if isinstance(counts, list):
+        for horizon_counts, horizon_partial in zip(counts, partial):
+            horizon_counts.add(horizon_partial)
+    else:
+        counts.add(partial)
+
+def results(counts):
+    if isinstance(counts, list):
+        return [horizon_counts.result() for horizon_counts in counts]
+    return counts.result()
+
+def live_edge_worker(array_specs, count_spec, n_worlds, stream, reach, accumulator, sampling, horizons, bank_path=None, offset=0,
+                     model='lt'):
+    blocks = []
+    arrays = []
+    for scheme_specs in (array_specs if isinstance(array_specs, list) else [array_specs]):
+        scheme_arrays = {}
+        for name, spec in scheme_specs.items():
+            block, scheme_arrays[name] = attach(spec)
+            blocks.append(block)
+        arrays.append(scheme_arrays)
+    n_nodes = len(arrays[0]['indptr']) - 1
+    n_slots = len(arrays) if isinstance(array_specs, list) else None if horizons is None else len(horizons)
+    if not isinstance(array_specs, list):
+        arrays = arrays[0]
+
+    if count_spec is None:
+        counts = create_counts(accumulator, n_nodes, n_worlds, n_slots=n_slots)
+    elif accumulator == 'memmap':
+        counts = accumulators.MemmapCounts(count_spec, n_nodes, accumulators.count_dtype(n_worlds))
+    else:
+        block, buffer = attach(count_spec)
+        blocks.append(block)
+        counts = accumulators.DenseCounts(buffer) if n_slots is None else [accumulators.DenseCounts(part) for part in buffer]
+
+    bank = open_bank(bank_path, offset, n_worlds)
+    try:
+        count_worlds(arrays, n_worlds, np.random.default_rng(stream), reach, counts, sampling, horizons, bank, model)
+        result = results(counts)
+        return result if count_spec is None else None
+    finally:
+        del arrays, counts, bank
+        if count_spec is not None and accumulator == 'dense':
+            del buffer
+        release(blocks)
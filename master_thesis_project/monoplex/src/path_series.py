@@ -0,0 +1,67 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from src import live_edge
+
+SERIES_LENGTH = 20
+SERIES_TOLERANCE = 1e-6
+SERIES_CHECK_SIMULATIONS = 1_000
+CONFIDENCE_Z = 2.576
+
+# Truncated path series
+# A node is reached from a seed when its chain of live parents runs into the seed. Summing the
+# weight products of all backward walks that first hit the seed within max_length steps gives
+# H_{k+1} = P H_k with the diagonal reset to 1, where P[v, u] is the weight of u -> v. This is
+# exact on acyclic graphs once max_length covers the longest path. On cycles it also counts
+# walks that revisit a node, which a live parent chain never does, so there it is a biased
+# approximation that overshoots the IA; its entries are clipped to probabilities.
+def weight_matrix(graph):
+    arrays = live_edge.in_edge_arrays(graph)
+    n_nodes = len(arrays['indptr']) - 1
+    targets = np.repeat(np.arange(n_nodes), np.diff(arrays['indptr']))
+    sources = arrays['sources']
+
+    # a self loop keeps a node's own parent and reaches nobody
+    live = sources != targets
+    return csr_matrix((arrays['weights'][live], (targets[live], sources[live])), shape=(n_nodes, n_nodes))
+
+def path_series(P, max_length=SERIES_LENGTH, tolerance=SERIES_TOLERANCE):
+    IA = np.eye(P.shape[0])
+    change = 0.0
+    step = 0
+    for step in range(1, max_length + 1):
+        previous = IA
+        IA = P @ IA
+        np.fill_diagonal(IA, 1.0)
+        change = float(np.abs(IA - previous).max())
+        print(f"Series step {step}/{max_length}, max change {change}")
+        if change <= tolerance:
+            break
+    np.clip(IA, 0.0, 1.0, out=IA)
+    return IA, step, change
+
+# Truncation bound
+# A row of P sums to a node's total in-weight, at most the norm ||P|| of the largest one, so the
+# walks of length j add at most ||P||^j to an entry and the walks a series of k steps leaves
+# out add at most ||P||^(k+1) / (1 - ||P||). This bounds the distance to the untruncated series,
+# not its bias on cycles, and does not exist once some node's in-weights sum to 1.
+def truncation_bound(P, steps):
+    norm = float(abs(P).sum(axis=1).max()) if P.shape[0] else 0.0
+    if norm >= 1:
+        return None
+    return norm ** (steps + 1) / (1 - norm)
+
+# Errors against a Monte Carlo IA, with the share of entries inside its confidence interval
+def monte_carlo_errors(IA, reference, n_simulations):
+    offdiag = ~np.eye(len(IA), dtype=bool)
+    difference = (IA - reference)[offdiag]
+    p = reference[offdiag]
+    margin = CONFIDENCE_Z * np.sqrt(p * (1 - p) / max(n_simulations - 1, 1)) + 1 / n_simulations
+
+    return {
+        'series_check_simulations': n_simulations,
+        'series_max_error': float(np.abs(difference).max()),
+        'series_mean_error': float(np.abs(difference).mean()),
+        'series_bias': float(difference.mean()),
+        'series_within_confidence': float((np.abs(difference) <= margin).mean()),
+    }
@@ -1,41 +1,221 @@
+import os
 import networkx as nx
 import numpy as np
+from numpy.lib.format import open_memmap
+from scipy.sparse import csr_matrix, diags, issparse
 import ndlib.models.ModelConfig as mc
 import ndlib.models.epidemics as ep
 import random
 import multiprocessing as mp
 from collections import deque
 from sklearn.cluster import KMeans
+from sklearn.preprocessing import normalize
 import time
 
 from src import utils
 from src import create_weights
+from src import live_edge
+from src import parallel
+from src import checkpoint
+from src import accumulators
+from src import path_series
+from src import sketches
+from src import reduction
+from src import components
+from src import world_bank
+from src import influence
+from src import blocks
+from src import threshold
+from src import metrics
 
 NUMBER_OF_PROCESSES = 8
-
-def run(dataset, type, n_simulations):
-    graph = utils.load_graph(dataset)
-
+WEIGHT_TYPES = ['weighted', 'random', 'trivalency', 'uniform']
+MODEL_NAMES = {'ic': 'independent cascade', 'threshold': 'threshold model, native engine'}
+# Run features
+# What a live-edge run asks for besides plain sampling, the features each engine supports and the
+# pairs of features that cannot be combined; check_features tests a run against these tables.
+RUN_FEATURES = {
+    'ic': 'the independent cascade model',
+    'threshold': 'the threshold model',
+    'reduce': 'the static reduction',
+    'decompose': 'the component decomposition',
+    'horizons': 'hop horizons',
+    'bank': 'a world bank',
+    'blocks': 'block counts',
+    'chunked': 'checkpointed or adaptive runs',
+    'memmap': 'the memmap accumulator',
+}
+ENGINE_FEATURES = {
+    'array': set(RUN_FEATURES),
+    'networkx': set(),
+    'series': set(),
+    'sketch': set(),
+}
+FEATURE_CONFLICTS = [
+    *[(model, feature) for model in ('ic', 'threshold') for feature in ('reduce', 'decompose', 'horizons', 'bank')],
+    *[('reduce', feature) for feature in ('horizons', 'bank', 'blocks', 'memmap')],
+    *[('decompose', feature) for feature in ('horizons', 'bank', 'blocks', 'chunked', 'memmap')],
+    *[('blocks', feature) for feature in ('horizons', 'bank', 'chunked', 'memmap')],
+    *[('chunked', feature) for feature in ('horizons', 'bank', 'memmap')],
+]
+
+def run(dataset, type, n_simulations, **options):
     if type == "ndlib":
-        IA, time_per_simulation = ndlib_simulation(n_simulations, graph, NUMBER_OF_PROCESSES)
+        graph = utils.load_graph(dataset)
+        if options.get('engine') == 'ndlib':
+            IA, time_per_simulation = ndlib_simulation(n_simulations, graph, NUMBER_OF_PROCESSES)
+        else:
+            IA, time_per_simulation = live_edge_simulation(n_simulations, graph, **{**options, 'model': 'threshold'})
         return IA, time_per_simulation, None
-    
-    if type == 'random':
-        graph = create_weights.w_random(graph)
-    elif type == 'uniform':
-        graph = create_weights.w_uniform(graph)
-    elif type == 'weighted':
-        graph = create_weights.w_weighted(graph)
-    elif type == 'trivalency':
-        graph = create_weights.w_trivalency(graph) 
+
+    graph, average_weight = weighted_graph(dataset, type, options.get('seed'))
+
+    IA, time_per_simulation = live_edge_simulation(n_simulations, graph, **options)
+    return IA, time_per_simulation, average_weight
+
+# IA rows of the targets and/or columns of the seeds, without the full matrix
+def query(dataset, type, n_simulations, targets=None, seeds=None, seed=None):
+    graph, _ = weighted_graph(dataset, type, seed)
+    return query_simulation(n_simulations, graph, targets, seeds, seed)
+
+def query_simulation(n_simulations, graph, targets=None, seeds=None, seed=None):
+    if targets is None and seeds is None:
+        raise ValueError('A query needs target or seed nodes!')
+    # a seed given twice would share or skip an IA column
+    seeds = None if seeds is None else np.unique(seeds)
+
+    arrays = live_edge.in_edge_arrays(graph)
+    rng = np.random.default_rng(np.random.SeedSequence(seed))
+    if targets is not None:
+        counts = live_edge.target_counts(arrays, targets, n_simulations, rng)
+        if seeds is not None:
+            counts = counts[:, seeds]
+    else:
+        counts = live_edge.seed_counts(arrays, seeds, n_simulations, rng)
+
+    return counts / n_simulations
+
+# Runs and queries on the worlds of a world bank. The weights only give the average edge weight
+# of the report, and are drawn with the bank's seed.
+def replay(dataset, type, bank_path, **options):
+    _, manifest = world_bank.load(bank_path)
+    graph, average_weight = weighted_graph(dataset, type, manifest['seed'])
+    if len(graph.nodes()) != manifest['n_nodes']:
+        raise ValueError(f"The world bank has {manifest['n_nodes']} nodes, {dataset} has {len(graph.nodes())}!")
+
+    IA, time_per_simulation = replay_simulation(bank_path, **options)
+    return IA, time_per_simulation, average_weight
+
+def replay_simulation(bank_path, reach='forest', accumulator='dense', memmap_path=None, horizons=None, stats=None):
+    start_time = time.time()
+
+    bank, manifest = world_bank.load(bank_path)
+    n_worlds = manifest['n_worlds']
+    n_slots = None if horizons is None else len(horizons)
+    counts = parallel.create_counts(accumulator, manifest['n_nodes'], n_worlds, memmap_path, n_slots)
+    counts = parallel.results(world_bank.replay_counts(bank, reach, counts, horizons))
+    if stats is not None:
+        stats['replayed_worlds'] = n_worlds
+
+    time_per_simulation = (time.time() - start_time) / n_worlds
+    if horizons is not None:
+        return [accumulators.probabilities(horizon_counts, n_worlds) for horizon_counts in counts], time_per_simulation
+    return accumulators.probabilities(counts, n_worlds), time_per_simulation
+
+def replay_query(bank_path, targets=None, seeds=None):
+    if targets is None and seeds is None:
+        raise ValueError('A query needs target or seed nodes!')
+    # a seed given twice would share or skip an IA column
+    seeds = None if seeds is None else np.unique(seeds)
+
+    bank, manifest = world_bank.load(bank_path)
+    if targets is not None:
+        counts = world_bank.target_counts(bank, targets)
+        if seeds is not None:
+            counts = counts[:, seeds]
+    else:
+        counts = world_bank.seed_counts(bank, seeds)
+
+    return counts / manifest['n_worlds']
+
+# Live-edge forests for seed set spreads and greedy seeds, sampled or from a world bank
+def influence_forests(dataset, type, n_worlds, seed=None, sampling='mc', bank_path=None):
+    if bank_path is not None:
+        return influence.world_forests(world_bank.load(bank_path)[0])
+
+    graph, _ = weighted_graph(dataset, type, seed)
+    rng = np.random.default_rng(np.random.SeedSequence(seed))
+    return influence.sample_forests(live_edge.in_edge_arrays(graph), n_worlds, rng, sampling)
+
+# One slice of a run: shard i of N draws from the i-th child of the run's SeedSequence,
+# exactly like worker i of a single run with N workers, and returns raw counts.
+def run_shard(dataset, type, n_simulations, shard, n_shards, seed, reach='forest', n_workers=1, accumulator='dense',
+              sampling='mc'):
+    graph, average_weight = weighted_graph(dataset, type, seed)
+
+    start_time = time.time()
+
+    arrays = live_edge.in_edge_arrays(graph)
+    stream = np.random.SeedSequence(seed).spawn(n_shards)[shard]
+    n_worlds = parallel.split_simulations(n_simulations, n_shards)[shard]
+
+    if n_workers == 1:
+        counts = accumulators.create(accumulator, len(graph.nodes()), n_worlds)
+        counts = live_edge.count_worlds(arrays, n_worlds, np.random.default_rng(stream), reach, counts, sampling).result()
+    else:
+        counts = parallel.count_live_edge_worlds(arrays, n_worlds, stream, n_workers, reach, accumulator, sampling=sampling)
+
+    return counts, time.time() - start_time, average_weight
+
+def weighted_graph(dataset, type, seed=None):
+    return assign_weights(utils.load_graph(dataset), type, seed)
+
+def assign_weights(graph, type, seed=None):
+    # random and trivalency weights must match across shards and resumed runs
+    if seed is not None:
+        random.seed(seed)
+
+    with metrics.phase('weights'):
+        if type == 'random':
+            graph = create_weights.w_random(graph)
+        elif type == 'uniform':
+            graph = create_weights.w_uniform(graph)
+        elif type == 'weighted':
+            graph = create_weights.w_weighted(graph)
+        elif type == 'trivalency':
+            graph = create_weights.w_trivalency(graph) 
 
     average_weight = np.mean([data['weight'] for _, _, data in graph.edges(data=True)])
     print(f"Average edge weight: {average_weight}")
 
-    IA, time_per_simulation = live_edge_simulation(n_simulations, graph)
-    return IA, time_per_simulation, average_weight
+    return graph, average_weight
+
+# Common random numbers
+# All weighting schemes come from one graph load and one set of worlds. Each scheme gets the
+# weights a single-scheme run with the same seed would get.
+def run_schemes(dataset, types, n_simulations, seed=None, reach='forest', n_workers=1, accumulator='dense', sampling='mc'):
+    graph = utils.load_graph(dataset)
+    graphs, average_weights = {}, {}
+    for type in types:
+        graphs[type], average_weights[type] = assign_weights(graph.copy(), type, seed)
+
+    IAs, time_per_simulation = common_simulation(n_simulations, list(graphs.values()), seed, reach, n_workers, accumulator,
+                                                 sampling)
+    return dict(zip(types, IAs)), time_per_simulation, average_weights
+
+def common_simulation(n_simulations, graphs, seed=None, reach='forest', n_workers=1, accumulator='dense', sampling='mc'):
+    start_time = time.time()
+
+    arrays_per_scheme = live_edge.coupled_edge_arrays(graphs)
+    counts = parallel.count_live_edge_worlds(
+        arrays_per_scheme, n_simulations, np.random.SeedSequence(seed), n_workers, reach, accumulator, sampling=sampling
+    )
 
-# NDLib simulator
+    time_per_simulation = (time.time() - start_time) / n_simulations
+    return [accumulators.probabilities(scheme_counts, n_simulations) for scheme_counts in counts], time_per_simulation
+
+# NDLib simulator, one ThresholdModel run per seed; type ndlib runs the native threshold engine
+# unless the engine is 'ndlib'
 def ndlib_simulation(n_simulations, graph, n_processes):
     n_nodes = len(graph.nodes())
     IA = np.zeros((n_nodes, n_nodes))
@@ -47,6 +227,7 @@ def ndlib_simulation(n_simulations, graph, n_processes):
     start_time = time.time()
 
     print("Creating processes ...")
+    metrics.children['started'] = True
     for i in range(n_processes):
         p = mp.Process(target=ndlib_simulation_process, args=(graph, n_nodes, simulations_per_process, queue))
         processes.append(p)
@@ -101,21 +282,202 @@ def ndlib_simulation_process(graph, n_nodes, n_simulations, queue):
     print('Process done!')
 
 # Live-edge simulator
-def live_edge_simulation(n_simulations, graph):
+def live_edge_simulation(n_simulations, graph, engine='array', seed=None, reach='forest', n_workers=1, accumulator='dense',
+                         memmap_path=None, sampling='mc', horizons=None, series_length=path_series.SERIES_LENGTH,
+                         series_check=path_series.SERIES_CHECK_SIMULATIONS, sketch_size=sketches.SKETCH_SIZE, sketch_path=None,
+                         checkpoint_folder=None, checkpoint_every=None, resume=False, extend_from=None,
+                         precision=None, error='max', time_budget=None, reduce=False, decompose=False, bank_path=None, n_blocks=None,
+                         blocks_folder=None, model='lt', checkpoint_run=None, stats=None):
+    chunked = checkpoint_folder is not None or precision is not None or time_budget is not None
+    check_features(engine, {
+        model: model != 'lt',
+        'reduce': reduce,
+        'decompose': decompose,
+        'horizons': horizons is not None,
+        'bank': bank_path is not None,
+        'blocks': n_blocks is not None,
+        'chunked': chunked,
+        'memmap': accumulator == 'memmap',
+    })
+    if reduce:
+        simulate = lambda residual: live_edge_simulation(
+            n_simulations, residual, seed=seed, reach=reach, n_workers=n_workers, accumulator=accumulator, sampling=sampling,
+            checkpoint_folder=checkpoint_folder, checkpoint_every=checkpoint_every, resume=resume, extend_from=extend_from,
+            precision=precision, error=error, time_budget=time_budget, decompose=decompose, checkpoint_run=checkpoint_run, stats=stats
+        )[0]
+        return reduced_simulation(n_simulations, graph, simulate, 'sparse' if decompose else accumulator, stats)
+    if engine == 'networkx':
+        return networkx_live_edge_simulation(n_simulations, graph)
+    if engine == 'series':
+        return series_simulation(graph, series_length, series_check, seed, reach, n_workers, stats)
+    if engine == 'sketch':
+        return sketch_simulation(n_simulations, graph, sketch_size, seed, sampling, sketch_path, stats)
+
+    start_time = time.time()
+
+    arrays = threshold.neighbor_arrays(graph) if model == 'threshold' else live_edge.in_edge_arrays(graph)
+    if decompose:
+        return component_simulation(n_simulations, arrays, seed, reach, n_workers, accumulator, sampling, stats)
+
+    if n_blocks is not None:
+        count_block = lambda n_worlds, stream: parallel.count_live_edge_worlds(
+            arrays, n_worlds, stream, n_workers, reach, accumulator, sampling=sampling, model=model
+        )
+        counts = blocks.run(count_block, len(graph.nodes()), n_simulations, n_blocks, seed, blocks_folder)
+        if stats is not None:
+            stats['n_blocks'] = n_blocks
+    elif not chunked:
+        if bank_path is not None:
+            world_bank.create(bank_path, n_simulations, len(arrays['indptr']) - 1, {'seed': seed, 'sampling': sampling})
+        counts = parallel.count_live_edge_worlds(
+            arrays, n_simulations, np.random.SeedSequence(seed), n_workers, reach, accumulator, memmap_path, sampling, horizons,
+            bank_path, model
+        )
+    else:
+        count_chunk = lambda n_worlds, stream: parallel.count_live_edge_worlds(
+            arrays, n_worlds, stream, n_workers, reach, accumulator, sampling=sampling, model=model
+        )
+        run_info = {**(checkpoint_run or {}), 'sampling': sampling, 'model': model, 'n_nodes': len(graph.nodes())}
+        counts, n_simulations = checkpoint.run(
+            count_chunk, len(graph.nodes()), n_simulations, seed, checkpoint_folder, checkpoint_every, resume, extend_from,
+            precision, error, time_budget, stats, run_info
+        )
+
+    if model != 'lt' and stats is not None:
+        stats['model'] = MODEL_NAMES[model]
+    time_per_simulation = (time.time() - start_time) / n_simulations
+    if horizons is not None:
+        # one IA per hop horizon, all from the same worlds
+        return [accumulators.probabilities(horizon_counts, n_simulations) for horizon_counts in counts], time_per_simulation
+    IA = accumulators.probabilities(counts, n_simulations)
+
+    return IA, time_per_simulation
+
+# Raises for the first feature of a run its engine lacks or that conflicts with another one
+def check_features(engine, requested):
+    if engine not in ENGINE_FEATURES:
+        raise ValueError(f"Unknown live-edge engine: {engine}!")
+    features = {feature for feature, used in requested.items() if used}
+    unsupported = sorted(features - ENGINE_FEATURES[engine])
+    if unsupported:
+        raise ValueError(f"The {engine} engine does not support {RUN_FEATURES[unsupported[0]]}!")
+    for first, second in FEATURE_CONFLICTS:
+        if first in features and second in features:
+            raise ValueError(f"{RUN_FEATURES[first].capitalize()} cannot be combined with {RUN_FEATURES[second]}!")
+
+# Simulates only the residual graph left by the static reduction and expands its IA
+def reduced_simulation(n_simulations, graph, simulate, accumulator='dense', stats=None):
+    start_time = time.time()
+
+    plan = reduction.reduce_graph(graph)
+    summary = reduction.summary(plan)
+    print(f"Static reduction: {summary['residual_nodes']} of {plan['n_nodes']} nodes left to simulate")
+    if stats is not None:
+        stats.update(summary)
+
+    if summary['residual_nodes']:
+        residual_IA = simulate(plan['graph'])
+    else:
+        residual_IA = csr_matrix((0, 0)) if accumulator == 'sparse' else np.zeros((0, 0))
+    IA = reduction.expand(plan, residual_IA)
+
+    if stats is not None and 'n_simulations' in stats:
+        n_simulations = stats['n_simulations']
+    return IA, (time.time() - start_time) / n_simulations
+
+# Solves every weakly connected component on its own, exactly when it has few worlds, and
+# returns the block-diagonal IA as a sparse matrix
+def component_simulation(n_simulations, arrays, seed=None, reach='forest', n_workers=1, accumulator='dense', sampling='mc',
+                         stats=None):
+    start_time = time.time()
+
+    parts = components.weak_components(arrays)
+    part_arrays = [components.component_arrays(arrays, nodes) for nodes in parts]
+    exact = [components.world_count(sub_arrays) <= components.EXACT_WORLDS for sub_arrays in part_arrays]
+    sampled = [index for index in range(len(parts)) if not exact[index]]
+    print(f"Components: {len(parts)}, {len(parts) - len(sampled)} solved exactly")
+
+    blocks = [components.exact_ia(sub_arrays) if is_exact else None for sub_arrays, is_exact in zip(part_arrays, exact)]
+    counts = parallel.count_component_worlds(
+        [part_arrays[index] for index in sampled], n_simulations, np.random.SeedSequence(seed), n_workers, reach, accumulator,
+        sampling
+    )
+    for index, component_counts in zip(sampled, counts):
+        blocks[index] = accumulators.probabilities(component_counts, n_simulations)
+    IA = components.block_diagonal(parts, blocks, len(arrays['indptr']) - 1)
+
+    if stats is not None:
+        stats.update({
+            'n_components': len(parts),
+            'largest_component': int(max(len(nodes) for nodes in parts)),
+            'exact_components': len(parts) - len(sampled),
+        })
+    return IA, (time.time() - start_time) / n_simulations
+
+# Path-series estimator, checked against a short Monte Carlo run. It is only exact on acyclic
+# graphs whose longest path the series covered, and a biased approximation otherwise. It runs
+# no simulations, so it keeps its elapsed time in stats and has no time per simulation.
+def series_simulation(graph, series_length, series_check, seed=None, reach='forest', n_workers=1, stats=None):
+    start_time = time.time()
+    P = path_series.weight_matrix(graph)
+    IA, steps, change = path_series.path_series(P, series_length)
+    elapsed = time.time() - start_time
+
+    if stats is not None:
+        acyclic = nx.is_directed_acyclic_graph(graph)
+        stats.update({
+            'series_steps': steps,
+            'series_last_change': change,
+            'series_acyclic': acyclic,
+            'series_exact': acyclic and change == 0,
+            'series_truncation_bound': path_series.truncation_bound(P, steps),
+        })
+        if series_check:
+            arrays = live_edge.in_edge_arrays(graph)
+            counts = parallel.count_live_edge_worlds(arrays, series_check, np.random.SeedSequence(seed), n_workers, reach)
+            stats.update(path_series.monte_carlo_errors(IA, counts / series_check, series_check))
+        stats['elapsed_seconds'] = elapsed
+
+    return IA, None
+
+# Bottom-k sketch estimator, returns sparse IA features with at most sketch_size entries per row
+def sketch_simulation(n_simulations, graph, sketch_size, seed=None, sampling='mc', sketch_path=None, stats=None):
+    start_time = time.time()
+
+    arrays = live_edge.in_edge_arrays(graph)
+    rng = np.random.default_rng(np.random.SeedSequence(seed))
+    sketch = sketches.sketch_worlds(arrays, n_simulations, rng, sketch_size, sampling)
+    if sketch_path is not None:
+        np.savez(sketch_path, **sketch)
+
+    if stats is not None:
+        stats.update({
+            'sketch_size': sketch_size,
+            'mean_reach_size': float(sketches.reach_sizes(sketch).mean()),
+            'max_reach_size': float(sketches.reach_sizes(sketch).max()),
+        })
+
+    time_per_simulation = (time.time() - start_time) / n_simulations
+    return sketches.features(sketch), time_per_simulation
+
+# Reference simulator on networkx live-edge graphs
+def networkx_live_edge_simulation(n_simulations, graph):
     n_nodes = len(graph.nodes())
     IA = np.zeros((n_nodes, n_nodes))
 
     start_time = time.time()
+    progress = metrics.Progress(n_simulations)
 
     for index in range(n_simulations):
-        print(f"Simulation {index + 1}/{n_simulations}")
-
-        live_edge_graph = create_live_edge_graph(graph)
+        with metrics.phase('sampling'):
+            live_edge_graph = create_live_edge_graph(graph)
 
-        for seed in range(n_nodes):
-            activated_nodes = get_activated_nodes(live_edge_graph, seed)
-            for node in activated_nodes:
-                IA[node][seed] += 1
+        with metrics.phase('reachability'):
+            for seed in range(n_nodes):
+                activated_nodes = get_activated_nodes(live_edge_graph, seed)
+                for node in activated_nodes:
+                    IA[node][seed] += 1
+        progress.update(index + 1)
 
     time_per_simulation = (time.time() - start_time) / n_simulations
     IA /= n_simulations
@@ -160,11 +522,25 @@ def get_activated_nodes(live_edge_graph, seed):
     return list(reachable)
 
 # Clustering
-def clustering(n_clusters, IA):
-    # normalization
-    IA = normalize_offdiag(IA)
+def clustering(n_clusters, IA, normalization='offdiag'):
+    with metrics.phase('normalization'):
+        if normalization == 'rows':
+            # unit rows keep sparse features such as sketch estimates sparse
+            IA = normalize(IA)
+        elif normalization == 'scaled':
+            IA = normalize_scaled(IA)
+        else:
+            if issparse(IA):
+                IA = IA.toarray()
+
+            # normalization, next to the IA file when it is memory-mapped
+            out = None
+            if isinstance(IA, np.memmap):
+                out = open_memmap(f'{os.path.splitext(IA.filename)[0]}_normalized.npy', mode='w+', dtype=float, shape=IA.shape)
+            IA = normalize_offdiag(IA, out)
 
-    labels = KMeans(n_clusters=n_clusters, random_state=1, n_init='auto').fit_predict(IA)
+    with metrics.phase('kmeans'):
+        labels = KMeans(n_clusters=n_clusters, random_state=1, n_init='auto').fit_predict(IA)
 
     clusters = {}
     for node in range(len(labels)):
@@ -179,17 +555,39 @@ def clustering(n_clusters, IA):
     clusters = {key: clusters[key] for key in sorted(clusters)}
     return clusters
 
-def normalize_offdiag(A):
+# Statistics are per row, so rows are normalized one tile at a time
+def normalize_offdiag(A, out=None, tile_rows=None):
     n = A.shape[0]
-    B = A.copy().astype(float)
-    np.fill_diagonal(B, 0.0)
-    row_sum = B.sum(axis=1)
-    mu = row_sum / (n - 1)
-
-    sq = ((B - mu[:,None])**2).sum(axis=1)
-    sigma = np.sqrt(sq / (n - 1))
+    if out is None:
+        out = np.empty(A.shape, dtype=float)
+    if tile_rows is None:
+        tile_rows = accumulators.tile_rows(n)
+
+    for first, last in accumulators.tiles(n, tile_rows):
+        rows = np.arange(last - first)
+        B = np.array(A[first:last], dtype=float)
+        B[rows, first + rows] = 0.0
+        row_sum = B.sum(axis=1)
+        mu = row_sum / (n - 1)
+
+        sq = ((B - mu[:,None])**2).sum(axis=1)
+        sigma = np.sqrt(sq / (n - 1))
+        sigma[sigma == 0] = 1.0
+        B = (B - mu[:,None]) / sigma[:,None]
+        B[rows, first + rows] = 0.0
+        out[first:last] = B
+
+    return out
+
+# Rows divided by their off-diagonal standard deviation without centering, which keeps the
+# block-diagonal IA of the component decomposition sparse
+def normalize_scaled(A):
+    n = A.shape[0]
+    B = csr_matrix(A, dtype=float)
+    B.setdiag(0.0)
+    B.eliminate_zeros()
+    mu = np.asarray(B.sum(axis=1)).ravel() / (n - 1)
+    sq = np.asarray(B.multiply(B).sum(axis=1)).ravel() / (n - 1)
+    sigma = np.sqrt(np.maximum(sq - mu**2, 0.0))
     sigma[sigma == 0] = 1.0
-    B = (B - mu[:,None]) / sigma[:,None]
-    np.fill_diagonal(B, 0.0)
-
-    return B
+    return diags(1.0 / sigma) @ B
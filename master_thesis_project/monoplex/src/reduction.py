@@ -0,0 +1,178 @@
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+from src import live_edge
+
+FORCED_WEIGHT = 1 - 1e-12
+
+# Static reduction
+# Three kinds of nodes have a fixed outcome and are taken out before simulation:
+# - sources (no in-edges) never have a parent. Peeled round by round, their IA columns follow
+#   exactly from their children: IA[:, s] = e_s + sum_c w(s -> c) IA[:, c].
+# - sinks (no out-edges) are on no chain but their own. Peeled round by round from the rest,
+#   their IA rows follow from their parents: IA[k] = e_k + sum_u w(u -> k) IA[u].
+# - forced chains p1 -> ... -> pk, where every link has weight 1 and is the only out-edge of
+#   its tail, are always walked as a whole and become one node of the residual graph.
+# Only the residual graph is simulated and its IA is expanded back to all nodes.
+def reduce_graph(graph):
+    arrays = live_edge.in_edge_arrays(graph)
+    n_nodes = len(arrays['indptr']) - 1
+    heads = np.repeat(np.arange(n_nodes), np.diff(arrays['indptr']))
+    tails = arrays['sources'].astype(np.int64)
+    weights = arrays['weights']
+
+    # a self loop only adds to the chance of having no parent
+    edges = tails != heads
+    tails, heads, weights = tails[edges], heads[edges], weights[edges]
+
+    source_rounds, alive = peel(n_nodes, np.ones(n_nodes, dtype=bool), tails, heads)
+    sink_rounds, alive = peel(n_nodes, alive, heads, tails)
+    groups = forced_chains(n_nodes, alive, tails, heads, weights)
+
+    # residual nodes are the alive nodes outside chains plus one node per chain, at its head
+    representative = np.full(n_nodes, -1, dtype=np.int64)
+    members = np.flatnonzero(alive)
+    representative[members] = members
+    for group in groups:
+        representative[group] = group[0]
+    kept = np.flatnonzero(alive & (representative == np.arange(n_nodes)))
+    index = np.full(n_nodes, -1, dtype=np.int64)
+    index[kept] = np.arange(len(kept))
+
+    # inner chain members are only ever entered from the member above them
+    inner = alive[tails] & alive[heads] & (representative[heads] == heads)
+    residual_tails, residual_heads = index[representative[tails[inner]]], index[representative[heads[inner]]]
+    live = residual_tails != residual_heads
+    residual = nx.DiGraph()
+    residual.add_nodes_from(range(len(kept)))
+    residual.add_weighted_edges_from(zip(residual_tails[live].tolist(), residual_heads[live].tolist(), weights[inner][live].tolist()))
+
+    return {
+        'n_nodes': n_nodes,
+        'graph': residual,
+        'nodes': members,
+        'index': index[representative[members]],
+        'groups': groups,
+        'source_rounds': source_rounds,
+        'sink_rounds': sink_rounds,
+        'tails': tails,
+        'heads': heads,
+        'weights': weights,
+        'sources': np.concatenate(source_rounds) if source_rounds else np.empty(0, dtype=np.int64),
+    }
+
+# Rounds of alive nodes that have no edge from another alive node
+def peel(n_nodes, alive, tails, heads):
+    alive = alive.copy()
+    rounds = []
+    while True:
+        live = alive[tails] & alive[heads]
+        peeled = np.flatnonzero(alive & (np.bincount(heads[live], minlength=n_nodes) == 0))
+        if not len(peeled):
+            return rounds, alive
+        rounds.append(peeled)
+        alive[peeled] = False
+
+# Chains of forced links among the alive nodes, each listed from its head down. Links closing
+# a cycle are left to the simulation.
+def forced_chains(n_nodes, alive, tails, heads, weights):
+    live = alive[tails] & alive[heads]
+    out_degree = np.bincount(tails[live], minlength=n_nodes)
+    forced = live & (weights >= FORCED_WEIGHT) & (out_degree[tails] == 1)
+
+    child = np.full(n_nodes, -1, dtype=np.int64)
+    child[tails[forced]] = heads[forced]
+    has_parent = np.zeros(n_nodes, dtype=bool)
+    has_parent[heads[forced]] = True
+
+    groups = []
+    for head in np.flatnonzero((child >= 0) & ~has_parent):
+        group = [head]
+        while child[group[-1]] >= 0:
+            group.append(child[group[-1]])
+        groups.append(np.array(group))
+    return groups
+
+def expand(reduction, residual_IA):
+    n_nodes = reduction['n_nodes']
+    nodes, index = reduction['nodes'], reduction['index']
+    tails, heads, weights = reduction['tails'], reduction['heads'], reduction['weights']
+    sparse = issparse(residual_IA)
+
+    IA = place(residual_IA, nodes, index, n_nodes)
+    IA = chain_blocks(IA, reduction, residual_IA)
+
+    # sink rows, in reverse peeling order, from parents that are not sources
+    source = np.zeros(n_nodes, dtype=bool)
+    source[reduction['sources']] = True
+    in_weights = csr_matrix((weights[~source[tails]], (heads[~source[tails]], tails[~source[tails]])), shape=(n_nodes, n_nodes))
+    for rows in reversed(reduction['sink_rounds']):
+        if sparse:
+            select = selection(rows, n_nodes)
+            IA = IA + select.T @ (in_weights[rows] @ IA + select)
+        else:
+            IA[rows] = in_weights[rows] @ IA
+            IA[rows, rows] = 1.0
+
+    # source columns, in reverse peeling order, from all children
+    out_weights = csr_matrix((weights, (heads, tails)), shape=(n_nodes, n_nodes)).tocsc()
+    for columns in reversed(reduction['source_rounds']):
+        if sparse:
+            select = selection(columns, n_nodes)
+            IA = IA + (IA @ out_weights[:, columns] + select.T) @ select
+        else:
+            children = np.unique(out_weights[:, columns].indices)
+            IA[:, columns] = IA[:, children] @ out_weights[children][:, columns].toarray()
+            IA[columns, columns] = 1.0
+
+    return IA.tocsr() if sparse else IA
+
+def selection(nodes, n_nodes):
+    return csr_matrix((np.ones(len(nodes)), (np.arange(len(nodes)), nodes)), shape=(len(nodes), n_nodes))
+
+# Residual IA on the original node ids, every chain member takes the IA of its chain
+def place(residual_IA, nodes, index, n_nodes):
+    if issparse(residual_IA):
+        residual_IA = csr_matrix(residual_IA)[index][:, index].tocoo()
+        return csr_matrix((residual_IA.data, (nodes[residual_IA.row], nodes[residual_IA.col])), shape=(n_nodes, n_nodes))
+    IA = np.zeros((n_nodes, n_nodes))
+    IA[np.ix_(nodes, nodes)] = residual_IA[np.ix_(index, index)]
+    return IA
+
+# Inside a chain a member is reached by itself and every member above it. Members below it
+# only reach it when the head's parent leads back into the chain.
+def chain_blocks(IA, reduction, residual_IA):
+    if not reduction['groups']:
+        return IA
+
+    tails, heads, weights = reduction['tails'], reduction['heads'], reduction['weights']
+    position = np.full(reduction['n_nodes'], -1, dtype=np.int64)
+    position[reduction['nodes']] = reduction['index']
+
+    rows, columns, values = [], [], []
+    for group in reduction['groups']:
+        parents = (heads == group[0]) & (position[tails] >= 0)
+        cycle = sum(weight * residual_IA[position[tail], position[group[0]]]
+                    for tail, weight in zip(tails[parents], weights[parents]))
+        order = np.arange(len(group))
+        rows.append(np.repeat(group, len(group)))
+        columns.append(np.tile(group, len(group)))
+        values.append(np.where(order[None, :] <= order[:, None], 1.0, cycle).ravel())
+
+    rows, columns, values = np.concatenate(rows), np.concatenate(columns), np.concatenate(values)
+    if issparse(IA):
+        block = csr_matrix((values, (rows, columns)), shape=IA.shape)
+        mask = csr_matrix((np.ones(len(rows)), (rows, columns)), shape=IA.shape)
+        return IA - IA.multiply(mask) + block
+    IA[rows, columns] = values
+    return IA
+
+def summary(reduction):
+    return {
+        'reduced_sources': int(sum(len(nodes) for nodes in reduction['source_rounds'])),
+        'reduced_sinks': int(sum(len(nodes) for nodes in reduction['sink_rounds'])),
+        'reduced_chain_nodes': int(sum(len(group) - 1 for group in reduction['groups'])),
+        'residual_nodes': reduction['graph'].number_of_nodes(),
+        'residual_edges': reduction['graph'].number_of_edges(),
+    }
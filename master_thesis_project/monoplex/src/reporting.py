@@ -1,17 +1,57 @@
 import numpy as np
 from src import utils
 from src import ploting
+from src import metrics
 
-def create_report(output_folder, clusters, dataset, time_per_simulation, average_weight):
+def create_report(output_folder, clusters, dataset, time_per_simulation, average_weight, stats=None):
     graph = utils.load_graph(dataset)
 
     with open(f"{output_folder}/report.md", 'w') as file:
         file.write('# Information Access Clustering Statistics\n\n')
         file.write(f'Dataset: {dataset}\n')
         file.write(f'Number of clusters: {len(clusters)}\n')
-        file.write(f'Time per simulation: {time_per_simulation} seconds\n')
+        if time_per_simulation is not None:
+            file.write(f'Time per simulation: {time_per_simulation} seconds\n')
+        if stats and 'elapsed_seconds' in stats:
+            file.write(f"Elapsed time: {stats['elapsed_seconds']} seconds\n")
+        if stats and 'common_types' in stats:
+            file.write(f"Common random numbers with: {', '.join(stats['common_types'])} (time per simulation covers all of them)\n")
+        if stats and 'n_simulations' in stats:
+            file.write(f"Simulations: {stats['n_simulations']} (stopped by {stats['stopped_by']})\n")
+            file.write(f"Max standard error: {stats['max_standard_error']}\n")
+            file.write(f"Mean standard error: {stats['mean_standard_error']}\n")
+        if stats and 'sketch_size' in stats:
+            file.write(f"Sketch size: {stats['sketch_size']}, mean reach size {stats['mean_reach_size']}, "
+                       f"max reach size {stats['max_reach_size']}\n")
+        if stats and 'residual_nodes' in stats:
+            file.write(f"Static reduction: {stats['reduced_sources']} sources, {stats['reduced_sinks']} sinks and "
+                       f"{stats['reduced_chain_nodes']} forced chain nodes expanded exactly, {stats['residual_nodes']} nodes and "
+                       f"{stats['residual_edges']} edges simulated\n")
+        if stats and 'replayed_worlds' in stats:
+            file.write(f"Replayed worlds: {stats['replayed_worlds']} from a world bank\n")
+        if stats and 'model' in stats:
+            file.write(f"Diffusion model: {stats['model']}\n")
+        if stats and 'n_blocks' in stats:
+            file.write(f"Block counts: {stats['n_blocks']} blocks kept for the stability command\n")
+        if stats and 'n_components' in stats:
+            file.write(f"Weakly connected components: {stats['n_components']} (largest {stats['largest_component']} nodes, "
+                       f"{stats['exact_components']} solved exactly)\n")
+        if stats and 'horizons' in stats:
+            file.write(f"Hop horizons: {', '.join(stats['horizons'])}, clustered at {stats['clustered_horizon']} hops\n")
+        if stats and 'series_steps' in stats:
+            bound = stats['series_truncation_bound']
+            file.write(f"Path series: {stats['series_steps']} steps, last max change {stats['series_last_change']}, "
+                       f"truncation bound {bound if bound is not None else 'none, some in-weights sum to 1'}\n")
+            if not stats['series_exact']:
+                kind = 'a cyclic graph, which it overcounts' if not stats['series_acyclic'] else 'an unfinished series'
+                file.write(f"Path series is a biased approximation on {kind}\n")
+        if stats and 'series_check_simulations' in stats:
+            file.write(f"Series error against {stats['series_check_simulations']} Monte Carlo simulations: "
+                       f"max {stats['series_max_error']}, mean {stats['series_mean_error']}, bias {stats['series_bias']}, "
+                       f"{stats['series_within_confidence']:.1%} inside the 99% interval\n")
         file.write(f'Average edge weight: {average_weight}\n\n')
-        file.write(get_cluster_statistics(dataset, clusters, graph, output_folder))
+        with metrics.phase('plotting'):
+            file.write(get_cluster_statistics(dataset, clusters, graph, output_folder))
 
 def get_cluster_statistics(dataset, clusters, graph, output_folder):
     if dataset == 'twitch':
@@ -0,0 +1,170 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from src import live_edge
+from src import metrics
+
+SKETCH_SIZE = 256
+EMPTY = np.uint64(np.iinfo(np.uint64).max)
+
+# Bottom-k reachability sketches
+# An item is a pair (world, node). The row sketch of v keeps the k smallest hashes of the items
+# (w, s) where s reaches v in world w, and the column sketch of s those of the items (w, v) that
+# s reaches. Both are merged along the live-edge forest of every world, so memory is O(n k).
+# The hash is a bijective 64-bit mix of the item id, so distinct items never collide.
+def mix(values):
+    values = values.astype(np.uint64)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+def empty(n_rows, k):
+    return np.full((n_rows, k), EMPTY, dtype=np.uint64), np.full((n_rows, k), -1, dtype=np.int32)
+
+# k smallest hashes of every group, for flat (group, hash, node) entries
+def bottom_k(groups, hashes, nodes, k):
+    keep = hashes != EMPTY
+    groups, hashes, nodes = groups[keep], hashes[keep], nodes[keep]
+    order = np.lexsort((hashes, groups))
+    groups, hashes, nodes = groups[order], hashes[order], nodes[order]
+
+    rows, starts = np.unique(groups, return_index=True)
+    rank = np.arange(len(groups)) - np.repeat(starts, np.diff(np.r_[starts, len(groups)]))
+    keep = rank < k
+
+    out_hashes, out_nodes = empty(len(rows), k)
+    index = np.searchsorted(rows, groups[keep])
+    out_hashes[index, rank[keep]] = hashes[keep]
+    out_nodes[index, rank[keep]] = nodes[keep]
+    return rows, out_hashes, out_nodes
+
+# Row sketches grow from the root down: a node adds its own item to its parent's sketch, and
+# nodes on a cycle share the sketch of all cycle members.
+def world_row_sketches(parents, own, k):
+    n_nodes = len(parents)
+    tree_parent, levels, on_cycle = live_edge.forest_levels(parents)
+    hashes, nodes = empty(len(tree_parent), k)
+
+    members = np.flatnonzero(on_cycle)
+    if len(members):
+        rows, hashes[rows], nodes[rows] = bottom_k(tree_parent[members], own[members], members, k)
+
+    for level in levels:
+        level = level[level < n_nodes]
+        cycle = on_cycle[level]
+        hashes[level[cycle]] = hashes[tree_parent[level[cycle]]]
+        nodes[level[cycle]] = nodes[tree_parent[level[cycle]]]
+
+        level = level[~cycle]
+        merged = np.concatenate((hashes[tree_parent[level]], own[level, None]), axis=1)
+        merged_nodes = np.concatenate((nodes[tree_parent[level]], level[:, None].astype(np.int32)), axis=1)
+        order = np.argsort(merged, axis=1)[:, :k]
+        hashes[level] = np.take_along_axis(merged, order, axis=1)
+        nodes[level] = np.take_along_axis(merged_nodes, order, axis=1)
+
+    return hashes[:n_nodes], nodes[:n_nodes]
+
+# Column sketches grow from the leaves up: a node merges the sketches of its children into its
+# own item, and nodes on a cycle share the sketch of everything below the cycle.
+def world_column_sketches(parents, own, k):
+    n_nodes = len(parents)
+    tree_parent, levels, on_cycle = live_edge.forest_levels(parents)
+    root = len(tree_parent) - 1
+    hashes, nodes = empty(len(tree_parent), k)
+    hashes[:n_nodes, 0] = own
+    nodes[:n_nodes, 0] = np.arange(n_nodes)
+
+    for level in reversed(levels):
+        level = level[tree_parent[level] != root]
+        if not len(level):
+            continue
+        targets = np.unique(tree_parent[level])
+        groups = np.concatenate((np.repeat(targets, k), np.repeat(tree_parent[level], k)))
+        rows, merged, merged_nodes = bottom_k(
+            groups,
+            np.concatenate((hashes[targets].ravel(), hashes[level].ravel())),
+            np.concatenate((nodes[targets].ravel(), nodes[level].ravel())),
+            k,
+        )
+        hashes[rows], nodes[rows] = merged, merged_nodes
+
+    key = np.where(on_cycle, tree_parent[:n_nodes], np.arange(n_nodes))
+    return hashes[key], nodes[key]
+
+def merge(sketch, update, k):
+    hashes = np.concatenate((sketch[0], update[0]), axis=1)
+    nodes = np.concatenate((sketch[1], update[1]), axis=1)
+    order = np.argsort(hashes, axis=1)[:, :k]
+    return np.take_along_axis(hashes, order, axis=1), np.take_along_axis(nodes, order, axis=1)
+
+def sketch_worlds(arrays, n_worlds, rng, k=SKETCH_SIZE, sampling='mc'):
+    n_nodes = len(arrays['indptr']) - 1
+    key = rng.integers(0, EMPTY, dtype=np.uint64, endpoint=True)
+    rows, columns = empty(n_nodes, k), empty(n_nodes, k)
+
+    world = 0
+    progress = metrics.Progress(n_worlds)
+    for parents in live_edge.sample_worlds(arrays, n_worlds, rng, sampling=sampling):
+        for world_parents in parents:
+            own = mix((np.uint64(world) * np.uint64(n_nodes) + np.arange(n_nodes, dtype=np.uint64)) ^ key)
+            rows = merge(rows, world_row_sketches(world_parents, own, k), k)
+            columns = merge(columns, world_column_sketches(world_parents, own, k), k)
+            world += 1
+        progress.update(world)
+
+    return {
+        'row_hashes': rows[0],
+        'row_nodes': rows[1],
+        'column_hashes': columns[0],
+        'column_nodes': columns[1],
+        'n_worlds': n_worlds,
+    }
+
+# Estimators
+# A sketch with fewer than k items holds its whole set, otherwise the set size is (k - 1) / h_k
+# with h_k the k-th smallest hash scaled to [0, 1).
+def set_sizes(hashes):
+    k = hashes.shape[1]
+    sizes = (hashes != EMPTY).sum(axis=1).astype(float)
+    full = sizes == k
+    sizes[full] = (k - 1) / (hashes[full, -1].astype(float) / 2.0 ** 64)
+    return sizes
+
+# Expected number of nodes every seed reaches, itself included
+def reach_sizes(sketch):
+    return set_sizes(sketch['column_hashes']) / sketch['n_worlds']
+
+# Expected number of seeds that reach every node, itself included
+def reached_by(sketch):
+    return set_sizes(sketch['row_hashes']) / sketch['n_worlds']
+
+# IA[target, seed] for arrays of (target, seed) pairs
+def information_access(sketch, targets, seeds):
+    hashes, nodes = sketch['row_hashes'][targets], sketch['row_nodes'][targets]
+    filled = np.maximum((hashes != EMPTY).sum(axis=1), 1)
+    hits = (nodes == np.asarray(seeds)[:, None]).sum(axis=1)
+    return set_sizes(hashes) * hits / filled / sketch['n_worlds']
+
+# Jaccard similarity of the (world, seed) sets of pairs of IA rows, from the k smallest items
+# of their union
+def similarity(sketch, rows_u, rows_v):
+    k = sketch['row_hashes'].shape[1]
+    hashes = np.sort(np.concatenate((sketch['row_hashes'][rows_u], sketch['row_hashes'][rows_v]), axis=1), axis=1)
+    repeated = np.zeros(hashes.shape, dtype=bool)
+    repeated[:, 1:] = (hashes[:, 1:] == hashes[:, :-1]) & (hashes[:, 1:] != EMPTY)
+
+    distinct = ~repeated & (hashes != EMPTY)
+    in_union = distinct & (np.cumsum(distinct, axis=1) <= k)
+    shared = repeated[:, 1:] & in_union[:, :-1]
+    return shared.sum(axis=1) / np.maximum(in_union.sum(axis=1), 1)
+
+# Sparse IA estimate with at most k entries per row, used as clustering features. Entries are
+# sampled, so clusters only settle for k well above the number of seeds a node is reached by.
+def features(sketch):
+    hashes, nodes = sketch['row_hashes'], sketch['row_nodes']
+    n_nodes = len(hashes)
+    filled = (hashes != EMPTY).sum(axis=1)
+    weights = reached_by(sketch) / np.maximum(filled, 1)
+
+    rows, slots = np.nonzero(hashes != EMPTY)
+    return csr_matrix((weights[rows], (rows, nodes[rows, slots])), shape=(n_nodes, n_nodes))
@@ -0,0 +1,76 @@
+import multiprocessing as mp
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+from src import blocks
+from src import pipeline
+from src import metrics
+
+STABILITY_REPLICATES = 100
+ARI_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+# Clustering stability
+# Every replicate draws the blocks of a block-resolved run with replacement, rebuilds IA and
+# clusters it again, so only the clustering is repeated. The confidence of a node is the share
+# of its reference cluster that ends up in its own cluster, averaged over replicates, and the
+# ARI of every replicate against the reference and between replicates shows how much the
+# whole partition moves.
+def run(folder, reference, n_clusters, n_replicates=STABILITY_REPLICATES, seed=None, n_workers=1, normalization='offdiag'):
+    _, manifest = blocks.load(folder)
+    n_blocks = manifest['n_blocks']
+    rng = np.random.default_rng(seed)
+    multiplicities = rng.multinomial(n_blocks, np.full(n_blocks, 1 / n_blocks), size=n_replicates)
+
+    tasks = [(folder, multiplicity, n_clusters, normalization) for multiplicity in multiplicities]
+    if n_workers == 1:
+        labels = [replicate_labels(*task) for task in tasks]
+    else:
+        with mp.Pool(n_workers) as pool:
+            labels = metrics.pool_map(pool, replicate_labels, tasks)
+
+    result = summary(np.asarray(reference), np.array(labels))
+    result.update({'n_replicates': n_replicates, 'n_blocks': n_blocks})
+    return result
+
+def replicate_labels(folder, multiplicity, n_clusters, normalization):
+    block_counts, manifest = blocks.load(folder)
+    IA = blocks.resampled_ia(block_counts, np.array(manifest['sizes']), multiplicity)
+    labels = cluster_labels(pipeline.clustering(n_clusters, IA, normalization), IA.shape[0])
+    print(f"Replicate done, {len(set(labels.tolist()))} clusters")
+    return labels
+
+def cluster_labels(clusters, n_nodes):
+    labels = np.zeros(n_nodes, dtype=np.int64)
+    for label, nodes in enumerate(clusters.values()):
+        labels[nodes] = label
+    return labels
+
+def summary(reference, labels):
+    sizes = np.bincount(reference)
+    confidence = np.zeros(len(reference))
+    for replicate in labels:
+        table = np.zeros((len(sizes), replicate.max() + 1))
+        np.add.at(table, (reference, replicate), 1)
+        confidence += table[reference, replicate] / sizes[reference]
+    confidence /= len(labels)
+
+    reference_ari = np.array([adjusted_rand_score(reference, replicate) for replicate in labels])
+    pairwise_ari = np.array([
+        adjusted_rand_score(labels[first], labels[second])
+        for first in range(len(labels)) for second in range(first + 1, len(labels))
+    ])
+    return {
+        'reference_ari': distribution(reference_ari),
+        'pairwise_ari': distribution(pairwise_ari),
+        'cluster_confidence': (np.bincount(reference, weights=confidence) / np.maximum(sizes, 1)).tolist(),
+        'node_confidence': confidence.tolist(),
+    }
+
+def distribution(values):
+    if not len(values):
+        return {'mean': None, 'quantiles': {}, 'values': []}
+    return {
+        'mean': float(values.mean()),
+        'quantiles': {str(q): float(np.quantile(values, q)) for q in ARI_QUANTILES},
+        'values': values.tolist(),
+    }
@@ -0,0 +1,63 @@
+import numpy as np
+import networkx as nx
+
+GRAPHS = ['scale_free', 'sbm']
+SCALE_FREE_EXPONENT = 2.5
+PLANTED_CLUSTERS = 8
+PLANTED_MIXING = 0.1
+
+# Synthetic graphs
+# Seeded directed graphs of a given size and mean out-degree, drawn straight into an edge array
+# so a million nodes never need a networkx graph. Scale-free graphs draw both ends of every edge
+# from Chung-Lu power-law weights, with the in-hubs shuffled away from the out-hubs. Planted
+# cluster graphs are a stochastic block model over contiguous clusters, where an edge leaves
+# its source's cluster with probability mixing. Self loops and repeated edges are dropped, so
+# the mean degree ends up slightly below the requested one.
+def generate(kind, n_nodes, degree, seed=None):
+    rng = np.random.default_rng(seed)
+    if kind == 'scale_free':
+        return scale_free(n_nodes, degree, rng), None
+    if kind == 'sbm':
+        return planted_clusters(n_nodes, degree, rng)
+    raise ValueError(f"Unknown synthetic graph: {kind}!")
+
+def scale_free(n_nodes, degree, rng, exponent=SCALE_FREE_EXPONENT):
+    weights = np.arange(1, n_nodes + 1) ** (-1 / (exponent - 1))
+    cumulative = np.cumsum(weights / weights.sum())
+    n_edges = n_nodes * degree
+    sources = np.minimum(np.searchsorted(cumulative, rng.random(n_edges)), n_nodes - 1)
+    targets = np.minimum(np.searchsorted(cumulative, rng.random(n_edges)), n_nodes - 1)
+    return simple_edges(n_nodes, sources, rng.permutation(n_nodes)[targets])
+
+def planted_clusters(n_nodes, degree, rng, n_clusters=PLANTED_CLUSTERS, mixing=PLANTED_MIXING):
+    labels = np.arange(n_nodes) * n_clusters // n_nodes
+    starts = np.searchsorted(labels, np.arange(n_clusters))
+    sizes = np.bincount(labels, minlength=n_clusters)
+
+    n_edges = n_nodes * degree
+    sources = rng.integers(n_nodes, size=n_edges)
+    own = labels[sources]
+    targets = starts[own] + (rng.random(n_edges) * sizes[own]).astype(np.int64)
+    mixed = rng.random(n_edges) < mixing
+    targets[mixed] = rng.integers(n_nodes, size=int(mixed.sum()))
+    return simple_edges(n_nodes, sources, targets), labels
+
+def simple_edges(n_nodes, sources, targets):
+    keys = np.unique(sources.astype(np.int64) * n_nodes + targets)
+    keys = keys[keys // n_nodes != keys % n_nodes]
+    return np.stack((keys // n_nodes, keys % n_nodes), axis=1)
+
+def to_networkx(n_nodes, edges):
+    graph = nx.DiGraph()
+    graph.add_nodes_from(range(n_nodes))
+    graph.add_edges_from(edges.tolist())
+    return graph
+
+# The weighted and uniform schemes of create_weights, computed on the edge array
+def scheme_weights(n_nodes, edges, type):
+    in_degrees = np.bincount(edges[:, 1], minlength=n_nodes)
+    if type == 'weighted':
+        return 1 / in_degrees[edges[:, 1]]
+    if type == 'uniform':
+        return np.full(len(edges), 1 / max(in_degrees.max(), 1))
+    raise ValueError('Synthetic edge weights are only computed for the weighted and uniform schemes!')
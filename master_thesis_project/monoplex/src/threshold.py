@@ -0,0 +1,78 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from src import metrics
+
+THRESHOLD_BUFFER_SIZE = 1 << 24
+
+# Threshold model
+# The model of ndlib's ThresholdModel: every simulation draws one uniform threshold per node,
+# shared by all seeds, and a node with in-neighbors becomes active once the share of its active
+# in-neighbors reaches its threshold. Edge weights play no part. A block of seeds runs as the
+# columns of one activation matrix and every round pushes only the newly active nodes through
+# the sparse in-neighbor matrix, so a seed's column drops out of the work once its cascade
+# stops and a round only touches the neighbors of the last round's activations.
+def neighbor_arrays(graph):
+    n_nodes = len(graph.nodes())
+    edges = np.array(list(graph.edges()), dtype=np.int64).reshape(-1, 2)
+    order = np.argsort(edges[:, 1], kind='stable')
+
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edges[:, 1], minlength=n_nodes), out=indptr[1:])
+    return {'indptr': indptr, 'sources': edges[order, 0].astype(np.int32)}
+
+def in_neighbors(arrays):
+    n_nodes = len(arrays['indptr']) - 1
+    values = np.ones(len(arrays['sources']), dtype=np.float32)
+    return csr_matrix((values, arrays['sources'], arrays['indptr']), shape=(n_nodes, n_nodes))
+
+# Fewest active in-neighbors with count / degree >= threshold, compared exactly as ndlib does;
+# nodes without in-neighbors never activate
+def required_counts(degrees, thresholds):
+    required = np.ceil(thresholds * degrees)
+    safe = np.maximum(degrees, 1)
+    required -= (required >= 1) & ((required - 1) / safe >= thresholds)
+    required += required / safe < thresholds
+    return np.where(degrees > 0, required, np.inf)
+
+def seed_blocks(n_nodes):
+    block = max(1, min(n_nodes, THRESHOLD_BUFFER_SIZE // max(n_nodes, 1)))
+    return [np.arange(start, min(start + block, n_nodes)) for start in range(0, n_nodes, block)]
+
+def cascade(matrix, required, seeds):
+    n_nodes = matrix.shape[0]
+    columns = np.arange(len(seeds))
+    active = np.zeros((n_nodes, len(seeds)), dtype=bool)
+    totals = np.zeros((n_nodes, len(seeds)), dtype=np.int32)
+
+    # a zero threshold is met without any active in-neighbor
+    free = np.flatnonzero(required == 0)
+    keys = np.unique(np.concatenate((seeds * len(seeds) + columns, (free[:, None] * len(seeds) + columns).ravel())))
+    rows, cols = keys // len(seeds), keys % len(seeds)
+    nodes, columns_reached = [], []
+    while len(rows):
+        active[rows, cols] = True
+        nodes.append(rows)
+        columns_reached.append(cols)
+        new = csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=active.shape)
+        pushed = (matrix @ new).tocoo()
+        rows, cols = pushed.row, pushed.col
+        totals[rows, cols] += pushed.data.astype(np.int32)
+        reached = (totals[rows, cols] >= required[rows]) & ~active[rows, cols]
+        rows, cols = rows[reached], cols[reached]
+    return np.concatenate(nodes), seeds[np.concatenate(columns_reached)]
+
+def count_worlds(arrays, n_worlds, rng, counts):
+    n_nodes = len(arrays['indptr']) - 1
+    matrix = in_neighbors(arrays)
+    degrees = np.diff(arrays['indptr'])
+    progress = metrics.Progress(n_worlds)
+    for simulation in range(n_worlds):
+        with metrics.phase('sampling'):
+            required = required_counts(degrees, rng.random(n_nodes))
+        for seeds in seed_blocks(n_nodes):
+            with metrics.phase('reachability'):
+                nodes, pair_seeds = cascade(matrix, required, seeds)
+            counts.add_pairs(nodes, pair_seeds)
+        progress.update(simulation + 1)
+    return counts
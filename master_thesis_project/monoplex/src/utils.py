@@ -1,7 +1,10 @@
 import pickle
 
+from src import metrics
+
 def load_graph(dataset):
-    return load_pickle(path=f'monoplex/data/graphs/{dataset}_graph')
+    with metrics.phase('graph_load'):
+        return load_pickle(path=f'monoplex/data/graphs/{dataset}_graph')
 
 def load_pickle(path):
     with open(path, 'rb') as pickle_file:
@@ -0,0 +1,19 @@
+import numpy as np
+
+from src import accumulators
+
+# A small buffer makes the memmap accumulator flush many times, with cells hit repeatedly
+# within and across flushes
+def test_memmap_counts_match_dense_counts_across_flushes(tmp_path):
+    n_nodes, n_worlds = 30, 50
+    dense = accumulators.DenseCounts.zeros(n_nodes, n_worlds)
+    memmap = accumulators.MemmapCounts(str(tmp_path / 'counts.npy'), n_nodes, buffer_size=100)
+
+    rng = np.random.default_rng(0)
+    for _ in range(n_worlds):
+        keys = rng.choice(n_nodes * n_nodes, size=rng.integers(1, 200), replace=False)
+        nodes, seeds = keys // n_nodes, keys % n_nodes
+        dense.add_pairs(nodes, seeds)
+        memmap.add_pairs(nodes, seeds)
+
+    np.testing.assert_array_equal(np.asarray(memmap.result()), dense.result())
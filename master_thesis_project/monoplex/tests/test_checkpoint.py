@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import pytest
+
+from src import checkpoint
+
+N_NODES = 5
+
+def count_chunk(n_worlds, stream):
+    rng = np.random.default_rng(stream)
+    return rng.binomial(n_worlds, 0.5, size=(N_NODES, N_NODES)).astype(np.uint32)
+
+def run(folder, resume=False):
+    os.makedirs(folder, exist_ok=True)
+    return checkpoint.run(count_chunk, N_NODES, 40, seed=1, folder=str(folder), every=10, resume=resume)
+
+# A crash while the second checkpoint is saved, after its counts are written but before the
+# state is replaced, must resume from the first checkpoint without counting its chunk twice
+def test_interrupted_save_resumes_without_double_counting(tmp_path, monkeypatch):
+    expected, _ = run(tmp_path / 'uninterrupted')
+
+    replace = os.replace
+    saves = []
+    def crashing_replace(source, destination):
+        if destination.endswith('checkpoint.json'):
+            saves.append(destination)
+        if len(saves) == 2:
+            raise KeyboardInterrupt
+        replace(source, destination)
+
+    monkeypatch.setattr(os, 'replace', crashing_replace)
+    with pytest.raises(KeyboardInterrupt):
+        run(tmp_path / 'interrupted')
+    monkeypatch.setattr(os, 'replace', replace)
+
+    assert checkpoint.load(str(tmp_path / 'interrupted'))[1]['completed'] == 10
+    counts, n_simulations = run(tmp_path / 'interrupted', resume=True)
+    assert n_simulations == 40
+    np.testing.assert_array_equal(counts, expected)
+
+def test_save_keeps_only_the_latest_counts(tmp_path):
+    run(tmp_path)
+    assert sorted(os.listdir(tmp_path)) == ['checkpoint.json', 'checkpoint_counts_4.npy']
+
+def test_extend_rejects_a_checkpoint_of_another_run(tmp_path):
+    run_info = {'dataset': 'cosponsorship', 'type': 'weighted', 'sampling': 'mc', 'model': 'lt', 'n_nodes': N_NODES}
+    checkpoint.run(count_chunk, N_NODES, 20, seed=1, folder=str(tmp_path), every=10, run_info=run_info)
+
+    with pytest.raises(ValueError, match='type weighted, not random'):
+        checkpoint.run(count_chunk, N_NODES, 40, seed=1, extend_from=str(tmp_path), every=10,
+                       run_info={**run_info, 'type': 'random'})
+
+def test_exhausted_time_budget_still_counts_one_chunk():
+    counts, n_simulations = checkpoint.run(count_chunk, N_NODES, 1_000, seed=1, time_budget=0)
+    assert n_simulations == checkpoint.ADAPTIVE_EVERY
+    assert counts.max() <= n_simulations
+
+def test_entries_without_hits_keep_a_standard_error():
+    counts = np.diag(np.full(N_NODES, 100))
+    max_error, mean_error = checkpoint.standard_errors(counts, 100)
+    assert max_error == mean_error > 0
@@ -0,0 +1,174 @@
+import os
+import sys
+import argparse
+import json
+import time
+import random
+import numpy as np
+from scipy.sparse import issparse
+from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+
+from src import pipeline
+from src import utils
+from src import synthetic
+from src import stability
+
+OUTPUT_PATH = 'multiplex/output'
+CONFIDENCE = 0.99
+CONFIDENCE_Z = 2.576
+ARI_SLACK = 0.1
+# Engines checked against the networkx reference; each entry holds the options of
+# pipeline.live_edge_simulation
+ENGINES = {
+    'array': {},
+    'array_bitset': {'reach': 'bitset'},
+    'array_bfs': {'reach': 'bfs'},
+    'array_scc': {'reach': 'scc'},
+    'array_sobol': {'sampling': 'sobol'},
+    'components': {'decompose': True},
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--graph', default='sbm', help='synthetic graph kind or dataset name')
+    parser.add_argument('--nodes', type=int, default=300, help='nodes of a synthetic graph')
+    parser.add_argument('--layers', type=int, default=3, help='layers of a synthetic graph')
+    parser.add_argument('--degree', type=int, default=5, help='mean out-degree of every synthetic layer')
+    parser.add_argument('--type', default='weighted')  # Options: 'random', 'uniform', 'weighted', 'trivalency'
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--engines', help='comma-separated engines to check, all by default')
+    parser.add_argument('--simulations', type=int, default=2_000)
+    parser.add_argument('--reference-simulations', type=int, help='simulations of the reference engine, --simulations by default')
+    parser.add_argument('--clusters', type=int, default=synthetic.PLANTED_CLUSTERS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--tolerance', type=float, default=0.01, help='allowed shortfall of entries inside the confidence interval')
+    parser.add_argument('--min-ari', type=float, default=0.7, help='lowest ARI against the reference clustering')
+    return parser.parse_args()
+
+def load_layers(args):
+    if args.graph not in synthetic.GRAPHS:
+        return utils.load_layers(args.graph), None
+    layer_edges, labels = synthetic.generate_layers(args.graph, args.nodes, args.layers, args.degree, args.seed)
+    return [synthetic.to_networkx(args.nodes, edges) for edges in layer_edges], labels
+
+# The reference simulator draws from the random module
+def reference_simulation(layers, n_simulations, threshold, seed):
+    random.seed(seed)
+    start_time = time.time()
+    IA = pipeline.networkx_live_edge_simulation(n_simulations, layers, threshold)
+    return IA, time.time() - start_time
+
+def simulate(layers, n_simulations, threshold, options, seed, n_workers):
+    start_time = time.time()
+    IA = pipeline.live_edge_simulation(n_simulations, layers, threshold, seed=seed, n_workers=n_workers, **options)
+    return IA, time.time() - start_time
+
+# Entry-wise agreement
+# Where two engines estimate the same IA, an off-diagonal entry differs by less than CONFIDENCE_Z
+# pooled standard errors, plus one world of slack per estimate, in about CONFIDENCE of the
+# entries.
+def agreement(IA, reference, n_simulations, n_reference):
+    offdiag = ~np.eye(len(IA), dtype=bool)
+    estimate, expected = IA[offdiag], reference[offdiag]
+    difference = estimate - expected
+    pooled = (estimate * n_simulations + expected * n_reference) / (n_simulations + n_reference)
+    variance = pooled * (1 - pooled) * (1 / n_simulations + 1 / n_reference)
+    slack = 1 / n_simulations + 1 / n_reference
+    margin = CONFIDENCE_Z * np.sqrt(variance) + slack
+
+    return {
+        'max_error': float(np.abs(difference).max()),
+        'mean_error': float(np.abs(difference).mean()),
+        'bias': float(difference.mean()),
+        'within_confidence': float((np.abs(difference) <= margin).mean()),
+    }
+
+def labels(IA, n_clusters):
+    return stability.cluster_labels(pipeline.clustering(n_clusters, IA), IA.shape[0])
+
+def clustering_agreement(engine_labels, reference_labels, planted=None):
+    result = {
+        'ari': float(adjusted_rand_score(reference_labels, engine_labels)),
+        'nmi': float(normalized_mutual_info_score(reference_labels, engine_labels)),
+    }
+    if planted is not None:
+        result['planted_ari'] = float(adjusted_rand_score(planted, engine_labels))
+    return result
+
+def throughput(n_simulations, seconds, n_nodes):
+    if not seconds:
+        return {'seconds': seconds}
+    return {
+        'seconds': seconds,
+        'worlds_per_second': n_simulations / seconds,
+        'seeds_per_second': n_simulations * n_nodes / seconds,
+    }
+
+# Every engine runs on the same graph and weights and is compared with the reference engine.
+# A second reference run on another seed shows how far two correct estimates already differ,
+# in the confidence interval share as well as in the clustering, where KMeans already moves
+# some nodes between two estimates of one IA.
+def main():
+    args = parse_args()
+    n_reference = args.reference_simulations or args.simulations
+    layers, planted = load_layers(args)
+    n_nodes = len(layers[0].nodes())
+    layers = pipeline.assign_layer_weights(layers, args.type, args.seed)
+
+    engines = ENGINES
+    if args.engines:
+        unknown = set(args.engines.split(',')) - set(engines)
+        if unknown:
+            raise ValueError(f"Unknown engines: {', '.join(sorted(unknown))}!")
+        engines = {name: engines[name] for name in args.engines.split(',')}
+
+    runs = {}
+    for name, seed in (('reference', args.seed), ('reference_repeat', args.seed + 1)):
+        print(f"Engine {name}")
+        IA, seconds = reference_simulation(layers, n_reference, args.threshold, seed)
+        runs[name] = (IA, n_reference, seconds)
+    for name, options in engines.items():
+        print(f"Engine {name}")
+        IA, seconds = simulate(layers, args.simulations, args.threshold, options, args.seed, args.workers)
+        runs[name] = (IA, args.simulations, seconds)
+
+    reference = runs['reference'][0]
+    reference_labels = labels(reference, args.clusters)
+    results = {}
+    for name, (IA, n_simulations, seconds) in runs.items():
+        results[name] = {'throughput': throughput(n_simulations, seconds, n_nodes)}
+        if name == 'reference':
+            continue
+        IA = IA.toarray() if issparse(IA) else np.asarray(IA)
+        results[name].update(clustering_agreement(labels(IA, args.clusters), reference_labels, planted))
+        results[name].update(agreement(IA, reference, n_simulations, n_reference))
+
+    # a graph without stable clusters cannot ask more of an engine than of the reference itself
+    min_ari = min(args.min_ari, results['reference_repeat']['ari'] - ARI_SLACK)
+    for name in engines:
+        result = results[name]
+        result['passed'] = bool(result['ari'] >= min_ari and result['within_confidence'] >= CONFIDENCE - args.tolerance)
+
+    for name, result in results.items():
+        line = f"{name:>16}: {result['throughput']['seconds']:.2f} s"
+        if 'worlds_per_second' in result['throughput']:
+            line += f", {result['throughput']['worlds_per_second']:.4g} worlds/s"
+        if 'within_confidence' in result:
+            line += f", {result['within_confidence']:.2%} inside the {CONFIDENCE:.0%} interval, max error {result['max_error']:.4f}"
+        if 'ari' in result:
+            line += f", ARI {result['ari']:.3f}, NMI {result['nmi']:.3f}"
+        if 'passed' in result:
+            line += ', passed' if result['passed'] else ', FAILED'
+        print(line)
+
+    os.makedirs(OUTPUT_PATH, exist_ok=True)
+    with open(f'{OUTPUT_PATH}/equivalence_{args.graph}_{args.type}_{args.simulations}_{args.threshold}.json', 'w') as file:
+        json.dump({'arguments': vars(args), 'n_nodes': n_nodes, 'confidence': CONFIDENCE, 'min_ari': min_ari,
+                   'results': results}, file, indent=4)
+
+    if not all(result.get('passed', True) for result in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
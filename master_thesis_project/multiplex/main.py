@@ -1,31 +1,367 @@
 import os
+import argparse
 import numpy as np
+from scipy.sparse import issparse, save_npz, vstack
 import json
 
 from src import pipeline
 from src import utils
+from src import shards
+from src import parallel
+from src import checkpoint
+from src import accumulators
+from src import live_edge
+from src import world_bank
+from src import influence
+from src import blocks
+from src import stability
+from src import metrics
 
 OUTPUT_PATH = 'multiplex/output'
 
-def main(type, inter_layer_threshold):
-    dataset = "politicsuk"  # Options: 'flickr', 'politicsuk'
-    type = "weighted"  # Options: 'random', 'uniform', 'weighted', 'trivalency'
-    n_simulations = 10_000
-    n_clusters = 4
-    inter_layer_threshold = 0.2
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'merge', 'query', 'influence', 'stability'])
+    parser.add_argument('--dataset', default='politicsuk')  # Options: 'flickr', 'politicsuk'
+    parser.add_argument('--type', default='weighted')  # Options: 'random', 'uniform', 'weighted', 'trivalency'
+    parser.add_argument('--simulations', type=int, default=10_000)
+    parser.add_argument('--clusters', type=int, default=4)
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--reach', default='forest')  # Options: 'forest', 'bitset', 'bfs', 'scc'
+    parser.add_argument('--model', default='lt', choices=['lt', 'ic'],
+                        help='linear threshold worlds (one live in-edge per node) or independent cascade worlds')
+    parser.add_argument('--accumulator', default='dense', choices=['dense', 'sparse', 'memmap'],
+                        help='sparse keeps only reached pairs, memmap accumulates IA.npy on disk')
+    parser.add_argument('--sampling', default='mc', choices=['mc', 'stratified', 'antithetic', 'sobol'],
+                        help='variance reduction for world sampling')
+    parser.add_argument('--components', action='store_true',
+                        help='solve weakly connected components separately and keep IA block-diagonal and sparse')
+    parser.add_argument('--normalization', default='auto', choices=['auto', 'offdiag', 'scaled'],
+                        help='row normalization before clustering (auto: scaled for components)')
+    parser.add_argument('--save-worlds', action='store_true', help='keep the sampled worlds in worlds.npy for later replays')
+    parser.add_argument('--worlds', default=None,
+                        help='run or query on the worlds of this worlds.npy instead of sampling, at any threshold')
+    parser.add_argument('--blocks', type=int, default=None,
+                        help='keep the counts of this many blocks of worlds for the stability command')
+    parser.add_argument('--replicates', type=int, default=stability.STABILITY_REPLICATES,
+                        help='stability: number of bootstrap replicates over the blocks')
+    parser.add_argument('--hops', default=None, help='hop horizons of a hop-limited run, e.g. 1,2,3,inf')
+    parser.add_argument('--cluster-hops', default=None,
+                        help='horizon whose IA is clustered (default: the largest), or all to cluster every horizon')
+    parser.add_argument('--targets', default=None, help='query: comma separated nodes whose IA rows are estimated')
+    parser.add_argument('--seeds', default=None,
+                        help='query: comma separated nodes whose IA columns are estimated, influence: seed set to evaluate')
+    parser.add_argument('--k', type=int, default=10, help='influence: number of seeds chosen greedily')
+    parser.add_argument('--objective', default='reach', choices=['reach', 'balanced'],
+                        help='influence: maximize the spread, or the lowest mean access over the clusters of clusters.json')
+    parser.add_argument('--influence-worlds', type=int, default=influence.INFLUENCE_WORLDS,
+                        help='influence: number of sampled worlds, unless --worlds is given')
+    parser.add_argument('--shard', default=None, help='run only shard i of N, given as i/N')
+    parser.add_argument('--checkpoint-every', type=int, default=None,
+                        help=f'checkpoint counts every N simulations, {checkpoint.CHECKPOINT_EVERY} by default')
+    parser.add_argument('--resume', action='store_true', help='continue from the checkpoint in the output folder')
+    parser.add_argument('--extend', default=None, help='add simulations to the checkpointed run in this folder')
+    parser.add_argument('--precision', type=float, default=None,
+                        help='stop once the IA standard error reaches this value, checked after every checkpoint, or every '
+                             f'{checkpoint.ADAPTIVE_EVERY} simulations without checkpoints')
+    parser.add_argument('--error', default='max', choices=['max', 'mean'], help='standard error used by --precision')
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help='stop after this many seconds, checked as --precision is; the first chunk always runs')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    dataset = args.dataset
+    type = args.type
+    n_simulations = args.simulations
+    n_clusters = args.clusters
+    if n_simulations < 1:
+        raise ValueError('A run needs at least one simulation!')
+    inter_layer_threshold = args.threshold
+    if args.worlds is not None:
+        n_simulations = world_bank.load(args.worlds)[1]['n_worlds']
 
     #create output subfolder
     output_folder = f'{OUTPUT_PATH}/{dataset}_{type}_{n_simulations}_{inter_layer_threshold}'
+    if args.model != 'lt':
+        output_folder = f'{output_folder}_{args.model}'
+    if args.worlds is not None:
+        output_folder = f'{output_folder}_replay'
+    if args.hops is not None:
+        output_folder = f'{output_folder}_hops'
     os.makedirs(output_folder, exist_ok=True)
 
+    if args.model == 'ic' and (args.command in ('query', 'influence') or args.shard is not None or args.worlds is not None):
+        raise ValueError('Independent cascade worlds are only supported by plain runs!')
+
+    if args.command == 'merge':
+        counts, manifest, _ = shards.merge(output_folder)
+        finish(output_folder, accumulators.probabilities(counts, manifest['n_simulations']), n_clusters)
+        return
+
+    if args.command == 'query':
+        run_query(output_folder, args)
+        return
+
+    if args.command == 'influence':
+        run_influence(output_folder, args)
+        return
+
+    if args.command == 'stability':
+        run_stability(output_folder, args)
+        return
+
+    if args.shard is not None:
+        run_shard(output_folder, args)
+        return
+
+    horizons = None if args.hops is None else live_edge.parse_horizons(args.hops)
+    if horizons is not None:
+        clustered_horizon(horizons, args.cluster_hops)
+    if args.save_worlds and args.worlds is not None:
+        raise ValueError('Replays cannot save their worlds again!')
+    if args.blocks is not None and args.worlds is not None:
+        raise ValueError('Replays cannot keep block counts!')
+
+    if args.worlds is not None:
+        run_replay(output_folder, args, horizons)
+        return
+
     #simulator
-    IA = pipeline.run(dataset, type, n_simulations, inter_layer_threshold)
-    np.save(f"{output_folder}/IA.npy", IA)
+    stats = {}
+    IA = pipeline.run(
+        dataset, type, n_simulations, inter_layer_threshold, horizons=horizons, seed=run_seed(args, output_folder), reach=args.reach,
+        n_workers=args.workers, accumulator=args.accumulator, memmap_path=memmap_path(args, output_folder),
+        sampling=args.sampling, decompose=args.components, bank_path=f'{output_folder}/worlds.npy' if args.save_worlds else None,
+        n_blocks=args.blocks, blocks_folder=output_folder, model=args.model, stats=stats, **adaptive_options(args), **checkpoint_options(args, output_folder)
+    )
+    normalization = clustering_normalization(args)
+    if horizons is not None:
+        IA = save_horizons(output_folder, IA, horizons, n_clusters, args.cluster_hops, stats, normalization)
+    finish(output_folder, IA, n_clusters, stats, normalization)
+
+def finish(output_folder, IA, n_clusters, stats=None, normalization='offdiag'):
+    if issparse(IA):
+        save_npz(f"{output_folder}/IA.npz", IA.tocsr())
+    elif isinstance(IA, np.memmap):
+        # the accumulator file already is IA.npy
+        IA.flush()
+        IA = np.load(IA.filename, mmap_mode='r')
+    else:
+        np.save(f"{output_folder}/IA.npy", IA)
 
     #clustering
-    clusters = pipeline.clustering(n_clusters, IA)
+    clusters = pipeline.clustering(n_clusters, IA, normalization)
     with open(f'{output_folder}/clusters.json', 'w') as file:
         json.dump(clusters, file, indent=4)
 
+    #phase timers, peak memory and throughput of the whole run so far
+    summary = metrics.summary(stats.get('time_per_simulation') if stats else None, IA.shape[0])
+    with open(f'{output_folder}/metrics.json', 'w') as file:
+        json.dump(summary, file, indent=4)
+
+    if stats:
+        write_report(output_folder, stats, summary)
+
+def write_report(output_folder, stats, summary=None):
+    with open(f"{output_folder}/report.md", 'w') as file:
+        file.write('# Information Access Simulation Statistics\n\n')
+        file.write(f"Time per simulation: {stats['time_per_simulation']} seconds\n")
+        if 'horizons' in stats:
+            file.write(f"Hop horizons: {', '.join(stats['horizons'])}, clustered at {stats['clustered_horizon']} hops\n")
+        if 'replayed_worlds' in stats:
+            file.write(f"Replayed worlds: {stats['replayed_worlds']} from a world bank\n")
+        if 'model' in stats:
+            file.write(f"Diffusion model: {stats['model']}\n")
+        if 'n_blocks' in stats:
+            file.write(f"Block counts: {stats['n_blocks']} blocks kept for the stability command\n")
+        if 'n_components' in stats:
+            file.write(f"Weakly connected components: {stats['n_components']} (largest {stats['largest_component']} nodes, "
+                       f"{stats['exact_components']} solved exactly)\n")
+        if 'n_simulations' in stats:
+            file.write(f"Simulations: {stats['n_simulations']} (stopped by {stats['stopped_by']})\n")
+            file.write(f"Max standard error: {stats['max_standard_error']}\n")
+            file.write(f"Mean standard error: {stats['mean_standard_error']}\n")
+        if summary:
+            file.write('\n' + metrics.report_lines(summary))
+
+# All horizons are stacked into IA_hops, sparse ones row-wise with horizon i in rows
+# i * n_nodes to (i + 1) * n_nodes. The IA of the clustered horizon is returned and saved as IA.
+def save_horizons(output_folder, IA, horizons, n_clusters, cluster_hops, stats, normalization='offdiag'):
+    names = [live_edge.horizon_name(horizon) for horizon in horizons]
+    if issparse(IA[0]):
+        save_npz(f"{output_folder}/IA_hops.npz", vstack(IA).tocsr())
+    else:
+        np.save(f"{output_folder}/IA_hops.npy", np.stack(IA))
+
+    selected = clustered_horizon(horizons, cluster_hops)
+    if cluster_hops == 'all':
+        clusters = {name: pipeline.clustering(n_clusters, horizon_IA, normalization) for name, horizon_IA in zip(names, IA)}
+        with open(f'{output_folder}/clusters_hops.json', 'w') as file:
+            json.dump(clusters, file, indent=4)
+
+    with open(f'{output_folder}/hops.json', 'w') as file:
+        json.dump({'horizons': names, 'clustered': selected}, file, indent=4)
+    stats.update({'horizons': names, 'clustered_horizon': selected})
+    return IA[names.index(selected)]
+
+def clustered_horizon(horizons, cluster_hops):
+    names = [live_edge.horizon_name(horizon) for horizon in horizons]
+    selected = names[-1] if cluster_hops in (None, 'all') else cluster_hops.strip().lower()
+    if selected not in names:
+        raise ValueError(f"Horizon {cluster_hops} is not one of the simulated horizons {names}!")
+    return selected
+
+def clustering_normalization(args):
+    if args.normalization != 'auto':
+        return args.normalization
+    return 'scaled' if args.components else 'offdiag'
+
+def adaptive_options(args):
+    return {'precision': args.precision, 'error': args.error, 'time_budget': args.time_budget}
+
+def memmap_path(args, output_folder):
+    return f"{output_folder}/IA.npy" if args.accumulator == 'memmap' else None
+
+def checkpoint_options(args, output_folder):
+    if args.checkpoint_every is None and not args.resume and args.extend is None:
+        return {}
+
+    options = {
+        'checkpoint_folder': output_folder, 'resume': args.resume, 'extend_from': args.extend,
+        'checkpoint_run': {'dataset': args.dataset, 'type': args.type},
+    }
+    if args.checkpoint_every is not None:
+        options['checkpoint_every'] = args.checkpoint_every
+    return options
+
+# Checkpointed runs need a fixed seed so that weights and worlds match after a restart
+def run_seed(args, output_folder):
+    if args.seed is not None or not checkpoint_options(args, output_folder):
+        return args.seed
+
+    seed = checkpoint.saved_seed(args.extend if args.extend is not None else output_folder)
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+        print(f"Checkpointed run seed: {seed}")
+    return seed
+
+# Nodes given more than once count once, in increasing order
+def node_list(value):
+    return None if value is None else np.unique([int(node) for node in value.split(',')]).tolist()
+
+def run_query(output_folder, args):
+    targets, seeds = node_list(args.targets), node_list(args.seeds)
+    if args.worlds is not None:
+        IA = pipeline.replay_query(args.worlds, args.threshold, targets, seeds)
+        query = {'targets': targets, 'seeds': seeds, 'worlds': args.worlds}
+    else:
+        IA = pipeline.query(args.dataset, args.type, args.simulations, args.threshold, targets, seeds, args.seed)
+        query = {'targets': targets, 'seeds': seeds, 'n_simulations': args.simulations, 'seed': args.seed}
+
+    np.save(f"{output_folder}/IA_query.npy", IA)
+    with open(f'{output_folder}/query.json', 'w') as file:
+        json.dump(query, file, indent=4)
+    print(f"Query IA of shape {IA.shape} saved")
+
+# Greedy seeds, or the spread of the --seeds set, with the access of every cluster of the
+# run's clusters.json when there is one
+def run_influence(output_folder, args):
+    forests = pipeline.influence_forests(args.dataset, args.type, args.influence_worlds, args.seed, args.sampling, args.worlds)
+    labels = cluster_labels(output_folder, forests['start'].shape[-1])
+    if args.objective == 'balanced' and labels is None and args.seeds is None:
+        raise ValueError(f'The balanced objective needs the clusters.json of a run in {output_folder}!')
+
+    result = {'n_worlds': len(forests['start'])}
+    if args.seeds is not None:
+        seeds = node_list(args.seeds)
+    else:
+        seeds, values = influence.maximize(forests, args.k, args.threshold, args.objective, labels)
+        result.update({'objective': args.objective, 'values': values})
+    result.update({'seeds': seeds, 'spread': float(influence.spread(forests, seeds, args.threshold))})
+    if labels is not None:
+        result['cluster_access'] = influence.cluster_access(forests, seeds, args.threshold, labels).tolist()
+
+    with open(f'{output_folder}/influence.json', 'w') as file:
+        json.dump(result, file, indent=4)
+    print(f"Spread of {len(seeds)} seeds: {result['spread']}")
+
+def cluster_labels(output_folder, n_nodes):
+    path = f'{output_folder}/clusters.json'
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        clusters = json.load(file)
+    labels = np.zeros(n_nodes, dtype=np.int64)
+    for label, nodes in enumerate(clusters.values()):
+        labels[nodes] = label
+    return labels
+
+# Bootstrap stability of the run's clusters.json over the block counts of a --blocks run
+def run_stability(output_folder, args):
+    if not blocks.exists(output_folder):
+        raise ValueError(f'No block counts in {output_folder}, run with --blocks first!')
+    block_counts, _ = blocks.load(output_folder)
+    reference = cluster_labels(output_folder, blocks.node_count(block_counts))
+    if reference is None:
+        raise ValueError(f'Stability needs the clusters.json of a run in {output_folder}!')
+
+    result = stability.run(
+        output_folder, reference, args.clusters, args.replicates, args.seed, args.workers, clustering_normalization(args)
+    )
+    with open(f'{output_folder}/stability.json', 'w') as file:
+        json.dump(result, file, indent=4)
+    print(f"Mean ARI against the reference over {args.replicates} replicates: {result['reference_ari']['mean']}")
+
+# Full IA from the worlds of a world bank, with any threshold, reach kernel, accumulator and
+# hop horizons
+def run_replay(output_folder, args, horizons):
+    if args.components or checkpoint_options(args, None) or args.precision is not None or args.time_budget is not None:
+        raise ValueError('Replays do not support decomposed, checkpointed or adaptive runs!')
+
+    stats = {}
+    IA = pipeline.replay_simulation(
+        args.worlds, args.threshold, reach=args.reach, accumulator=args.accumulator, memmap_path=memmap_path(args, output_folder),
+        horizons=horizons, stats=stats
+    )
+    normalization = clustering_normalization(args)
+    if horizons is not None:
+        IA = save_horizons(output_folder, IA, horizons, args.clusters, args.cluster_hops, stats, normalization)
+    finish(output_folder, IA, args.clusters, stats, normalization)
+
+def run_shard(output_folder, args):
+    if args.seed is None:
+        raise ValueError('Sharded runs need an explicit --seed shared by all shards!')
+    if args.accumulator == 'memmap':
+        raise ValueError('Sharded runs do not support the memmap accumulator!')
+    if args.components or args.worlds is not None or args.save_worlds or args.blocks is not None:
+        raise ValueError('Sharded runs do not support the component decomposition, world banks or block counts!')
+    if args.model != 'lt' or args.hops is not None:
+        raise ValueError('Sharded runs only sample linear threshold worlds, without hop horizons!')
+
+    shard, n_shards = (int(value) for value in args.shard.split('/'))
+    if not 0 <= shard < n_shards:
+        raise ValueError(f'Invalid shard: {args.shard}')
+
+    counts = pipeline.run_shard(
+        args.dataset, args.type, args.simulations, args.threshold, shard, n_shards, args.seed, args.reach, args.workers,
+        args.accumulator, args.sampling
+    )
+
+    shards.write_shard(output_folder, counts, {
+        'dataset': args.dataset,
+        'type': args.type,
+        'threshold': args.threshold,
+        'n_simulations': args.simulations,
+        'sampling': args.sampling,
+        'seed': args.seed,
+        'shard': shard,
+        'n_shards': n_shards,
+        'shard_simulations': parallel.split_simulations(args.simulations, n_shards)[shard],
+    })
+    print(f'Shard {shard}/{n_shards} done')
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
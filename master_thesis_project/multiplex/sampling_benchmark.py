@@ -0,0 +1,74 @@
+import os
+import argparse
+import json
+import time
+import numpy as np
+
+from src import pipeline
+from src import live_edge
+from src import accumulators
+
+OUTPUT_PATH = 'multiplex/output'
+SAMPLING_MODES = ['mc', 'stratified', 'antithetic', 'sobol']
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', default='politicsuk')
+    parser.add_argument('--type', default='weighted')  # Options: 'random', 'uniform', 'weighted', 'trivalency'
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--simulations', type=int, default=1_024)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--reference', type=int, default=20_000, help='plain Monte Carlo simulations for the reference IA')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reach', default='forest')
+    return parser.parse_args()
+
+def estimate(arrays_per_layer, n_simulations, threshold, seed_sequence, sampling, reach):
+    n_nodes = len(arrays_per_layer[0]['indptr']) - 1
+    counts = accumulators.create('dense', n_nodes, n_simulations)
+
+    start_time = time.process_time()
+    rng = np.random.default_rng(seed_sequence)
+    live_edge.count_layer_worlds(arrays_per_layer, n_simulations, threshold, rng, reach, counts, sampling)
+    return counts.result() / n_simulations, time.process_time() - start_time
+
+# Error is measured against a long plain Monte Carlo run. That reference is noisy itself, so
+# its expected squared error is subtracted, and efficiency is 1 / (squared error * CPU time).
+def main():
+    args = parse_args()
+    layers = pipeline.weighted_layers(args.dataset, args.type, args.seed)
+    arrays_per_layer = live_edge.layer_arrays(layers)
+    streams = np.random.SeedSequence(args.seed).spawn(len(SAMPLING_MODES) * args.repeats + 1)
+
+    reference, _ = estimate(arrays_per_layer, args.reference, args.threshold, streams[-1], 'mc', args.reach)
+    offdiag = ~np.eye(len(reference), dtype=bool)
+    reference_error = float((reference * (1 - reference))[offdiag].mean() / args.reference)
+
+    results = {}
+    for index, sampling in enumerate(SAMPLING_MODES):
+        errors, cpu_times = [], []
+        for repeat in range(args.repeats):
+            stream = streams[index * args.repeats + repeat]
+            IA, cpu_time = estimate(arrays_per_layer, args.simulations, args.threshold, stream, sampling, args.reach)
+            errors.append(float(((IA - reference)[offdiag] ** 2).mean()) - reference_error)
+            cpu_times.append(cpu_time)
+
+        squared_error = max(float(np.mean(errors)), 1e-300)
+        cpu_time = float(np.mean(cpu_times))
+        results[sampling] = {
+            'rmse': float(np.sqrt(squared_error)),
+            'cpu_time': cpu_time,
+            'efficiency': 1 / (squared_error * cpu_time),
+        }
+
+    for sampling, result in results.items():
+        result['relative_efficiency'] = result['efficiency'] / results['mc']['efficiency']
+        print(f"{sampling:>10}: rmse {result['rmse']:.6f}, cpu time {result['cpu_time']:.3f} s, "
+              f"efficiency x{result['relative_efficiency']:.2f} of mc")
+
+    os.makedirs(OUTPUT_PATH, exist_ok=True)
+    with open(f'{OUTPUT_PATH}/sampling_benchmark_{args.dataset}_{args.type}_{args.simulations}_{args.threshold}.json', 'w') as file:
+        json.dump({'arguments': vars(args), 'reference_error': reference_error, 'results': results}, file, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import json
+import numpy as np
+from numpy.lib.format import open_memmap
+from scipy.sparse import csr_matrix, issparse, vstack, save_npz, load_npz
+
+from src import accumulators
+from src import parallel
+
+# Block-resolved counts
+# A block-resolved run splits its worlds into blocks, block b drawing from the b-th child of
+# the run's SeedSequence, and keeps the counts of every block: dense as one (n_blocks, n, n)
+# blocks.npy, sparse as one blocks.npz with the flattened counts of block b in row b.
+# Weighting the blocks with bootstrap multiplicities rebuilds resampled IA without
+# simulating again.
+def paths(folder):
+    return f'{folder}/blocks', f'{folder}/blocks.json'
+
+def run(count_block, n_nodes, n_simulations, n_blocks, seed, folder):
+    if not 1 <= n_blocks <= n_simulations:
+        raise ValueError(f'Cannot split {n_simulations} simulations into {n_blocks} blocks!')
+
+    seed_sequence = np.random.SeedSequence(seed)
+    sizes = parallel.split_simulations(n_simulations, n_blocks)
+    counts_path, manifest_path = paths(folder)
+
+    dense = None
+    rows = []
+    total = None
+    for index, (n_worlds, stream) in enumerate(zip(sizes, seed_sequence.spawn(n_blocks))):
+        counts = count_block(n_worlds, stream)
+        if issparse(counts):
+            rows.append(csr_matrix(counts).reshape(1, n_nodes * n_nodes))
+        else:
+            if dense is None:
+                dense = open_memmap(f'{counts_path}.npy', mode='w+', dtype=accumulators.count_dtype(max(sizes)),
+                                    shape=(n_blocks, n_nodes, n_nodes))
+            dense[index] = counts
+        total = accumulators.widen(counts, n_simulations) if total is None else accumulators.widen(total, n_simulations) + counts
+        print(f"Block {index + 1}/{n_blocks}")
+
+    if rows:
+        save_npz(f'{counts_path}.npz', vstack(rows).tocsr())
+    else:
+        dense.flush()
+        del dense
+    with open(manifest_path, 'w') as file:
+        json.dump({'n_blocks': n_blocks, 'sizes': sizes, 'seed': seed if seed is not None else seed_sequence.entropy}, file, indent=4)
+    return total
+
+def exists(folder):
+    counts_path, manifest_path = paths(folder)
+    return accumulators.counts_exist(counts_path) and os.path.exists(manifest_path)
+
+def load(folder):
+    counts_path, manifest_path = paths(folder)
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+    if os.path.exists(f'{counts_path}.npz'):
+        return load_npz(f'{counts_path}.npz'), manifest
+    return np.load(f'{counts_path}.npy', mmap_mode='r'), manifest
+
+def node_count(block_counts):
+    return int(round(np.sqrt(block_counts.shape[1]))) if issparse(block_counts) else block_counts.shape[1]
+
+# IA of the blocks taken multiplicity[b] times each
+def resampled_ia(block_counts, sizes, multiplicity):
+    n_worlds = float(np.dot(multiplicity, sizes))
+    if issparse(block_counts):
+        n_nodes = node_count(block_counts)
+        counts = csr_matrix(multiplicity[None, :].astype(float)) @ block_counts
+        return counts.reshape(n_nodes, n_nodes).tocsr() / n_worlds
+
+    IA = np.zeros(block_counts.shape[1:])
+    for index in np.flatnonzero(multiplicity):
+        IA += multiplicity[index] * block_counts[index]
+    return IA / n_worlds
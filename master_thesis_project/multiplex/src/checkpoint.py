@@ -0,0 +1,163 @@
+import glob
+import json
+import os
+import time
+import numpy as np
+from scipy.sparse import issparse
+
+from src import accumulators
+
+CHECKPOINT_EVERY = 1_000
+# Runs that only stop adaptively check their budget and precision this often
+ADAPTIVE_EVERY = 100
+
+# Checkpointed and adaptive runs are split into chunks of worlds. Chunk c draws from the c-th child of
+# the run's SeedSequence, so the RNG state is the seed entropy plus the number of finished
+# chunks, and resuming or extending continues the exact same stream.
+def paths(folder):
+    return f'{folder}/checkpoint_counts', f'{folder}/checkpoint.json'
+
+# Every save writes the counts to a file named after the number of finished chunks and then
+# replaces the state, which names that file, in one step. A crash before the replace leaves the
+# previous state and its counts in place, so a resumed run never counts a chunk twice.
+def counts_path(folder, state):
+    return f"{folder}/{state.get('counts', 'checkpoint_counts')}"
+
+def exists(folder):
+    _, state_path = paths(folder)
+    if not os.path.exists(state_path):
+        return False
+    with open(state_path, 'r') as file:
+        state = json.load(file)
+    return accumulators.counts_exist(counts_path(folder, state))
+
+def save(folder, counts, state):
+    base_path, state_path = paths(folder)
+    state['counts'] = f"{os.path.basename(base_path)}_{state['chunks']}"
+    accumulators.save_counts(counts_path(folder, state), counts)
+
+    with open(f'{state_path}.tmp', 'w') as file:
+        json.dump(state, file, indent=4)
+    os.replace(f'{state_path}.tmp', state_path)
+
+    # counts of earlier checkpoints are no longer referenced
+    extension = '.npz' if issparse(counts) else '.npy'
+    for path in glob.glob(f'{base_path}*'):
+        if path != f'{counts_path(folder, state)}{extension}':
+            os.remove(path)
+
+def load(folder):
+    _, state_path = paths(folder)
+    with open(state_path, 'r') as file:
+        state = json.load(file)
+    return accumulators.load_counts(counts_path(folder, state)), state
+
+def saved_seed(folder):
+    return load(folder)[1]['seed'] if exists(folder) else None
+
+def run(count_chunk, n_nodes, n_simulations, seed, folder=None, every=None, resume=False, extend_from=None,
+        precision=None, error='max', time_budget=None, stats=None, run_info=None):
+    source = extend_from if extend_from is not None else folder if resume else None
+    if every is None:
+        every = CHECKPOINT_EVERY if folder is not None else ADAPTIVE_EVERY
+
+    if source is not None and exists(source):
+        counts, state = load(source)
+        if seed is not None and seed != state['seed']:
+            raise ValueError(f"Checkpoint was written with seed {state['seed']}, not {seed}")
+        # dataset, type, sampling, model and size of the run the counts came from
+        for key, value in (run_info or {}).items():
+            if key in state and state[key] != value:
+                raise ValueError(f"Checkpoint was written with {key} {state[key]}, not {value}!")
+        print(f"Continuing from {state['completed']} simulations in {source}")
+    else:
+        if extend_from is not None:
+            raise ValueError(f'No checkpoint found in {extend_from}')
+        seed_sequence = np.random.SeedSequence(seed)
+        counts = None
+        state = {
+            'seed': seed if seed is not None else seed_sequence.entropy,
+            'completed': 0,
+            'chunks': 0,
+        }
+    state.update(run_info or {})
+
+    if state['completed'] > n_simulations:
+        raise ValueError(f"Checkpoint already holds {state['completed']} simulations, more than {n_simulations}")
+
+    start_time = time.time()
+    stopped_by = 'n_simulations'
+    while state['completed'] < n_simulations:
+        # a run always counts at least one chunk, however small its budget
+        if time_budget is not None and state['completed'] > 0 and time.time() - start_time >= time_budget:
+            stopped_by = 'time_budget'
+            break
+
+        n_worlds = min(every, n_simulations - state['completed'])
+        stream = np.random.SeedSequence(state['seed'], spawn_key=(state['chunks'],))
+
+        chunk = count_chunk(n_worlds, stream)
+        counts = accumulators.widen(chunk, n_simulations) if counts is None else accumulators.widen(counts, n_simulations) + chunk
+        state['completed'] += n_worlds
+        state['chunks'] += 1
+
+        if folder is not None:
+            save(folder, counts, state)
+            print(f"Checkpoint: {state['completed']}/{n_simulations} simulations")
+
+        if precision is not None:
+            max_error, mean_error = standard_errors(counts, state['completed'])
+            print(f"Standard error after {state['completed']} simulations: max {max_error}, mean {mean_error}")
+            if (max_error if error == 'max' else mean_error) <= precision:
+                stopped_by = 'precision'
+                break
+
+    if counts is None:
+        counts = accumulators.DenseCounts.zeros(n_nodes, n_simulations).result()
+
+    if stats is not None:
+        max_error, mean_error = standard_errors(counts, state['completed'])
+        stats.update({
+            'n_simulations': state['completed'],
+            'max_standard_error': max_error,
+            'mean_standard_error': mean_error,
+            'stopped_by': stopped_by,
+        })
+
+    return counts, state['completed']
+
+# Every IA entry is the mean of one indicator per world, so its standard error follows
+# from the count alone. An entry reached in no world or in every world would have no error
+# at all, so p is kept 1/n away from 0 and 1, as if a single world had gone the other way;
+# a rare pair cannot pass the precision test before it is ever hit. Rows are processed in
+# blocks to keep the temporaries small.
+def standard_errors(counts, n_simulations, block=1024):
+    n_nodes = counts.shape[0]
+    if n_simulations < 2 or n_nodes < 2:
+        return float('inf'), float('inf')
+    n_offdiag = n_nodes * (n_nodes - 1)
+
+    if issparse(counts):
+        counts = counts.tocoo()
+        offdiag = counts.row != counts.col
+        errors = entry_errors(counts.data[offdiag] / n_simulations, n_simulations)
+        # the entries a sparse matrix leaves out were never reached
+        n_unreached = n_offdiag - int(offdiag.sum())
+        unreached = float(entry_errors(0.0, n_simulations)) if n_unreached else 0.0
+        return max(float(errors.max(initial=0.0)), unreached), (float(errors.sum()) + n_unreached * unreached) / n_offdiag
+
+    max_error = 0.0
+    total_error = 0.0
+    for first in range(0, n_nodes, block):
+        errors = entry_errors(counts[first:first + block] / n_simulations, n_simulations)
+        # the diagonal is always 1 and has no error
+        rows = np.arange(len(errors))
+        errors[rows, first + rows] = 0.0
+        max_error = max(max_error, float(errors.max()))
+        total_error += float(errors.sum())
+
+    return max_error, total_error / n_offdiag
+
+def entry_errors(p, n_simulations):
+    p = np.clip(p, 1 / n_simulations, 1 - 1 / n_simulations)
+    return np.sqrt(p * (1 - p) / (n_simulations - 1))
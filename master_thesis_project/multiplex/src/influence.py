@@ -0,0 +1,137 @@
+import heapq
+import numpy as np
+
+from src import live_edge
+
+INFLUENCE_WORLDS = 1_000
+
+# Seed sets
+# A seed set reaches a node in a world when at least the required number of layers have one
+# of its seeds among the node's ancestors. Every world keeps the preorder and the ranges of
+# the live-edge forest of every layer, and the chosen seeds leave the nodes they cover in
+# every layer and the number of covered layers of every node. The gain of a candidate walks
+# its ranges, so CELF only pays for the candidates it re-evaluates.
+def sample_forests(arrays_per_layer, n_worlds, rng, sampling='mc'):
+    return world_forests(np.concatenate(list(live_edge.sample_layer_worlds(arrays_per_layer, n_worlds, rng, sampling=sampling))))
+
+# Forests of stored parents, also of a memory-mapped world bank
+def world_forests(parents):
+    forests = {name: np.empty(parents.shape, dtype=np.int32) for name in ('order', 'start', 'count')}
+    for world in range(len(parents)):
+        for layer, layer_parents in enumerate(np.asarray(parents[world])):
+            order, start, count = live_edge.forest(layer_parents)
+            forests['order'][world, layer], forests['start'][world, layer], forests['count'][world, layer] = order, start, count
+    return forests
+
+def empty_state(forests):
+    n_worlds, n_layers, n_nodes = forests['start'].shape
+    return {
+        'covered': np.zeros((n_worlds, n_layers, n_nodes), dtype=bool),
+        'layers': np.zeros((n_worlds, n_nodes), dtype=np.int64),
+    }
+
+# Nodes a seed reaches in every world and layer, with row = world * n_layers + layer
+def descendants(forests, seed):
+    n_worlds, n_layers, n_nodes = forests['start'].shape
+    start = forests['start'][:, :, seed].ravel().astype(np.int64)
+    count = forests['count'][:, :, seed].ravel().astype(np.int64)
+    rows = np.repeat(np.arange(n_worlds * n_layers), count)
+    positions = rows * n_nodes + np.repeat(start - np.cumsum(count) + count, count) + np.arange(count.sum())
+    return rows, forests['order'].reshape(-1)[positions]
+
+# New (world, node) pairs the seed would reach, as world * n_nodes + node
+def new_reach(forests, state, seed, required):
+    n_worlds, n_layers, n_nodes = forests['start'].shape
+    rows, nodes = descendants(forests, seed)
+    new = ~state['covered'].reshape(-1)[rows * n_nodes + nodes]
+    keys, added = np.unique((rows[new] // n_layers) * n_nodes + nodes[new], return_counts=True)
+    layers = state['layers'].reshape(-1)[keys]
+    return keys[(layers < required) & (layers + added >= required)]
+
+def add_seed(forests, state, seed):
+    n_worlds, n_layers, n_nodes = forests['start'].shape
+    rows, nodes = descendants(forests, seed)
+    state['covered'][rows // n_layers, rows % n_layers, nodes] = True
+    state['layers'] = state['covered'].sum(axis=1)
+    return state
+
+def reached(forests, seeds, threshold):
+    state = empty_state(forests)
+    for seed in seeds:
+        add_seed(forests, state, seed)
+    return state['layers'] >= live_edge.required_layers(forests['start'].shape[1], threshold)
+
+# Expected number of nodes the seed set reaches
+def spread(forests, seeds, threshold):
+    return reached(forests, seeds, threshold).sum() / len(forests['start'])
+
+# Probability that the seed set reaches every node
+def access(forests, seeds, threshold):
+    return reached(forests, seeds, threshold).mean(axis=0)
+
+# Expected gain of the candidate in every cluster
+def cluster_gains(forests, state, seed, required, labels, n_clusters):
+    keys = new_reach(forests, state, seed, required)
+    return np.bincount(labels[keys % forests['start'].shape[2]], minlength=n_clusters) / len(forests['start'])
+
+# Greedy seed selection
+# 'reach' maximizes the spread with CELF: every candidate's last gain waits in a max-heap and
+# only the top is re-evaluated. With one required layer the spread is submodular and CELF
+# picks the same seeds as the plain greedy, with more the stale gains are a heuristic bound.
+# 'balanced' maximizes the lowest mean access over the clusters, with the total gain breaking
+# ties. A minimum is not submodular, so every round evaluates all candidates.
+def maximize(forests, k, threshold, objective='reach', labels=None, candidates=None):
+    n_nodes = forests['start'].shape[2]
+    candidates = np.arange(n_nodes) if candidates is None else np.asarray(candidates, dtype=np.int64)
+    required = live_edge.required_layers(forests['start'].shape[1], threshold)
+    if objective == 'reach':
+        return celf(forests, k, required, candidates)
+    if objective == 'balanced':
+        if labels is None:
+            raise ValueError('The balanced objective needs cluster labels!')
+        return balanced_greedy(forests, k, required, np.asarray(labels), candidates)
+    raise ValueError(f"Unknown objective: {objective}")
+
+def celf(forests, k, required, candidates):
+    n_nodes = forests['start'].shape[2]
+    labels = np.zeros(n_nodes, dtype=np.int64)
+    state = empty_state(forests)
+
+    heap = [(-cluster_gains(forests, state, node, required, labels, 1)[0], int(node), 0) for node in candidates]
+    heapq.heapify(heap)
+    seeds, spreads = [], []
+    while heap and len(seeds) < k:
+        gain, node, evaluated = heapq.heappop(heap)
+        if evaluated < len(seeds):
+            heapq.heappush(heap, (-cluster_gains(forests, state, node, required, labels, 1)[0], node, len(seeds)))
+            continue
+
+        seeds.append(node)
+        spreads.append(float((spreads[-1] if spreads else 0.0) - gain))
+        add_seed(forests, state, node)
+        print(f'Seed {len(seeds)}/{k}: node {node}, spread {spreads[-1]} ...')
+    return seeds, spreads
+
+def balanced_greedy(forests, k, required, labels, candidates):
+    sizes = np.bincount(labels)
+    state = empty_state(forests)
+    reached_mean = np.zeros(len(sizes))
+
+    seeds, minimum_access = [], []
+    for _ in range(min(k, len(candidates))):
+        gains = np.stack([cluster_gains(forests, state, node, required, labels, len(sizes)) for node in candidates], axis=1)
+        worst = ((reached_mean[:, None] + gains) / np.maximum(sizes, 1)[:, None]).min(axis=0)
+        best = np.lexsort((gains.sum(axis=0), worst))[-1]
+
+        seeds.append(int(candidates[best]))
+        reached_mean += gains[:, best]
+        minimum_access.append(float(worst[best]))
+        add_seed(forests, state, seeds[-1])
+        candidates = np.delete(candidates, best)
+        print(f'Seed {len(seeds)}/{k}: node {seeds[-1]}, lowest cluster access {minimum_access[-1]} ...')
+    return seeds, minimum_access
+
+# Mean access of every cluster
+def cluster_access(forests, seeds, threshold, labels):
+    labels = np.asarray(labels)
+    return np.bincount(labels, weights=access(forests, seeds, threshold)) / np.maximum(np.bincount(labels), 1)
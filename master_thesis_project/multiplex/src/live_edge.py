@@ -0,0 +1,699 @@
+import numpy as np
+from collections import deque, Counter
+from itertools import combinations
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.stats import qmc
+
+from src import metrics
+
+WORLD_BATCH_SIZE = 64
+PAIR_BUFFER_SIZE = 1 << 24
+
+# In-edge arrays (CSR over targets)
+def in_edge_arrays(graph):
+    edges = np.array([(u, v, w) for u, v, w in graph.edges(data='weight')], dtype=float).reshape(-1, 3)
+    return edge_arrays(len(graph.nodes()), edges[:, 0], edges[:, 1], edges[:, 2])
+
+def edge_arrays(n_nodes, sources, targets, weights):
+    targets = np.asarray(targets).astype(np.int64)
+    order = np.argsort(targets, kind='stable')
+    sources = np.asarray(sources)[order].astype(np.int32)
+    targets = targets[order]
+    weights = np.asarray(weights, dtype=float)[order]
+
+    counts = np.bincount(targets, minlength=n_nodes)
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    return {
+        'indptr': indptr,
+        'sources': sources,
+        'weights': weights,
+        'keys': cumulative_keys(targets, indptr, weights),
+    }
+
+# cumulative in-weight of every edge within its target, shifted by the target id,
+# so one searchsorted over all targets picks a parent per node
+def cumulative_keys(targets, indptr, weights):
+    cumulative = np.concatenate(([0.0], np.cumsum(weights)))
+    cumulative = cumulative[1:] - np.repeat(cumulative[indptr[:-1]], np.diff(indptr))
+    return targets + np.minimum(cumulative, 1.0)
+
+# Sampler
+def sample_parents(arrays, n_worlds, rng, sampling='mc'):
+    n_nodes = len(arrays['indptr']) - 1
+    uniforms = sample_uniforms(n_worlds, n_nodes, rng, sampling)
+    return choose_parents(arrays, uniforms)
+
+# Variance reduction
+# The uniforms of a run, one per node and world, come from one design over all of its worlds
+# that is handed out batch by batch, so strata and point sets cover the whole run, or a
+# worker's chunk of it, instead of a single batch. Stratified runs put world i of a node in
+# stratum (step * i + shift) mod n_worlds, a random permutation of the strata per node that
+# needs no memory. Antithetic runs pair u with 1 - u within a batch and sobol runs draw
+# consecutive points of one scrambled Sobol sequence. Batches are powers of two, which keeps
+# every Sobol batch balanced and antithetic pairs whole.
+def uniform_batches(n_worlds, n_dims, rng, sampling='mc', batch_size=WORLD_BATCH_SIZE):
+    if sampling == 'stratified':
+        steps = coprime_steps(n_worlds, n_dims, rng)
+        shifts = rng.integers(max(n_worlds, 1), size=n_dims)
+    elif sampling == 'sobol':
+        if n_dims > qmc.Sobol.MAXDIM:
+            raise ValueError(f"Sobol sampling supports at most {qmc.Sobol.MAXDIM} dimensions, got {n_dims}")
+        sobol = qmc.Sobol(n_dims, scramble=True, seed=rng)
+    elif sampling not in ('mc', 'antithetic'):
+        raise ValueError(f"Unknown sampling mode: {sampling}")
+
+    done = 0
+    for size in batch_sizes(n_worlds, batch_size):
+        with metrics.phase('sampling'):
+            if sampling == 'mc':
+                uniforms = rng.random((size, n_dims))
+            elif sampling == 'stratified':
+                worlds = np.arange(done, done + size)[:, None]
+                uniforms = ((steps * worlds + shifts) % n_worlds + rng.random((size, n_dims))) / n_worlds
+            elif sampling == 'antithetic':
+                half = rng.random(((size + 1) // 2, n_dims))
+                uniforms = np.concatenate((half, 1.0 - half))[:size]
+            else:
+                uniforms = sobol.random(size)
+        yield uniforms
+        done += size
+
+def sample_uniforms(n_worlds, n_dims, rng, sampling='mc'):
+    return np.concatenate(list(uniform_batches(n_worlds, n_dims, rng, sampling, max(n_worlds, 1))))
+
+# Batch sizes of a run, each the largest power of two that fits
+def batch_sizes(n_worlds, batch_size):
+    done = 0
+    while done < n_worlds:
+        size = 1 << (int(min(batch_size, n_worlds - done)).bit_length() - 1)
+        yield size
+        done += size
+
+# Steps coprime with n_worlds, so every step * i + shift runs through all strata
+def coprime_steps(n_worlds, n_dims, rng):
+    steps = rng.integers(1, max(n_worlds, 2), size=n_dims)
+    invalid = np.gcd(steps, n_worlds) != 1
+    while invalid.any():
+        steps[invalid] = rng.integers(1, n_worlds, size=int(invalid.sum()))
+        invalid = np.gcd(steps, n_worlds) != 1
+    return steps
+
+def choose_parents(arrays, uniforms):
+    n_nodes = len(arrays['indptr']) - 1
+    return choose_node_parents(arrays, np.arange(n_nodes), uniforms)
+
+def choose_node_parents(arrays, nodes, uniforms):
+    indptr = arrays['indptr']
+    sources = arrays['sources']
+
+    if len(sources) == 0:
+        return np.full(np.shape(uniforms), -1, dtype=np.int32)
+
+    chosen = np.searchsorted(arrays['keys'], uniforms + nodes, side='right')
+    has_parent = chosen < indptr[nodes + 1]
+    parents = sources[np.minimum(chosen, len(sources) - 1)]
+    return np.where(has_parent, parents, -1).astype(np.int32)
+
+def sample_worlds(arrays, n_worlds, rng, batch_size=WORLD_BATCH_SIZE, sampling='mc'):
+    n_nodes = len(arrays['indptr']) - 1
+    for uniforms in uniform_batches(n_worlds, n_nodes, rng, sampling, batch_size):
+        yield choose_parents(arrays, uniforms)
+
+# Forest reachability
+# A live-edge world gives every node at most one parent, so it is a set of in-trees
+# whose roots are either parentless nodes or a single cycle. Cycles are replaced by a
+# virtual root, the forest is laid out in preorder and the descendants of every node
+# become one contiguous range of that order.
+def forest(parents):
+    n_nodes = len(parents)
+    nodes = np.arange(n_nodes)
+    parents = np.where(parents == nodes, -1, parents)
+    live = parents >= 0
+
+    links = csr_matrix((np.ones(live.sum()), (parents[live], nodes[live])), shape=(n_nodes, n_nodes))
+    n_components, labels = connected_components(links, directed=True, connection='strong')
+    component_sizes = np.bincount(labels, minlength=n_components)
+    on_cycle = component_sizes[labels] > 1
+
+    cycle_ids = np.cumsum(component_sizes > 1) - 1
+    n_cycles = int((component_sizes > 1).sum())
+    root = n_nodes + n_cycles
+    n_total = root + 1
+
+    tree_parent = np.full(n_total, root, dtype=np.int64)
+    tree_parent[:n_nodes] = np.where(live, parents, root)
+    tree_parent[:n_nodes][on_cycle] = n_nodes + cycle_ids[labels[on_cycle]]
+    tree_parent[root] = -1
+
+    slots = np.zeros(n_total, dtype=np.int64)
+    slots[:n_nodes] = 1
+
+    # levels from the root down
+    children = np.flatnonzero(tree_parent >= 0)
+    children = children[np.argsort(tree_parent[children], kind='stable')]
+    indptr = np.zeros(n_total + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tree_parent[children], minlength=n_total), out=indptr[1:])
+
+    levels = []
+    frontier = np.array([root])
+    while len(frontier):
+        frontier = children[segments(indptr, frontier)]
+        if len(frontier):
+            levels.append(frontier)
+
+    size = slots.copy()
+    for level in reversed(levels):
+        np.add.at(size, tree_parent[level], size[level])
+
+    tin = np.zeros(n_total, dtype=np.int64)
+    for level in levels:
+        level_parents = tree_parent[level]
+        preceding = np.cumsum(size[level]) - size[level]
+        group_start = np.flatnonzero(np.r_[True, level_parents[1:] != level_parents[:-1]])
+        preceding -= np.repeat(preceding[group_start], np.diff(np.r_[group_start, len(level)]))
+        tin[level] = tin[level_parents] + slots[level_parents] + preceding
+
+    order = np.empty(n_nodes, dtype=np.int64)
+    order[tin[:n_nodes]] = nodes
+
+    key = np.where(on_cycle, tree_parent[:n_nodes], nodes)
+    return order, tin[key], size[key]
+
+def segments(indptr, rows):
+    counts = indptr[rows + 1] - indptr[rows]
+    return np.repeat(indptr[rows] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+def seed_chunks(count, max_pairs=PAIR_BUFFER_SIZE):
+    bounds = np.searchsorted(np.cumsum(count), np.arange(max_pairs, count.sum(), max_pairs), side='right')
+    return [seeds for seeds in np.split(np.arange(len(count)), np.unique(bounds)) if len(seeds)]
+
+def descendant_pairs(order, start, count, seeds):
+    counts = count[seeds]
+    positions = np.repeat(start[seeds] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return order[positions], np.repeat(seeds, counts)
+
+def reach_pairs(parents, max_pairs=PAIR_BUFFER_SIZE):
+    order, start, count = forest(parents)
+    for seeds in seed_chunks(count, max_pairs):
+        yield descendant_pairs(order, start, count, seeds)
+
+# Hop-limited reachability
+# A seed reaches a node within h hops when it is one of the node's first h ancestors. Walking
+# every node up to the largest finite horizon gives each (node, seed) pair its first hop
+# distance, so all finite horizons come from the same walk. Unlimited horizons (None) use
+# the reach kernel, and every horizon gets its own accumulator.
+def hop_pairs(parents, max_hops):
+    n_nodes = len(parents)
+    nodes = np.arange(n_nodes)
+    parents = np.where(parents == nodes, -1, parents)
+
+    walkers, current = nodes, nodes
+    keys, hops = [nodes * n_nodes + nodes], [np.zeros(n_nodes, dtype=np.int64)]
+    for hop in range(1, max_hops + 1):
+        current = parents[current]
+        live = (current >= 0) & (current != walkers)
+        walkers, current = walkers[live], current[live]
+        if not len(walkers):
+            break
+        keys.append(walkers * n_nodes + current)
+        hops.append(np.full(len(walkers), hop))
+
+    # a walk that entered a cycle revisits ancestors, the first visit is the closest
+    keys, first = np.unique(np.concatenate(keys), return_index=True)
+    return keys // n_nodes, keys % n_nodes, np.concatenate(hops)[first]
+
+# Horizons given as e.g. '1,2,3,inf', sorted with the unlimited horizon last
+def parse_horizons(value):
+    horizons = set()
+    for item in value.split(','):
+        item = item.strip().lower()
+        if item in ('inf', 'none'):
+            horizons.add(None)
+        elif not item.isdigit() or int(item) < 1:
+            raise ValueError(f"Invalid hop horizon: {item}")
+        else:
+            horizons.add(int(item))
+    return sorted(horizon for horizon in horizons if horizon is not None) + ([None] if None in horizons else [])
+
+def horizon_name(horizon):
+    return 'inf' if horizon is None else str(horizon)
+
+# Bit-parallel reachability
+# Up to 64 worlds share one uint64 per (node, seed): bit w is set when the seed reaches
+# the node in world w. Masks are pushed along the union of live edges of all worlds until
+# nothing changes, and IA counts are popcounts of the final masks.
+BITSET_WORLDS = 64
+BITSET_BUFFER_SIZE = 1 << 20
+POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+def popcount(values):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return POPCOUNT_TABLE[values.view(np.uint8).reshape(values.shape + (8,))].sum(axis=-1)
+
+def live_edge_masks(parents):
+    n_worlds, n_nodes = parents.shape
+    worlds, children = np.nonzero((parents >= 0) & (parents != np.arange(n_nodes)))
+    if len(children) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+
+    keys = parents[worlds, children].astype(np.int64) * n_nodes + children
+    bits = np.left_shift(np.uint64(1), worlds.astype(np.uint64))
+
+    order = np.argsort(keys, kind='stable')
+    keys, bits = keys[order], bits[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    masks = np.bitwise_or.reduceat(bits, starts)
+    keys = keys[starts]
+
+    # group by child so updates can be reduced per target row
+    order = np.argsort(keys % n_nodes, kind='stable')
+    return keys[order] // n_nodes, keys[order] % n_nodes, masks[order]
+
+def reach_masks(edges, n_worlds, n_nodes, seeds):
+    sources, targets, masks = edges
+    full = np.uint64((1 << n_worlds) - 1) if n_worlds < 64 else np.uint64(~np.uint64(0))
+
+    reach = np.zeros((n_nodes, len(seeds)), dtype=np.uint64)
+    reach[seeds, np.arange(len(seeds))] = full
+
+    changed = np.zeros(n_nodes, dtype=bool)
+    changed[seeds] = True
+    while changed.any():
+        active = changed[sources]
+        if not active.any():
+            break
+        active_sources, active_targets = sources[active], targets[active]
+        updates = reach[active_sources] & masks[active][:, None]
+
+        starts = np.flatnonzero(np.r_[True, active_targets[1:] != active_targets[:-1]])
+        rows = active_targets[starts]
+        merged = reach[rows] | np.bitwise_or.reduceat(updates, starts, axis=0)
+
+        changed[:] = False
+        changed[rows] = (merged != reach[rows]).any(axis=1)
+        reach[rows] = merged
+
+    return reach
+
+def bitset_seed_blocks(n_edges, n_nodes):
+    block = max(1, min(n_nodes, BITSET_BUFFER_SIZE // max(n_edges, 1)))
+    return [np.arange(start, min(start + block, n_nodes)) for start in range(0, n_nodes, block)]
+
+def bitset_counts(parents, out):
+    for first in range(0, len(parents), BITSET_WORLDS):
+        batch = parents[first:first + BITSET_WORLDS]
+        n_nodes = batch.shape[1]
+        edges = live_edge_masks(batch)
+        for seeds in bitset_seed_blocks(len(edges[0]), n_nodes):
+            out.add_columns(seeds, popcount(reach_masks(edges, len(batch), n_nodes, seeds)))
+    return out
+
+# Per-seed BFS reachability
+def children_arrays(parents):
+    n_nodes = len(parents)
+    children = np.flatnonzero((parents >= 0) & (parents != np.arange(n_nodes)))
+    order = np.argsort(parents[children], kind='stable')
+    children = children[order]
+
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(parents[children], minlength=n_nodes), out=indptr[1:])
+    return indptr, children
+
+def get_activated_nodes(indptr, children, seed):
+    reachable = {seed}
+    queue = deque([seed])
+
+    while queue:
+        node = queue.popleft()
+        for neighbor in children[indptr[node]:indptr[node + 1]]:
+            if neighbor not in reachable:
+                reachable.add(neighbor)
+                queue.append(neighbor)
+
+    return list(reachable)
+
+# Layers
+def layer_arrays(layers):
+    return [in_edge_arrays(layer) for layer in layers]
+
+def sample_layer_worlds(arrays_per_layer, n_worlds, rng, batch_size=WORLD_BATCH_SIZE, sampling='mc'):
+    n_nodes = len(arrays_per_layer[0]['indptr']) - 1
+    for uniforms in layer_uniform_batches([n_nodes] * len(arrays_per_layer), n_worlds, rng, sampling, batch_size):
+        with metrics.phase('sampling'):
+            parents = np.stack([choose_parents(arrays, layer) for arrays, layer in zip(arrays_per_layer, uniforms)], axis=1)
+        yield parents
+
+# One uniform batch per layer. Sobol runs use one sequence over all layers, so layers are spread
+# out jointly; the other modes keep a design per layer, drawn batch by batch in layer order.
+def layer_uniform_batches(layer_dims, n_worlds, rng, sampling='mc', batch_size=WORLD_BATCH_SIZE):
+    if sampling == 'sobol':
+        splits = np.cumsum(layer_dims)[:-1]
+        for uniforms in uniform_batches(n_worlds, sum(layer_dims), rng, sampling, batch_size):
+            yield np.split(uniforms, splits, axis=1)
+        return
+    yield from zip(*[uniform_batches(n_worlds, n_dims, rng, sampling, batch_size) for n_dims in layer_dims])
+
+def required_layers(n_layers, threshold):
+    return next((count for count in range(1, n_layers + 1) if count / n_layers >= threshold), n_layers + 1)
+
+def threshold_pairs(layer_parents, threshold, max_pairs=PAIR_BUFFER_SIZE):
+    n_nodes = layer_parents.shape[1]
+    required = required_layers(len(layer_parents), threshold)
+    forests = [forest(parents) for parents in layer_parents]
+    total_count = sum(count for _, _, count in forests)
+
+    for seeds in seed_chunks(total_count, max_pairs):
+        keys = []
+        for order, start, count in forests:
+            nodes, pair_seeds = descendant_pairs(order, start, count, seeds)
+            keys.append(nodes * n_nodes + pair_seeds)
+
+        keys, counts = np.unique(np.concatenate(keys), return_counts=True)
+        keys = keys[counts >= required]
+        yield keys // n_nodes, keys % n_nodes
+
+def threshold_bitset_counts(layer_parents, threshold, out):
+    n_layers = layer_parents.shape[1]
+    required = required_layers(n_layers, threshold)
+    if required > n_layers:
+        return out
+
+    for first in range(0, len(layer_parents), BITSET_WORLDS):
+        batch = layer_parents[first:first + BITSET_WORLDS]
+        n_nodes = batch.shape[2]
+        layer_edges = [live_edge_masks(batch[:, layer]) for layer in range(n_layers)]
+        n_edges = max(len(edges[0]) for edges in layer_edges)
+
+        for seeds in bitset_seed_blocks(n_edges, n_nodes):
+            layer_reach = [reach_masks(edges, len(batch), n_nodes, seeds) for edges in layer_edges]
+            # worlds where at least `required` layers reach the node
+            reach = np.zeros_like(layer_reach[0])
+            for combination in combinations(layer_reach, required):
+                reach |= np.bitwise_and.reduce(combination)
+            out.add_columns(seeds, popcount(reach))
+    return out
+
+# With a world bank every sampled batch is also written to its rows
+def count_layer_worlds(arrays_per_layer, n_worlds, threshold, rng, reach, counts, sampling='mc', horizons=None, bank=None,
+                       model='lt'):
+    if model == 'ic':
+        if horizons is not None or bank is not None:
+            raise ValueError('Independent cascade runs do not support hop-limited IA or world banks!')
+        return count_cascade_layer_worlds(arrays_per_layer, n_worlds, threshold, rng, counts, sampling)
+    if model != 'lt':
+        raise ValueError(f"Unknown diffusion model: {model}")
+
+    done = 0
+    progress = metrics.Progress(n_worlds)
+    for parents in sample_layer_worlds(arrays_per_layer, n_worlds, rng, sampling=sampling):
+        if bank is not None:
+            bank[done:done + len(parents)] = parents
+        with metrics.phase('reachability'):
+            if horizons is None:
+                count_layer_batch(parents, threshold, reach, counts)
+            else:
+                count_layer_horizon_batch(parents, threshold, horizons, reach, counts)
+        done += len(parents)
+        progress.update(done)
+    return counts
+
+def count_layer_batch(parents, threshold, reach, counts):
+    if reach == 'bitset':
+        return threshold_bitset_counts(parents, threshold, counts)
+    if reach == 'scc':
+        nodes = np.arange(parents.shape[2])
+        for world in parents:
+            layer_edges = []
+            for layer_parents in world:
+                children = np.flatnonzero((layer_parents >= 0) & (layer_parents != nodes))
+                layer_edges.append((layer_parents[children], children))
+            threshold_condensation_counts(layer_edges, len(nodes), threshold, counts)
+        return counts
+
+    for world in parents:
+        if reach == 'forest':
+            for nodes, seeds in threshold_pairs(world, threshold):
+                counts.add_pairs(nodes, seeds)
+        elif reach == 'bfs':
+            layer_children = [children_arrays(layer_parents) for layer_parents in world]
+            for seed in range(world.shape[1]):
+                reachables = [get_activated_nodes(indptr, children, seed) for indptr, children in layer_children]
+                nodes = np.array(threshold_activated(reachables, threshold), dtype=np.int64)
+                counts.add_pairs(nodes, np.full(len(nodes), seed))
+        else:
+            raise ValueError(f"Unknown reach mode: {reach}")
+    return counts
+
+# A node is reached within h hops when at least the required number of layers reach it
+# within h hops
+def count_layer_horizon_batch(parents, threshold, horizons, reach, counts):
+    n_nodes = parents.shape[2]
+    required = required_layers(parents.shape[1], threshold)
+    max_hops = max((horizon for horizon in horizons if horizon is not None), default=0)
+    if max_hops and required <= parents.shape[1]:
+        for world in parents:
+            layer_pairs = [hop_pairs(layer_parents, max_hops) for layer_parents in world]
+            keys = np.concatenate([nodes * n_nodes + seeds for nodes, seeds, _ in layer_pairs])
+            hops = np.concatenate([layer_hops for _, _, layer_hops in layer_pairs])
+            for horizon, horizon_counts in zip(horizons, counts):
+                if horizon is not None:
+                    horizon_keys, layer_counts = np.unique(keys[hops <= horizon], return_counts=True)
+                    horizon_keys = horizon_keys[layer_counts >= required]
+                    horizon_counts.add_pairs(horizon_keys // n_nodes, horizon_keys % n_nodes)
+
+    for horizon, horizon_counts in zip(horizons, counts):
+        if horizon is None:
+            count_layer_batch(parents, threshold, reach, horizon_counts)
+    return counts
+
+# Independent cascade
+# Every edge is live on its own with probability equal to its weight, so a world is a general
+# digraph and a node can keep many live in-edges. The strongly connected components of a world
+# are condensed into a DAG whose components are grouped into levels by their longest path from
+# a source. The seeds reaching every component are bitsets pushed along the DAG one level at
+# a time, so a block of seeds takes one pass per world and layer. A node is reached when at
+# least the required number of layers reach it.
+CASCADE_EDGE_BUFFER_SIZE = 1 << 23
+CASCADE_BUFFER_SIZE = 1 << 22
+
+def count_cascade_layer_worlds(arrays_per_layer, n_worlds, threshold, rng, counts, sampling='mc', batch_size=WORLD_BATCH_SIZE):
+    n_nodes = len(arrays_per_layer[0]['indptr']) - 1
+    layer_targets = [np.repeat(np.arange(n_nodes), np.diff(arrays['indptr'])) for arrays in arrays_per_layer]
+    n_edges = sum(len(targets) for targets in layer_targets)
+    batch_size = max(1, min(batch_size, CASCADE_EDGE_BUFFER_SIZE // max(n_edges, 1)))
+    done = 0
+    progress = metrics.Progress(n_worlds)
+    layer_edges_count = [len(targets) for targets in layer_targets]
+    for uniforms in layer_uniform_batches(layer_edges_count, n_worlds, rng, sampling, batch_size):
+        # an edge is live on its own with probability equal to its weight
+        live_per_layer = [layer < arrays['weights'] for layer, arrays in zip(uniforms, arrays_per_layer)]
+        size = len(live_per_layer[0])
+        for world in range(size):
+            layer_edges = [
+                (arrays['sources'][live[world]], targets[live[world]])
+                for arrays, targets, live in zip(arrays_per_layer, layer_targets, live_per_layer)
+            ]
+            with metrics.phase('reachability'):
+                threshold_condensation_counts(layer_edges, n_nodes, threshold, counts)
+        done += size
+        progress.update(done)
+    return counts
+
+# Components of a world with the levels of their DAG, level 0 holds the sources, and the
+# DAG's in-edges grouped by head
+def condensation(sources, targets, n_nodes):
+    links = csr_matrix((np.ones(len(sources), dtype=np.int8), (sources, targets)), shape=(n_nodes, n_nodes))
+    n_components, labels = connected_components(links, directed=True, connection='strong')
+    tails, heads = labels[sources].astype(np.int64), labels[targets].astype(np.int64)
+    between = tails != heads
+    keys = np.unique(tails[between] * n_components + heads[between])
+    tails, heads = keys // n_components, keys % n_components
+
+    out_indptr = np.zeros(n_components + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=n_components), out=out_indptr[1:])
+    in_indptr = np.zeros(n_components + 1, dtype=np.int64)
+    np.cumsum(np.bincount(heads, minlength=n_components), out=in_indptr[1:])
+    # keys are sorted by tail already
+    out_heads = heads
+    in_tails = tails[np.argsort(heads, kind='stable')]
+
+    indegree = np.bincount(heads, minlength=n_components)
+    levels = []
+    frontier = np.flatnonzero(indegree == 0)
+    while len(frontier):
+        levels.append(frontier)
+        reached = out_heads[segments(out_indptr, frontier)]
+        np.subtract.at(indegree, reached, 1)
+        reached = np.unique(reached)
+        frontier = reached[indegree[reached] == 0]
+    return {'labels': labels, 'levels': levels, 'in_indptr': in_indptr, 'in_tails': in_tails}
+
+# Bit b of a component's mask is set when seeds[b] reaches it
+def ancestor_masks(condensed, seeds):
+    labels, in_indptr, in_tails = condensed['labels'], condensed['in_indptr'], condensed['in_tails']
+    bits = np.arange(len(seeds))
+    masks = np.zeros((len(in_indptr) - 1, (len(seeds) + 63) // 64), dtype=np.uint64)
+    np.bitwise_or.at(masks, (labels[seeds], bits // 64), np.left_shift(np.uint64(1), (bits % 64).astype(np.uint64)))
+    for level in condensed['levels'][1:]:
+        degrees = in_indptr[level + 1] - in_indptr[level]
+        updates = masks[in_tails[segments(in_indptr, level)]]
+        masks[level] |= np.bitwise_or.reduceat(updates, np.cumsum(degrees) - degrees, axis=0)
+    return masks
+
+def cascade_seed_blocks(n_nodes):
+    block = max(64, CASCADE_BUFFER_SIZE // 8 // n_nodes * 64)
+    return [np.arange(first, min(first + block, n_nodes)) for first in range(0, n_nodes, block)]
+
+# Reached (node, seed) pairs of a block of consecutive seeds, only the nonzero words of every
+# node are unpacked
+def cascade_pairs(condensed, seeds):
+    labels = condensed['labels']
+    masks = ancestor_masks(condensed, seeds)
+    nodes, words = np.nonzero(masks[labels])
+    bits = np.unpackbits(masks[labels[nodes], words].view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    hits, offsets = np.nonzero(bits)
+    return nodes[hits], seeds[0] + words[hits] * 64 + offsets
+
+def threshold_condensation_counts(layer_edges, n_nodes, threshold, counts):
+    required = required_layers(len(layer_edges), threshold)
+    if required > len(layer_edges):
+        return counts
+
+    condensed = [condensation(sources, targets, n_nodes) for sources, targets in layer_edges]
+    for seeds in cascade_seed_blocks(n_nodes):
+        keys = []
+        for layer in condensed:
+            nodes, pair_seeds = cascade_pairs(layer, seeds)
+            keys.append(nodes * n_nodes + pair_seeds)
+        keys, layers = np.unique(np.concatenate(keys), return_counts=True)
+        keys = keys[layers >= required]
+        counts.add_pairs(keys // n_nodes, keys % n_nodes)
+    return counts
+
+# Targeted queries
+# A slice of IA only needs the parents its walks look at. Parents are drawn lazily, once per
+# world and node, so walks from different targets or seeds in one world agree.
+def lazy_parents(arrays, n_worlds, rng):
+    n_nodes = len(arrays['indptr']) - 1
+    parents = np.full((n_worlds, n_nodes), -2, dtype=np.int32)
+
+    def parent(worlds, nodes):
+        missing = parents[worlds, nodes] == -2
+        if missing.any():
+            cells = np.unique(worlds[missing].astype(np.int64) * n_nodes + nodes[missing])
+            cell_worlds, cell_nodes = cells // n_nodes, cells % n_nodes
+            chosen = choose_node_parents(arrays, cell_nodes, rng.random(len(cells)))
+            parents[cell_worlds, cell_nodes] = np.where(chosen == cell_nodes, -1, chosen)
+        return parents[worlds, nodes].astype(np.int64)
+
+    return parent
+
+def out_edge_arrays(arrays):
+    n_nodes = len(arrays['indptr']) - 1
+    targets = np.repeat(np.arange(n_nodes), np.diff(arrays['indptr']))
+    order = np.argsort(arrays['sources'], kind='stable')
+
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(arrays['sources'], minlength=n_nodes), out=indptr[1:])
+    return indptr, targets[order]
+
+# Rows: every target walks up its parent chain with Brent's cycle check, and stops at a
+# parentless node or once it has gone around its cycle. Keys are walk * n_nodes + node,
+# with walk = world * n_targets + target index. parent(worlds, nodes) gives the parents, drawn
+# lazily here or read from stored worlds.
+def walk_keys(arrays, targets, n_worlds, rng):
+    return walk_parent_keys(lazy_parents(arrays, n_worlds, rng), len(arrays['indptr']) - 1, targets, n_worlds)
+
+def walk_parent_keys(parent, n_nodes, targets, n_worlds):
+    walks = np.arange(n_worlds * len(targets))
+    worlds = walks // len(targets)
+    tortoise = np.tile(np.asarray(targets, dtype=np.int64), n_worlds)
+    hare = parent(worlds, tortoise)
+    power = np.ones(len(walks), dtype=np.int64)
+    steps = np.ones(len(walks), dtype=np.int64)
+    keys = [walks * n_nodes + tortoise]
+
+    while len(walks):
+        live = hare >= 0
+        keys.append(walks[live] * n_nodes + hare[live])
+        live &= hare != tortoise
+        walks, worlds, tortoise, hare, power, steps = (
+            values[live] for values in (walks, worlds, tortoise, hare, power, steps)
+        )
+
+        restart = power == steps
+        tortoise = np.where(restart, hare, tortoise)
+        power = np.where(restart, power * 2, power)
+        steps = np.where(restart, 0, steps) + 1
+        hare = parent(worlds, hare)
+
+    return np.unique(np.concatenate(keys))
+
+# Columns: every seed grows its tree along out-edges whose child picked the current node as
+# its parent. A node has one parent, so the only way back is a cycle through the seed.
+def reach_keys(arrays, children, seeds, n_worlds, rng):
+    n_nodes = len(arrays['indptr']) - 1
+    indptr, out_targets = children
+    parent = lazy_parents(arrays, n_worlds, rng)
+
+    walks = np.arange(n_worlds * len(seeds))
+    roots = np.tile(np.asarray(seeds, dtype=np.int64), n_worlds)
+    nodes = roots
+    keys = [walks * n_nodes + nodes]
+
+    while len(walks):
+        degrees = indptr[nodes + 1] - indptr[nodes]
+        walks, roots, sources = np.repeat(walks, degrees), np.repeat(roots, degrees), np.repeat(nodes, degrees)
+        nodes = out_targets[segments(indptr, nodes)]
+
+        live = (parent(walks // len(seeds), nodes) == sources) & (nodes != roots)
+        walks, roots, nodes = walks[live], roots[live], nodes[live]
+        keys.append(walks * n_nodes + nodes)
+
+    return np.concatenate(keys)
+
+def layer_target_counts(arrays_per_layer, targets, n_worlds, threshold, rng, batch_size=WORLD_BATCH_SIZE):
+    n_nodes = len(arrays_per_layer[0]['indptr']) - 1
+    required = required_layers(len(arrays_per_layer), threshold)
+    counts = np.zeros(len(targets) * n_nodes, dtype=np.int64)
+    done = 0
+    progress = metrics.Progress(n_worlds)
+    while done < n_worlds:
+        size = min(batch_size, n_worlds - done)
+        keys = np.concatenate([walk_keys(arrays, targets, size, rng) for arrays in arrays_per_layer])
+        keys, layers = np.unique(keys, return_counts=True)
+        keys = keys[layers >= required]
+        counts += np.bincount((keys // n_nodes) % len(targets) * n_nodes + keys % n_nodes, minlength=len(counts))
+        done += size
+        progress.update(done)
+    return counts.reshape(len(targets), n_nodes)
+
+def layer_seed_counts(arrays_per_layer, seeds, n_worlds, threshold, rng, batch_size=WORLD_BATCH_SIZE):
+    n_nodes = len(arrays_per_layer[0]['indptr']) - 1
+    required = required_layers(len(arrays_per_layer), threshold)
+    layer_children = [out_edge_arrays(arrays) for arrays in arrays_per_layer]
+    counts = np.zeros(n_nodes * len(seeds), dtype=np.int64)
+    done = 0
+    progress = metrics.Progress(n_worlds)
+    while done < n_worlds:
+        size = min(batch_size, n_worlds - done)
+        keys = np.concatenate([
+            reach_keys(arrays, children, seeds, size, rng) for arrays, children in zip(arrays_per_layer, layer_children)
+        ])
+        keys, layers = np.unique(keys, return_counts=True)
+        keys = keys[layers >= required]
+        counts += np.bincount(keys % n_nodes * len(seeds) + (keys // n_nodes) % len(seeds), minlength=len(counts))
+        done += size
+        progress.update(done)
+    return counts.reshape(n_nodes, len(seeds))
+
+def threshold_activated(reachables, threshold):
+    id_counter = Counter()
+    for lst in reachables:
+        id_counter.update(lst)
+
+    return [id_ for id_, count in id_counter.items() if count / len(reachables) >= threshold]
@@ -0,0 +1,191 @@
+import os
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+from src import live_edge
+from src import accumulators
+from src import metrics
+
+# Shared memory
+def share(array):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+def attach(spec):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def release(blocks, unlink=False):
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
+
+def split_simulations(n_simulations, n_parts):
+    return [n_simulations // n_parts + (index < n_simulations % n_parts) for index in range(n_parts)]
+
+# Worker pool
+# Worker i draws from the i-th child of the run's SeedSequence, so a run with the same
+# seed and number of workers reproduces bit for bit, and a single worker runs in-process.
+# Dense workers count into their own shared buffer, memmap workers into their own file next
+# to the result, and sparse workers return their matrix. With a world bank worker i writes
+# its worlds to its own rows of the bank file. The model picks linear threshold ('lt') or
+# independent cascade ('ic') worlds. Workers send their phase timers back with their counts.
+def count_live_edge_worlds(arrays_per_layer, n_simulations, threshold, seed_sequence, n_workers, reach, accumulator='dense',
+                           path=None, sampling='mc', horizons=None, bank_path=None, model='lt'):
+    n_nodes = len(arrays_per_layer[0]['indptr']) - 1
+    n_workers = max(1, min(n_workers, n_simulations))
+    streams = seed_sequence.spawn(n_workers)
+    worlds = split_simulations(n_simulations, n_workers)
+
+    if n_workers == 1:
+        counts = create_counts(accumulator, n_nodes, worlds[0], path, horizons)
+        bank = open_bank(bank_path, 0, worlds[0])
+        live_edge.count_layer_worlds(arrays_per_layer, worlds[0], threshold, np.random.default_rng(streams[0]), reach, counts, sampling,
+                                     horizons, bank, model)
+        del bank
+        return results(counts)
+
+    blocks = []
+    array_specs = []
+    for arrays in arrays_per_layer:
+        layer_specs = {}
+        for name, array in arrays.items():
+            block, layer_specs[name] = share(array)
+            blocks.append(block)
+        array_specs.append(layer_specs)
+
+    count_specs = []
+    for index in range(n_workers):
+        if accumulator == 'dense':
+            shape = (n_nodes, n_nodes) if horizons is None else (len(horizons), n_nodes, n_nodes)
+            block, spec = share(np.zeros(shape, dtype=accumulators.count_dtype(worlds[index])))
+            blocks.append(block)
+            count_specs.append(spec)
+        elif accumulator == 'memmap':
+            count_specs.append(f'{path}.worker{index}')
+        else:
+            count_specs.append(None)
+
+    offsets = np.cumsum([0] + worlds)
+    try:
+        tasks = [
+            (array_specs, count_specs[index], worlds[index], threshold, streams[index], reach, accumulator, sampling, horizons,
+             bank_path, offsets[index], model)
+            for index in range(n_workers)
+        ]
+        with mp.Pool(n_workers) as pool:
+            partials = metrics.pool_map(pool, live_edge_worker, tasks)
+
+        counts = create_counts(accumulator, n_nodes, n_simulations, path, horizons)
+        for spec, result in zip(count_specs, partials):
+            if spec is None:
+                add(counts, result)
+                continue
+            if accumulator == 'memmap':
+                partial = np.load(spec, mmap_mode='r')
+                counts.add(partial)
+                del partial
+                os.remove(spec)
+                continue
+            block, partial = attach(spec)
+            add(counts, partial)
+            del partial
+            release([block])
+    finally:
+        release(blocks, unlink=True)
+
+    return results(counts)
+
+# Components
+# Weakly connected components of the union of all layers are independent runs and component
+# i draws from the i-th child of the run's SeedSequence. A component larger than a worker's
+# share of the nodes takes the whole pool, the others run in-process on the workers of one
+# pool, several per worker.
+def count_component_worlds(component_arrays, n_simulations, threshold, seed_sequence, n_workers, reach, accumulator='dense',
+                           sampling='mc'):
+    streams = seed_sequence.spawn(len(component_arrays))
+    sizes = np.array([len(arrays_per_layer[0]['indptr']) - 1 for arrays_per_layer in component_arrays])
+    large = sizes * n_workers > sizes.sum()
+    counts = [None] * len(component_arrays)
+
+    for index in np.flatnonzero(large):
+        counts[index] = count_live_edge_worlds(
+            component_arrays[index], n_simulations, threshold, streams[index], n_workers, reach, accumulator, sampling=sampling
+        )
+
+    small = np.flatnonzero(~large)
+    tasks = [
+        (component_arrays[index], n_simulations, threshold, streams[index], 1, reach, accumulator, None, sampling)
+        for index in small
+    ]
+    if n_workers == 1 or len(tasks) <= 1:
+        partials = [count_live_edge_worlds(*task) for task in tasks]
+    else:
+        with mp.Pool(min(n_workers, len(tasks))) as pool:
+            partials = metrics.pool_map(pool, count_live_edge_worlds, tasks, chunksize=max(1, len(tasks) // (4 * n_workers)))
+    for index, partial in zip(small, partials):
+        counts[index] = partial
+    return counts
+
+# Rows of the world bank written by one worker
+def open_bank(bank_path, offset, n_worlds):
+    if bank_path is None:
+        return None
+    return np.load(bank_path, mmap_mode='r+')[offset:offset + n_worlds]
+
+# Hop-limited runs keep one accumulator per horizon
+def create_counts(accumulator, n_nodes, n_simulations, path=None, horizons=None):
+    if horizons is None:
+        return accumulators.create(accumulator, n_nodes, n_simulations, path)
+    if accumulator == 'memmap':
+        raise ValueError('Hop-limited runs do not support the memmap accumulator!')
+    return [accumulators.create(accumulator, n_nodes, n_simulations) for _ in horizons]
+
+def add(counts, partial):
+    if isinstance(counts, list):
+        for horizon_counts, horizon_partial in zip(counts, partial):
+            horizon_counts.add(horizon_partial)
+    else:
+        counts.add(partial)
+
+def results(counts):
+    if isinstance(counts, list):
+        return [horizon_counts.result() for horizon_counts in counts]
+    return counts.result()
+
+def live_edge_worker(array_specs, count_spec, n_worlds, threshold, stream, reach, accumulator, sampling, horizons, bank_path=None,
+                     offset=0, model='lt'):
+    blocks = []
+    arrays_per_layer = []
+    for layer_specs in array_specs:
+        arrays = {}
+        for name, spec in layer_specs.items():
+            block, arrays[name] = attach(spec)
+            blocks.append(block)
+        arrays_per_layer.append(arrays)
+
+    if count_spec is None:
+        counts = create_counts(accumulator, len(arrays['indptr']) - 1, n_worlds, horizons=horizons)
+    elif accumulator == 'memmap':
+        counts = accumulators.MemmapCounts(count_spec, len(arrays['indptr']) - 1, accumulators.count_dtype(n_worlds))
+    else:
+        block, buffer = attach(count_spec)
+        blocks.append(block)
+        counts = accumulators.DenseCounts(buffer) if horizons is None else [accumulators.DenseCounts(part) for part in buffer]
+
+    bank = open_bank(bank_path, offset, n_worlds)
+    try:
+        live_edge.count_layer_worlds(arrays_per_layer, n_worlds, threshold, np.random.default_rng(stream), reach, counts, sampling,
+                                     horizons, bank, model)
+        result = results(counts)
+        return result if count_spec is None else None
+    finally:
+        del arrays, arrays_per_layer, counts, bank
+        if count_spec is not None and accumulator == 'dense':
+            del buffer
+        release(blocks)
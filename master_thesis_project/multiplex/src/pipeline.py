@@ -1,39 +1,274 @@
+import os
 import networkx as nx
 import numpy as np
+from numpy.lib.format import open_memmap
+from scipy.sparse import csr_matrix, diags, issparse
 import random
 from collections import deque
 from sklearn.cluster import KMeans
 from collections import Counter
+import time
 
 from src import utils
 from src import create_weights
+from src import live_edge
+from src import parallel
+from src import checkpoint
+from src import accumulators
+from src import components
+from src import world_bank
+from src import influence
+from src import blocks
+from src import metrics
 
-def run(dataset, type, n_simulations, threshold):
-    layers = utils.load_layers(dataset)
-    
-    if type == 'random':
-        w_layers = create_weights.w_random_multiple(layers)
-    elif type == 'uniform':
-        w_layers = create_weights.w_uniform_multiple(layers)
-    elif type == 'weighted':
-        w_layers = create_weights.w_weighted_multiple(layers)
-    elif type == 'trivalency':
-        w_layers = create_weights.w_trivalency_multiple(layers)
-
-    return live_edge_simulation(n_simulations, w_layers, threshold)
-
-def live_edge_simulation(n_simulations, layers, threshold):
+# Run features
+# What a live-edge run asks for besides plain sampling, the features each engine supports and the
+# pairs of features that cannot be combined; check_features tests a run against these tables.
+RUN_FEATURES = {
+    'ic': 'the independent cascade model',
+    'decompose': 'the component decomposition',
+    'horizons': 'hop horizons',
+    'bank': 'a world bank',
+    'blocks': 'block counts',
+    'chunked': 'checkpointed or adaptive runs',
+    'memmap': 'the memmap accumulator',
+}
+ENGINE_FEATURES = {
+    'array': set(RUN_FEATURES),
+    'networkx': set(),
+}
+FEATURE_CONFLICTS = [
+    *[('ic', feature) for feature in ('decompose', 'horizons', 'bank')],
+    *[('decompose', feature) for feature in ('horizons', 'bank', 'blocks', 'chunked', 'memmap')],
+    *[('blocks', feature) for feature in ('horizons', 'bank', 'chunked', 'memmap')],
+    *[('chunked', feature) for feature in ('horizons', 'bank', 'memmap')],
+]
+
+def run(dataset, type, n_simulations, threshold, **options):
+    w_layers = weighted_layers(dataset, type, options.get('seed'))
+    return live_edge_simulation(n_simulations, w_layers, threshold, **options)
+
+# IA rows of the targets and/or columns of the seeds, without the full matrix
+def query(dataset, type, n_simulations, threshold, targets=None, seeds=None, seed=None):
+    w_layers = weighted_layers(dataset, type, seed)
+    return query_simulation(n_simulations, w_layers, threshold, targets, seeds, seed)
+
+def query_simulation(n_simulations, layers, threshold, targets=None, seeds=None, seed=None):
+    if targets is None and seeds is None:
+        raise ValueError('A query needs target or seed nodes!')
+    # a seed given twice would share or skip an IA column
+    seeds = None if seeds is None else np.unique(seeds)
+
+    arrays_per_layer = live_edge.layer_arrays(layers)
+    rng = np.random.default_rng(np.random.SeedSequence(seed))
+    if targets is not None:
+        counts = live_edge.layer_target_counts(arrays_per_layer, targets, n_simulations, threshold, rng)
+        if seeds is not None:
+            counts = counts[:, seeds]
+    else:
+        counts = live_edge.layer_seed_counts(arrays_per_layer, seeds, n_simulations, threshold, rng)
+
+    return counts / n_simulations
+
+# Runs and queries on the worlds of a world bank, at any inter-layer threshold
+def replay_simulation(bank_path, threshold, reach='forest', accumulator='dense', memmap_path=None, horizons=None, stats=None):
+    start_time = time.time()
+
+    bank, manifest = world_bank.load(bank_path)
+    n_worlds = manifest['n_worlds']
+    counts = parallel.create_counts(accumulator, manifest['n_nodes'], n_worlds, memmap_path, horizons)
+    counts = parallel.results(world_bank.replay_counts(bank, threshold, reach, counts, horizons))
+    if stats is not None:
+        stats['replayed_worlds'] = n_worlds
+        stats['time_per_simulation'] = (time.time() - start_time) / n_worlds
+
+    if horizons is not None:
+        return [accumulators.probabilities(horizon_counts, n_worlds) for horizon_counts in counts]
+    return accumulators.probabilities(counts, n_worlds)
+
+def replay_query(bank_path, threshold, targets=None, seeds=None):
+    if targets is None and seeds is None:
+        raise ValueError('A query needs target or seed nodes!')
+    # a seed given twice would share or skip an IA column
+    seeds = None if seeds is None else np.unique(seeds)
+
+    bank, manifest = world_bank.load(bank_path)
+    if targets is not None:
+        counts = world_bank.target_counts(bank, targets, threshold)
+        if seeds is not None:
+            counts = counts[:, seeds]
+    else:
+        counts = world_bank.seed_counts(bank, seeds, threshold)
+
+    return counts / manifest['n_worlds']
+
+# Live-edge forests for seed set spreads and greedy seeds, sampled or from a world bank
+def influence_forests(dataset, type, n_worlds, seed=None, sampling='mc', bank_path=None):
+    if bank_path is not None:
+        return influence.world_forests(world_bank.load(bank_path)[0])
+
+    w_layers = weighted_layers(dataset, type, seed)
+    rng = np.random.default_rng(np.random.SeedSequence(seed))
+    return influence.sample_forests(live_edge.layer_arrays(w_layers), n_worlds, rng, sampling)
+
+# One slice of a run: shard i of N draws from the i-th child of the run's SeedSequence,
+# exactly like worker i of a single run with N workers, and returns raw counts.
+def run_shard(dataset, type, n_simulations, threshold, shard, n_shards, seed, reach='forest', n_workers=1, accumulator='dense',
+              sampling='mc'):
+    w_layers = weighted_layers(dataset, type, seed)
+
+    arrays_per_layer = live_edge.layer_arrays(w_layers)
+    stream = np.random.SeedSequence(seed).spawn(n_shards)[shard]
+    n_worlds = parallel.split_simulations(n_simulations, n_shards)[shard]
+
+    if n_workers == 1:
+        counts = accumulators.create(accumulator, len(w_layers[0].nodes()), n_worlds)
+        live_edge.count_layer_worlds(arrays_per_layer, n_worlds, threshold, np.random.default_rng(stream), reach, counts, sampling)
+        return counts.result()
+
+    return parallel.count_live_edge_worlds(arrays_per_layer, n_worlds, threshold, stream, n_workers, reach, accumulator,
+                                           sampling=sampling)
+
+def weighted_layers(dataset, type, seed=None):
+    return assign_layer_weights(utils.load_layers(dataset), type, seed)
+
+def assign_layer_weights(layers, type, seed=None):
+    # random and trivalency weights must match across shards and resumed runs
+    if seed is not None:
+        random.seed(seed)
+
+    with metrics.phase('weights'):
+        if type == 'random':
+            w_layers = create_weights.w_random_multiple(layers)
+        elif type == 'uniform':
+            w_layers = create_weights.w_uniform_multiple(layers)
+        elif type == 'weighted':
+            w_layers = create_weights.w_weighted_multiple(layers)
+        elif type == 'trivalency':
+            w_layers = create_weights.w_trivalency_multiple(layers)
+
+    return w_layers
+
+def live_edge_simulation(n_simulations, layers, threshold, engine='array', seed=None, reach='forest', n_workers=1, accumulator='dense',
+                         memmap_path=None, sampling='mc', horizons=None, checkpoint_folder=None, checkpoint_every=None,
+                         resume=False, extend_from=None, precision=None, error='max', time_budget=None, decompose=False, bank_path=None,
+                         n_blocks=None, blocks_folder=None, model='lt', checkpoint_run=None, stats=None):
+    chunked = checkpoint_folder is not None or precision is not None or time_budget is not None
+    check_features(engine, {
+        'ic': model == 'ic',
+        'decompose': decompose,
+        'horizons': horizons is not None,
+        'bank': bank_path is not None,
+        'blocks': n_blocks is not None,
+        'chunked': chunked,
+        'memmap': accumulator == 'memmap',
+    })
+    if engine == 'networkx':
+        return networkx_live_edge_simulation(n_simulations, layers, threshold)
+
+    start_time = time.time()
+
+    arrays_per_layer = live_edge.layer_arrays(layers)
+    if decompose:
+        return component_simulation(n_simulations, arrays_per_layer, threshold, seed, reach, n_workers, accumulator, sampling, stats)
+
+    if n_blocks is not None:
+        count_block = lambda n_worlds, stream: parallel.count_live_edge_worlds(
+            arrays_per_layer, n_worlds, threshold, stream, n_workers, reach, accumulator, sampling=sampling, model=model
+        )
+        counts = blocks.run(count_block, len(layers[0].nodes()), n_simulations, n_blocks, seed, blocks_folder)
+        if stats is not None:
+            stats['n_blocks'] = n_blocks
+    elif not chunked:
+        if bank_path is not None:
+            world_bank.create(bank_path, n_simulations, len(layers), len(arrays_per_layer[0]['indptr']) - 1,
+                              {'seed': seed, 'sampling': sampling})
+        counts = parallel.count_live_edge_worlds(
+            arrays_per_layer, n_simulations, threshold, np.random.SeedSequence(seed), n_workers, reach, accumulator,
+            memmap_path, sampling, horizons, bank_path, model
+        )
+    else:
+        count_chunk = lambda n_worlds, stream: parallel.count_live_edge_worlds(
+            arrays_per_layer, n_worlds, threshold, stream, n_workers, reach, accumulator, sampling=sampling, model=model
+        )
+        run_info = {
+            **(checkpoint_run or {}), 'threshold': threshold, 'sampling': sampling, 'model': model,
+            'n_nodes': len(layers[0].nodes()),
+        }
+        counts, n_simulations = checkpoint.run(
+            count_chunk, len(layers[0].nodes()), n_simulations, seed, checkpoint_folder, checkpoint_every, resume, extend_from,
+            precision, error, time_budget, stats, run_info
+        )
+
+    if stats is not None:
+        stats['time_per_simulation'] = (time.time() - start_time) / n_simulations
+        if model == 'ic':
+            stats['model'] = 'independent cascade'
+
+    if horizons is not None:
+        # one IA per hop horizon, all from the same worlds
+        return [accumulators.probabilities(horizon_counts, n_simulations) for horizon_counts in counts]
+    IA = accumulators.probabilities(counts, n_simulations)
+    return IA
+
+# Raises for the first feature of a run its engine lacks or that conflicts with another one
+def check_features(engine, requested):
+    if engine not in ENGINE_FEATURES:
+        raise ValueError(f"Unknown live-edge engine: {engine}!")
+    features = {feature for feature, used in requested.items() if used}
+    unsupported = sorted(features - ENGINE_FEATURES[engine])
+    if unsupported:
+        raise ValueError(f"The {engine} engine does not support {RUN_FEATURES[unsupported[0]]}!")
+    for first, second in FEATURE_CONFLICTS:
+        if first in features and second in features:
+            raise ValueError(f"{RUN_FEATURES[first].capitalize()} cannot be combined with {RUN_FEATURES[second]}!")
+
+# Solves every weakly connected component of the union of all layers on its own, exactly when
+# it has few worlds, and returns the block-diagonal IA as a sparse matrix
+def component_simulation(n_simulations, arrays_per_layer, threshold, seed=None, reach='forest', n_workers=1, accumulator='dense',
+                         sampling='mc', stats=None):
+    start_time = time.time()
+
+    parts = components.weak_components(arrays_per_layer)
+    part_arrays = [[components.component_arrays(arrays, nodes) for arrays in arrays_per_layer] for nodes in parts]
+    exact = [components.world_count(sub_arrays) <= components.EXACT_WORLDS for sub_arrays in part_arrays]
+    sampled = [index for index in range(len(parts)) if not exact[index]]
+    print(f"Components: {len(parts)}, {len(parts) - len(sampled)} solved exactly")
+
+    blocks = [components.exact_ia(sub_arrays, threshold) if is_exact else None for sub_arrays, is_exact in zip(part_arrays, exact)]
+    counts = parallel.count_component_worlds(
+        [part_arrays[index] for index in sampled], n_simulations, threshold, np.random.SeedSequence(seed), n_workers, reach,
+        accumulator, sampling
+    )
+    for index, component_counts in zip(sampled, counts):
+        blocks[index] = accumulators.probabilities(component_counts, n_simulations)
+    IA = components.block_diagonal(parts, blocks, len(arrays_per_layer[0]['indptr']) - 1)
+
+    if stats is not None:
+        stats.update({
+            'time_per_simulation': (time.time() - start_time) / n_simulations,
+            'n_components': len(parts),
+            'largest_component': int(max(len(nodes) for nodes in parts)),
+            'exact_components': len(parts) - len(sampled),
+        })
+    return IA
+
+# Reference simulator on networkx live-edge graphs
+def networkx_live_edge_simulation(n_simulations, layers, threshold):
     n_nodes = len(layers[0].nodes())
     IA = np.zeros((n_nodes, n_nodes))
 
+    progress = metrics.Progress(n_simulations)
     for i in range(n_simulations):
-        print(f'Simulation {i + 1}/{n_simulations} ...')
-        live_edge_graphs = create_live_edge_graphs(layers)
+        with metrics.phase('sampling'):
+            live_edge_graphs = create_live_edge_graphs(layers)
 
-        for seed in range(n_nodes):
-            activated_nodes = get_activated_nodes(live_edge_graphs, seed, threshold)
-            for node in activated_nodes:
-                IA[node][seed] += 1
+        with metrics.phase('reachability'):
+            for seed in range(n_nodes):
+                activated_nodes = get_activated_nodes(live_edge_graphs, seed, threshold)
+                for node in activated_nodes:
+                    IA[node][seed] += 1
+        progress.update(i + 1)
 
     IA /= n_simulations
     return IA
@@ -91,11 +326,22 @@ def get_activated_nodes(live_edge_graphs, seed, threshold):
     return [id_ for id_, count in id_counter.items() if count / len(reachables) >= threshold]
     
 # Clustering
-def clustering(n_clusters, IA):
-    # normalization
-    IA = normalize_offdiag(IA)
+def clustering(n_clusters, IA, normalization='offdiag'):
+    with metrics.phase('normalization'):
+        if normalization == 'scaled':
+            IA = normalize_scaled(IA)
+        else:
+            if issparse(IA):
+                IA = IA.toarray()
+
+            # normalization, next to the IA file when it is memory-mapped
+            out = None
+            if isinstance(IA, np.memmap):
+                out = open_memmap(f'{os.path.splitext(IA.filename)[0]}_normalized.npy', mode='w+', dtype=float, shape=IA.shape)
+            IA = normalize_offdiag(IA, out)
 
-    labels = KMeans(n_clusters=n_clusters, random_state=1, n_init='auto').fit_predict(IA)
+    with metrics.phase('kmeans'):
+        labels = KMeans(n_clusters=n_clusters, random_state=1, n_init='auto').fit_predict(IA)
 
     clusters = {}
     for node in range(len(labels)):
@@ -110,17 +356,39 @@ def clustering(n_clusters, IA):
     clusters = {key: clusters[key] for key in sorted(clusters)}
     return clusters
 
-def normalize_offdiag(A):
+# Statistics are per row, so rows are normalized one tile at a time
+def normalize_offdiag(A, out=None, tile_rows=None):
     n = A.shape[0]
-    B = A.copy().astype(float)
-    np.fill_diagonal(B, 0.0)
-    row_sum = B.sum(axis=1)
-    mu = row_sum / (n - 1)
+    if out is None:
+        out = np.empty(A.shape, dtype=float)
+    if tile_rows is None:
+        tile_rows = accumulators.tile_rows(n)
 
-    sq = ((B - mu[:,None])**2).sum(axis=1)
-    sigma = np.sqrt(sq / (n - 1))
-    sigma[sigma == 0] = 1.0
-    B = (B - mu[:,None]) / sigma[:,None]
-    np.fill_diagonal(B, 0.0)
+    for first, last in accumulators.tiles(n, tile_rows):
+        rows = np.arange(last - first)
+        B = np.array(A[first:last], dtype=float)
+        B[rows, first + rows] = 0.0
+        row_sum = B.sum(axis=1)
+        mu = row_sum / (n - 1)
+
+        sq = ((B - mu[:,None])**2).sum(axis=1)
+        sigma = np.sqrt(sq / (n - 1))
+        sigma[sigma == 0] = 1.0
+        B = (B - mu[:,None]) / sigma[:,None]
+        B[rows, first + rows] = 0.0
+        out[first:last] = B
+
+    return out
 
-    return B
\ No newline at end of file
+# Rows divided by their off-diagonal standard deviation without centering, which keeps the
+# block-diagonal IA of the component decomposition sparse
+def normalize_scaled(A):
+    n = A.shape[0]
+    B = csr_matrix(A, dtype=float)
+    B.setdiag(0.0)
+    B.eliminate_zeros()
+    mu = np.asarray(B.sum(axis=1)).ravel() / (n - 1)
+    sq = np.asarray(B.multiply(B).sum(axis=1)).ravel() / (n - 1)
+    sigma = np.sqrt(np.maximum(sq - mu**2, 0.0))
+    sigma[sigma == 0] = 1.0
+    return diags(1.0 / sigma) @ B
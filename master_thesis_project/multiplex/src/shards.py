@@ -0,0 +1,58 @@
+import glob
+import json
+import os
+import numpy as np
+
+from src import accumulators
+
+MANIFEST_KEYS = ['dataset', 'type', 'threshold', 'n_simulations', 'sampling', 'seed', 'n_shards']
+
+def shard_folder(output_folder):
+    return f'{output_folder}/shards'
+
+def write_shard(output_folder, counts, manifest):
+    folder = shard_folder(output_folder)
+    os.makedirs(folder, exist_ok=True)
+
+    name = f"shard_{manifest['shard']}_of_{manifest['n_shards']}"
+    accumulators.save_counts(f'{folder}/{name}', counts)
+    with open(f'{folder}/{name}.json', 'w') as file:
+        json.dump(manifest, file, indent=4)
+
+def read_manifests(output_folder):
+    manifests = []
+    for path in sorted(glob.glob(f'{shard_folder(output_folder)}/shard_*.json')):
+        with open(path, 'r') as file:
+            manifests.append(json.load(file))
+    return manifests
+
+def validate(manifests):
+    if not manifests:
+        raise ValueError('No shard manifests found!')
+
+    reference = manifests[0]
+    for manifest in manifests[1:]:
+        for key in MANIFEST_KEYS:
+            if manifest.get(key) != reference.get(key):
+                raise ValueError(f"Shard {manifest['shard']} has {key}={manifest.get(key)}, expected {reference.get(key)}")
+
+    indices = sorted(manifest['shard'] for manifest in manifests)
+    if indices != list(range(reference['n_shards'])):
+        missing = sorted(set(range(reference['n_shards'])) - set(indices))
+        raise ValueError(f'Shards are missing or duplicated, missing: {missing}')
+
+    if sum(manifest['shard_simulations'] for manifest in manifests) != reference['n_simulations']:
+        raise ValueError('Shard simulation counts do not add up to n_simulations!')
+
+    return reference
+
+def merge(output_folder):
+    manifests = read_manifests(output_folder)
+    reference = validate(manifests)
+
+    counts = None
+    for manifest in manifests:
+        partial = accumulators.load_counts(f"{shard_folder(output_folder)}/shard_{manifest['shard']}_of_{manifest['n_shards']}")
+        counts = accumulators.widen(partial, reference['n_simulations']) if counts is None else counts + partial
+
+    return counts, reference, manifests
@@ -2,6 +2,8 @@ import pickle
 import networkx as nx
 import random
 
+from src import metrics
+
 def load_pickle(path):
     with open(path, 'rb') as pickle_file:
         G = pickle.load(pickle_file)
@@ -12,6 +14,10 @@ def save_pickle(path, data):
         pickle.dump(data, file)
 
 def load_layers(dataset):
+    with metrics.phase('graph_load'):
+        return read_layers(dataset)
+
+def read_layers(dataset):
     if dataset == 'flickr':
         l0 = load_pickle('multiplex/data/graphs/flickr/flickr_friendship_graph')
         l1 = load_pickle('multiplex/data/graphs/flickr/flickr_tag_similarity_graph')
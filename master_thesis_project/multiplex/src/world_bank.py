@@ -0,0 +1,86 @@
+import os
+import json
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from src import live_edge
+from src import metrics
+
+# World bank
+# The sampled live-edge worlds of a run are kept as one int32 parent array per world and
+# layer, -1 for no parent, in a memory-mapped worlds.npy with the run's settings in
+# worlds.json next to it. Worlds do not depend on the inter-layer threshold, so replaying the
+# bank runs other thresholds, reach kernels, hop horizons or queries on the very same worlds
+# without sampling again.
+def create(path, n_worlds, n_layers, n_nodes, manifest):
+    bank = open_memmap(path, mode='w+', dtype=np.int32, shape=(n_worlds, n_layers, n_nodes))
+    with open(manifest_path(path), 'w') as file:
+        json.dump({**manifest, 'n_worlds': n_worlds, 'n_layers': n_layers, 'n_nodes': n_nodes}, file, indent=4)
+    del bank
+
+def manifest_path(path):
+    return f'{os.path.splitext(path)[0]}.json'
+
+def load(path):
+    with open(manifest_path(path)) as file:
+        manifest = json.load(file)
+    return np.load(path, mmap_mode='r'), manifest
+
+def batches(bank, batch_size=live_edge.WORLD_BATCH_SIZE):
+    for first in range(0, len(bank), batch_size):
+        yield np.asarray(bank[first:first + batch_size])
+
+# Full IA counts with any threshold, reach kernel and hop horizons
+def replay_counts(bank, threshold, reach, counts, horizons=None):
+    done = 0
+    progress = metrics.Progress(len(bank), 'Replay')
+    for parents in batches(bank):
+        with metrics.phase('reachability'):
+            if horizons is None:
+                live_edge.count_layer_batch(parents, threshold, reach, counts)
+            else:
+                live_edge.count_layer_horizon_batch(parents, threshold, horizons, reach, counts)
+        done += len(parents)
+        progress.update(done)
+    return counts
+
+# Stored parents for the walks of targeted queries, a self loop is no parent
+def stored_parents(parents):
+    def parent(worlds, nodes):
+        chosen = parents[worlds, nodes].astype(np.int64)
+        return np.where(chosen == nodes, -1, chosen)
+
+    return parent
+
+def target_counts(bank, targets, threshold):
+    n_layers, n_nodes = bank.shape[1:]
+    required = live_edge.required_layers(n_layers, threshold)
+    counts = np.zeros(len(targets) * n_nodes, dtype=np.int64)
+    for parents in batches(bank):
+        keys = np.concatenate([
+            live_edge.walk_parent_keys(stored_parents(parents[:, layer]), n_nodes, targets, len(parents))
+            for layer in range(n_layers)
+        ])
+        keys, layers = np.unique(keys, return_counts=True)
+        keys = keys[layers >= required]
+        counts += np.bincount((keys // n_nodes) % len(targets) * n_nodes + keys % n_nodes, minlength=len(counts))
+    return counts.reshape(len(targets), n_nodes)
+
+def seed_counts(bank, seeds, threshold):
+    n_layers, n_nodes = bank.shape[1:]
+    required = live_edge.required_layers(n_layers, threshold)
+    seeds = np.asarray(seeds, dtype=np.int64)
+    column = np.zeros(n_nodes, dtype=np.int64)
+    column[seeds] = np.arange(len(seeds))
+    counts = np.zeros(n_nodes * len(seeds), dtype=np.int64)
+    for parents in batches(bank):
+        keys = []
+        for world in parents:
+            layer_keys = []
+            for layer_parents in world:
+                nodes, pair_seeds = live_edge.descendant_pairs(*live_edge.forest(layer_parents), seeds)
+                layer_keys.append(nodes * len(seeds) + column[pair_seeds])
+            world_keys, layers = np.unique(np.concatenate(layer_keys), return_counts=True)
+            keys.append(world_keys[layers >= required])
+        counts += np.bincount(np.concatenate(keys), minlength=len(counts))
+    return counts.reshape(n_nodes, len(seeds))